@@ -0,0 +1,56 @@
+"""
+Config resolution: initialize() with and without an existing config dir,
+and setup_config_dir() on its own
+"""
+import contextlib
+import io
+
+import pytool
+
+
+# -----------------------------------------------------------------------------
+def bench_initialize(ctx):
+    """
+    Time initialize() when it has to set up the config dir, when the config
+    dir exists but this process hasn't loaded it, and when it has
+    """
+    def fresh():
+        stack = contextlib.ExitStack()
+        stack.enter_context(ctx.config_dir())
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        return stack
+
+    def timed(stack):
+        with stack:
+            pytool.initialize()
+
+    ctx.time("initialize.setup", timed, setup=fresh)
+
+    with ctx.config_dir():
+        with contextlib.redirect_stdout(io.StringIO()):
+            pytool.initialize()
+
+        def forget():
+            pytool._cfgctx.clear()
+
+        ctx.time("initialize.existing", lambda _: pytool.initialize(),
+                 setup=forget)
+        ctx.time("initialize.loaded", pytool.initialize)
+
+
+# -----------------------------------------------------------------------------
+def bench_setup_config_dir(ctx):
+    """
+    Time setup_config_dir() into a new config dir
+    """
+    def fresh():
+        stack = contextlib.ExitStack()
+        stack.enter_context(ctx.config_dir())
+        stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        return stack
+
+    def timed(stack):
+        with stack:
+            pytool.setup_config_dir()
+
+    ctx.time("setup_config_dir", timed, setup=fresh)
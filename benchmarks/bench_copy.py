@@ -0,0 +1,85 @@
+"""
+Big template assets: peak RSS and time of copier.copy_file() for sparse
+files of up to 4 GiB and dense ones of up to 512 MiB, copying in the kernel
+and through the fixed buffer. Each copy runs in a fresh interpreter so its
+peak RSS is its own; it should be the same whatever the file size.
+"""
+import os
+import subprocess
+import sys
+
+
+SPARSE_SIZES = (64 << 20, 1 << 30, 4 << 30)
+DENSE_SIZES = (64 << 20, 512 << 20)
+# a sparse file has EXTENT bytes of data every STRIDE bytes
+EXTENT = 1 << 20
+STRIDE = 64 << 20
+
+_CHILD = """
+import os, resource, sys, time
+if sys.argv[3] == 'buffered':
+    for name in ('copy_file_range', 'sendfile'):
+        if hasattr(os, name):
+            delattr(os, name)
+from pytool import copier
+start = time.perf_counter()
+copier.copy_file(sys.argv[1], sys.argv[2])
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(rss // 1024 if sys.platform == 'darwin' else rss, elapsed)
+"""
+
+
+# -----------------------------------------------------------------------------
+def bench_copy(ctx):
+    """
+    Record the peak RSS (KiB) and time of copying each file, both ways
+    """
+    for kind, sizes in (('sparse', SPARSE_SIZES), ('dense', DENSE_SIZES)):
+        for size in sizes:
+            names = ["copy.{}.{}.{}".format(kind, how, what)
+                     for how in ('kernel', 'buffered')
+                     for what in ('rss', 'time')]
+            if not any(ctx.wanted(x) for x in names):
+                continue
+            src = os.path.join(ctx.scratch("copy"), "src")
+            _write(src, size, sparse=(kind == 'sparse'))
+            for how in ('kernel', 'buffered'):
+                rss, times = [], []
+                for _ in range(ctx.repeat):
+                    peak, elapsed = _run(src, src + ".out", how)
+                    rss.append(peak)
+                    times.append(elapsed)
+                ctx.record("copy.{}.{}.rss".format(kind, how), rss, 'KiB',
+                           bytes=size)
+                ctx.record("copy.{}.{}.time".format(kind, how), times, 's',
+                           bytes=size)
+            os.unlink(src)
+
+
+# -----------------------------------------------------------------------------
+def _write(path, size, sparse):
+    """
+    Write a *size* byte file at *path*: all data, or a sparse file with an
+    EXTENT of data every STRIDE bytes
+    """
+    chunk = b"pytool copy benchmark data\n" * (EXTENT // 27 + 1)
+    chunk = chunk[:EXTENT]
+    with open(path, 'wb') as wbl:
+        wbl.truncate(size)
+        step = STRIDE if sparse else EXTENT
+        for offset in range(0, size, step):
+            wbl.seek(offset)
+            wbl.write(chunk[:size - offset])
+
+
+# -----------------------------------------------------------------------------
+def _run(src, dst, how):
+    """
+    Copy *src* to *dst* in a new interpreter, 'kernel' or 'buffered', and
+    return its (peak RSS in KiB, seconds copying)
+    """
+    out = subprocess.run([sys.executable, "-c", _CHILD, src, dst, how],
+                         stdout=subprocess.PIPE, check=True).stdout.split()
+    os.unlink(dst)
+    return (int(out[0]), float(out[1]))
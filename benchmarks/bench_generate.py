@@ -0,0 +1,78 @@
+"""
+Generation at scale: create_project() from synthetic template trees of
+ctx.sizes files, with file sizes from empty to 64 KiB, and the system calls
+it makes (as estimated by pytool.trace's est_syscalls)
+"""
+import contextlib
+import io
+import os
+import shutil
+
+import pytool
+from pytool import bench
+from pytool import manifest
+from pytool import trace
+
+
+# -----------------------------------------------------------------------------
+def bench_create_project(ctx):
+    """
+    Time create_project() for each tree size, copying and hard linking
+    """
+    for count in ctx.sizes:
+        with ctx.config_dir():
+            with contextlib.redirect_stdout(io.StringIO()):
+                cfg = pytool.initialize()
+            prjdir = os.path.join(cfg.get('pytool', 'templates_dir'),
+                                  "prjdir")
+            shutil.rmtree(prjdir)
+            bench.write_tree(prjdir, count)
+            pytool.template_tree(cfg)
+            out = []
+
+            def target():
+                # only keep one generated tree around at a time
+                for path in out:
+                    shutil.rmtree(path)
+                out[:] = [ctx.scratch("out")]
+                return os.path.join(out[0], "proj")
+
+            for link in ('copy', 'hard'):
+                ctx.time("create_project.{}".format(link),
+                         lambda trg: pytool.create_project(trg, cfg=cfg,
+                                                           link=link),
+                         setup=target, files=count)
+
+
+# -----------------------------------------------------------------------------
+def bench_create_project_est_syscalls(ctx):
+    """
+    Estimate the system calls create_project() makes for each tree size,
+    from pytool.trace's est_syscalls, with the template tree walked afresh
+    (cold) and with its manifest current (warm)
+    """
+    if not ctx.wanted("create_project.est_syscalls"):
+        return
+    for count in ctx.sizes:
+        with ctx.config_dir() as cdir:
+            with contextlib.redirect_stdout(io.StringIO()):
+                cfg = pytool.initialize()
+            prjdir = os.path.join(cfg.get('pytool', 'templates_dir'),
+                                  "prjdir")
+            shutil.rmtree(prjdir)
+            bench.write_tree(prjdir, count)
+            for walk in ('cold', 'warm'):
+                if walk == 'cold':
+                    manifest.invalidate()
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(manifest.manifest_path(
+                            os.path.abspath(prjdir), cdir))
+                trace.configure(os.devnull)
+                try:
+                    pytool.create_project(
+                        os.path.join(ctx.scratch("out"), "proj"), cfg=cfg)
+                    calls = trace.counters().get('est_syscalls', 0)
+                finally:
+                    trace.configure_from_env()
+                ctx.record("create_project.est_syscalls", [calls], 'calls',
+                           files=count, walk=walk)
@@ -0,0 +1,34 @@
+"""
+Startup: 'pytool version' and 'pytool help' in a fresh interpreter, cold
+(no compiled bytecode for pytool) and warm (bytecode already cached)
+"""
+import os
+import subprocess
+
+from pytool import bench
+
+
+# -----------------------------------------------------------------------------
+def bench_startup(ctx):
+    """
+    Time 'pytool version' and 'pytool help', cold and warm
+    """
+    with ctx.config_dir():
+        warm = ctx.scratch("pycache")
+        for cmd in ("version", "help"):
+            argv = bench.subprocess_argv(cmd)
+            ctx.time("startup.{}.cold".format(cmd),
+                     lambda prefix: _run(argv, prefix),
+                     setup=lambda: ctx.scratch("pycache"))
+            _run(argv, warm)
+            ctx.time("startup.{}.warm".format(cmd),
+                     lambda: _run(argv, warm))
+
+
+# -----------------------------------------------------------------------------
+def _run(argv, pycache):
+    """
+    Run *argv* with compiled bytecode kept under *pycache*
+    """
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache)
+    subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, check=True)
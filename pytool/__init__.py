@@ -2,26 +2,117 @@
 pytool - produce skeletons for python programs
 
 Usage:
+    pytool [--trace] apply [-d] [-j N] PLAN [ROOT]
+    pytool [--trace] batch [-d] [-j N] [--pool KIND] [FILE]
+    pytool bench [-d] [--suite DIR] [--sizes LIST] [--repeat N] [-k GLOB]
+                 [-o FILE] [--compare OLD]
+    pytool cache [-d] [--clear]
     pytool help [COMMAND]
-    pytool project [-d] PATH
-    pytool program [-d] PATH
-    pytool tool [-d] PATH
+    pytool [--client] [--trace] project [-d] [-j N] [--link MODE]
+                              [--profile NAME] [--var VAR]... [--update]
+                              [--plan FILE] [--archive KIND [-o FILE]] PATH
+    pytool [--client] [--trace] program [-d] [--link MODE] [--var VAR]... PATH
+    pytool [--client] [--trace] tool [-d] [--link MODE] [--var VAR]... PATH
+    pytool [--trace] pack-templates [-d]
+    pytool [--trace] store [-d] [NAME [DIR]]
+    pytool [--trace] serve [-d]
     pytool version [-d]
 
+Options:
+    --archive KIND  write the project to -o FILE as a tar, tar.gz, or zip
+                    archive instead of creating it
+    --clear         empty the local template cache
+    --client        hand the request to a running 'pytool serve', if any
+    --compare OLD   flag benchmarks slower than in report OLD
+    -d              run under the debugger
+    -j N, --jobs N  number of batch workers or copy threads [default: 4]
+    -k GLOB         run only the benchmarks whose names match GLOB
+    --link MODE     copy, hard, reflink, or auto [default: copy]
+    --update        rewrite only project files whose template changed
+    --var VAR       NAME=VALUE for {{NAME}} in the templates (repeatable)
+    -o FILE         write the benchmark report or archive to FILE
+                    [default: -]
+    --plan FILE     write the generation plan to FILE ('-' for stdout)
+                    instead of generating
+    --pool KIND     batch worker pool, 'process' or 'thread' [default: thread]
+    --profile NAME  generate from stored template profile NAME
+    --repeat N      times to run each benchmark [default: 3]
+    --sizes LIST    tree sizes to benchmark [default: 10,1000,10000,100000]
+    --suite DIR     directory of bench_*.py files
+    --trace         write timing spans as JSON lines to stderr (or to the
+                    file named by $PYTOOL_TRACE)
+
 ---
 pytool examples:
 
+    pytool apply demo.plan /srv/checkouts
+        Carry out the generation plan in demo.plan in /srv/checkouts
+        without reading the config or walking the templates
+
+    pytool batch FILE
+        Read JSON-lines jobs from FILE (or stdin) and run them on a worker
+        pool, reporting one JSON result line per job
+
+    pytool bench -o after.json --compare before.json
+        Run the benchmarks, write the results to after.json, and flag the
+        ones that are slower than in before.json
+
+    pytool cache
+        Report how full the local template cache (pytool.ini's [cache]
+        section) is
+
     pytool help
         Display this list of command descriptions
 
     pytool project PATH
         Create a python project in PATH
 
+    pytool project -j 8 PATH
+        Create a python project in PATH, copying up to 8 files at a time
+
+    pytool project --link auto PATH
+        Create a python project in PATH, cloning or hard linking template
+        files rather than copying them where that's safe
+
+    pytool project --var author="Ann Author" PATH
+        Create a python project in PATH, filling in {{author}} in the
+        templates with "Ann Author" ({{project}} is always the name)
+
+    pytool project --profile service PATH
+        Create a python project in PATH from the template profile stored
+        as 'service'
+
+    pytool project --archive tar.gz -o demo.tar.gz demo
+        Write a python project called demo straight into demo.tar.gz,
+        without creating it on disk first
+
+    pytool project --plan demo.plan PATH
+        Write what creating a python project in PATH would do to demo.plan
+        rather than doing it
+
+    pytool project --update PATH
+        Bring the project in PATH up to date with changed templates,
+        leaving files you've edited alone
+
     pytool program PATH
         Create a python program in PATH
 
     pytool tool PATH
         Create a new tool-style python program in PATH
+
+    PYTOOL_TRACE=trace.jsonl pytool project PATH
+        Create a python project in PATH, recording how long each phase
+        took and the bytes and system calls for each file in trace.jsonl
+
+    pytool pack-templates
+        Pack the templates directory into one memory-mapped bundle file
+
+    pytool store service ~/skeletons/service
+        Store the project template tree in ~/skeletons/service as profile
+        'service', sharing files it has in common with other profiles
+
+    pytool serve
+        Run a generation daemon on a Unix socket for 'pytool --client ...'
 ---
 
 Copyright (C) 1995 - <the end of time> Tom Barron
@@ -42,122 +133,806 @@ but WITHOUT ANY WARRANTY; without even the implied warranty of
 MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 GNU General Public License for more details.
 """
-import configparser
-from docopt_dispatch import dispatch
 import os
-import py
-import pdb
+import sys
+import threading
 from pytool.msgcat import mcat
+from pytool import trace
 from pytool import version
 
+# Subcommand handlers, filled in by @command(). Anything heavier than the
+# standard library basics is imported by the code that needs it, so that
+# 'pytool version' and 'pytool help' (and 'import pytool') stay quick.
+_commands = {}
+
+# The config context for this process: the environment the config dir was
+# resolved under, the pytool.ini path found there, and parsed configs keyed
+# by path. See initialize(), load_config(), and invalidate_config().
+# Threads generating at the same time take turns with it.
+_cfgctx = {}
+_cfglock = threading.RLock()
+
 
 # -----------------------------------------------------------------------------
-def main():
+def main(argv=None, out=None, err=None, stdin=None):
     """
-    Main entrypoint
+    Main entrypoint. *argv* is the command line without the program name
+    (default: sys.argv[1:]). The command writes its output to *out* and its
+    messages to *err*, and reads *stdin* (default: sys.stdout, sys.stderr,
+    and sys.stdin).
     """
-    dispatch(__doc__)
+    from docopt_dispatch import Dispatch
+    argv = sys.argv[1:] if argv is None else argv
+    args = argv[:argv.index('--')] if '--' in argv else argv
+    if '-h' in args or '--help' in args:
+        # what docopt does, but on *out*
+        print(__doc__.strip("\n"), file=out or sys.stdout)
+        sys.exit()
+    dispatch = Dispatch()
+    streams = {'out': out, 'err': err, 'stdin': stdin}
+    for name, func in _commands.items():
+        dispatch.on(name)(_common_options(func, streams))
+    dispatch(__doc__, argv=argv, help=False)
 
 
 # -----------------------------------------------------------------------------
-@dispatch.on('help')
+def _common_options(func, streams):
+    """
+    Wrap handler *func* to act on the options several commands share
+    (--trace) before it runs, and to hand it *streams* ('out', 'err', and
+    'stdin') along with its arguments
+    """
+    def wrapper(**kwa):
+        kwa.update(streams)
+        if kwa.get('trace'):
+            trace.configure_from_env(force=True, err=_streams(kwa)[1])
+        return func(**kwa)
+    return wrapper
+
+
+# -----------------------------------------------------------------------------
+def _streams(kwa):
+    """
+    Return the (out, err, stdin) streams for a handler called with *kwa*:
+    the ones main() was given, else sys.stdout, sys.stderr, and sys.stdin
+    """
+    return (kwa.get('out') or sys.stdout, kwa.get('err') or sys.stderr,
+            kwa.get('stdin') or sys.stdin)
+
+
+# -----------------------------------------------------------------------------
+def command(name):
+    """
+    Decorator registering a function as the handler for subcommand *name*
+    """
+    def decorator(func):
+        _commands[name] = func
+        return func
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+def _debug(kwa):
+    """
+    If -d was given, start the debugger in the calling handler
+    """
+    if kwa['d']:
+        import pdb
+        pdb.Pdb().set_trace(sys._getframe(1))
+
+
+# -----------------------------------------------------------------------------
+@command('apply')
+def apply_plan(**kwa):
+    """
+    Carry out a generation plan written by 'pytool project --plan'
+    """
+    _debug(kwa)
+    from pytool import plan
+    try:
+        if kwa['PLAN'] == '-':
+            gplan = plan.load(_streams(kwa)[2])
+        else:
+            with open(kwa['PLAN']) as rbl:
+                gplan = plan.load(rbl)
+    except ValueError as exc:
+        sys.exit("{}: {}".format(kwa['PLAN'], exc))
+    plan.apply(gplan, root=kwa['ROOT'], jobs=int(kwa['jobs']))
+
+
+# -----------------------------------------------------------------------------
+@command('batch')
+def run_batch(**kwa):
+    """
+    Run the JSON-lines jobs in FILE (or stdin) on a worker pool
+    """
+    _debug(kwa)
+    from pytool import batch
+    out, _, stdin = _streams(kwa)
+    initialize(out=out)
+    if kwa['FILE'] and kwa['FILE'] != '-':
+        with open(kwa['FILE']) as rbl:
+            failed = batch.run_batch(rbl, out=out, jobs=int(kwa['jobs']),
+                                     pool=kwa['pool'])
+    else:
+        failed = batch.run_batch(stdin, out=out, jobs=int(kwa['jobs']),
+                                 pool=kwa['pool'])
+    if failed:
+        sys.exit(1)
+
+
+# -----------------------------------------------------------------------------
+@command('bench')
+def run_bench(**kwa):
+    """
+    Run the benchmark suite and write a JSON report
+    """
+    _debug(kwa)
+    import json
+    from pytool import bench
+    out, err, _ = _streams(kwa)
+    sizes = [int(x) for x in kwa['sizes'].split(",") if x.strip()]
+    report = bench.run(kwa.get('suite'), sizes=sizes,
+                       repeat=int(kwa['repeat']), pattern=kwa.get('k'))
+    text = json.dumps(report, indent=1) + "\n"
+    if kwa['o'] in (None, '-'):
+        out.write(text)
+    else:
+        with open(kwa['o'], 'w') as wbl:
+            wbl.write(text)
+    if kwa.get('compare'):
+        with open(kwa['compare']) as rbl:
+            old = json.load(rbl)
+        for line in bench.compare(old, report):
+            print(line, file=err)
+
+
+# -----------------------------------------------------------------------------
+@command('cache')
+def report_cache(**kwa):
+    """
+    Report on (or with --clear, empty) the local template cache
+    """
+    _debug(kwa)
+    out = _streams(kwa)[0]
+    local = template_cache(initialize(out=out))
+    if local is None:
+        sys.exit(mcat['nocache'])
+    if kwa.get('clear'):
+        local.clear()
+    count, size = local.usage()
+    print("{}: {} files, {} bytes (max_size {})".format(local.root, count,
+                                                        size, local.limit),
+          file=out)
+
+
+# -----------------------------------------------------------------------------
+@command('help')
 def pytool_help(**kwa):
     """
     With a trailing COMMAND value, provide more info about that command
     """
-    if kwa['d']:
-        pdb.set_trace()
-    if 'program' == kwa['COMMAND']:
-        print(mcat['hlpprogtxt'])
+    _debug(kwa)
+    out = _streams(kwa)[0]
+    if 'batch' == kwa['COMMAND']:
+        print(mcat['hlpbatchtxt'], file=out)
+    elif 'apply' == kwa['COMMAND']:
+        print(mcat['hlpapplytxt'], file=out)
+    elif 'bench' == kwa['COMMAND']:
+        print(mcat['hlpbenchtxt'], file=out)
+    elif 'cache' == kwa['COMMAND']:
+        print(mcat['hlpcachetxt'], file=out)
+    elif 'pack-templates' == kwa['COMMAND']:
+        print(mcat['hlppacktxt'], file=out)
+    elif 'program' == kwa['COMMAND']:
+        print(mcat['hlpprogtxt'], file=out)
+    elif 'serve' == kwa['COMMAND']:
+        print(mcat['hlpservetxt'], file=out)
     elif 'project' == kwa['COMMAND']:
-        print(mcat['hlpprojtxt'])
+        print(mcat['hlpprojtxt'], file=out)
+    elif 'store' == kwa['COMMAND']:
+        print(mcat['hlpstoretxt'], file=out)
     elif 'tool' == kwa['COMMAND']:
-        print(mcat['hlptooltxt'])
+        print(mcat['hlptooltxt'], file=out)
     else:
         if kwa['COMMAND']:
-            print("{}: {}".format(mcat['unknown'], kwa['COMMAND']))
-        print(__doc__)
+            print("{}: {}".format(mcat['unknown'], kwa['COMMAND']), file=out)
+        print(__doc__, file=out)
 
 
 # -----------------------------------------------------------------------------
-@dispatch.on('project')
+@command('project')
 def make_project(**kwa):
     """
     Create a project directory
     """
-    if kwa['d']:
-        pdb.set_trace()
-    create_project(kwa['PATH'])
+    _debug(kwa)
+    out, err, _ = _streams(kwa)
+    if kwa.get('update'):
+        result = update_project(kwa['PATH'], cfg=initialize(out=out))
+        for key in ('written', 'conflicts'):
+            for path in result[key]:
+                print("{}: {}".format(mcat[key], path), file=out)
+        if result['conflicts']:
+            sys.exit(1)
+        return
+    _check_link(kwa)
+    if kwa.get('profile'):
+        try:
+            template_profile(kwa['profile'])
+        except (FileNotFoundError, ValueError) as exc:
+            sys.exit(str(exc))
+    if kwa.get('archive'):
+        _write_archive(kwa)
+        return
+    if kwa.get('plan'):
+        from pytool import plan
+        # the plan may go to stdout, so setup messages go to stderr
+        cfg = initialize(out=err)
+        gplan = plan_project(kwa['PATH'], cfg=cfg, link=kwa.get('link'),
+                             var=kwa.get('var'), profile=kwa.get('profile'))
+        if kwa['plan'] == '-':
+            plan.dump(gplan, out)
+        else:
+            with open(kwa['plan'], 'w') as wbl:
+                plan.dump(gplan, wbl)
+        return
+    opts = {'jobs': int(kwa['jobs']), 'link': kwa.get('link'),
+            'profile': kwa.get('profile'), 'var': kwa.get('var')}
+    if not _via_daemon(kwa, mcat['project'], opts):
+        create_project(kwa['PATH'], cfg=initialize(out=out), **opts)
+
+
+# -----------------------------------------------------------------------------
+def _check_link(kwa):
+    """
+    Exit with a message, before anything is written, if --link isn't one of
+    copier.LINK_MODES
+    """
+    from pytool import copier
+    try:
+        copier.check_link(kwa.get('link'))
+    except ValueError as exc:
+        sys.exit(str(exc))
 
 
 # -----------------------------------------------------------------------------
-@dispatch.on('program')
+def _write_archive(kwa):
+    """
+    Generate the project named by PATH into an archive of kind --archive on
+    -o FILE (or stdout)
+    """
+    from pytool import fs
+    if kwa['archive'] not in fs.ARCHIVE_KINDS:
+        sys.exit("{}: '{}'".format(mcat['badarch'], kwa['archive']))
+    name = os.path.basename(os.path.abspath(kwa['PATH']))
+    stdout, stderr, _ = _streams(kwa)
+    tostdout = kwa['o'] in (None, '-')
+    if tostdout:
+        out = getattr(stdout, 'buffer', None)
+        if out is None:
+            sys.exit(mcat['textout'])
+        # nothing but the archive may go to stdout
+        cfg = initialize(out=stderr)
+        stdout.flush()
+    else:
+        cfg = initialize(out=stdout)
+        out = open(kwa['o'], 'wb')
+    try:
+        afs = fs.ArchiveFS(out, kwa['archive'])
+        # one file at a time, so members go out in the same order each run
+        create_project(name, cfg=cfg, jobs=1, link=kwa.get('link'),
+                       var=kwa.get('var'), fs=afs,
+                       profile=kwa.get('profile'))
+        afs.close()
+    finally:
+        if tostdout:
+            out.flush()
+        else:
+            out.close()
+
+
+# -----------------------------------------------------------------------------
+@command('program')
 def make_program(**kwa):
     """
     Create a program file
     """
-    if kwa['d']:
-        pdb.set_trace()
-    create_prog_tool(mcat['prog_py'], kwa['PATH'])
+    _debug(kwa)
+    _check_link(kwa)
+    opts = {'link': kwa.get('link'), 'var': kwa.get('var')}
+    if not _via_daemon(kwa, mcat['program'], opts):
+        create_prog_tool(mcat['prog_py'], kwa['PATH'],
+                         cfg=initialize(out=_streams(kwa)[0]), **opts)
 
 
 # -----------------------------------------------------------------------------
-@dispatch.on('tool')
+@command('tool')
 def make_tool(**kwa):
     """
     Create a tool
     """
-    if kwa['d']:
-        pdb.set_trace()
-    create_prog_tool(mcat['tool_py'], kwa['PATH'])
+    _debug(kwa)
+    _check_link(kwa)
+    opts = {'link': kwa.get('link'), 'var': kwa.get('var')}
+    if not _via_daemon(kwa, mcat['tool'], opts):
+        create_prog_tool(mcat['tool_py'], kwa['PATH'],
+                         cfg=initialize(out=_streams(kwa)[0]), **opts)
 
 
 # -----------------------------------------------------------------------------
-def create_prog_tool(src, trg):
+@command('pack-templates')
+def pack_templates(**kwa):
     """
-    Create a program or tool
+    Pack the templates directory into a bundle in the config dir
     """
-    cfg = initialize()
-    tmpldir = py.path.local(cfg.get(mcat['pytool'], 'templates_dir'))
-    pysrc = tmpldir.join(src)
-    pytrg = py.path.local(trg)
-    pysrc.copy(pytrg)
+    _debug(kwa)
+    from pytool import bundle
+    out = _streams(kwa)[0]
+    cfg = initialize(out=out)
+    cdir, _ = cfgdir()
+    roots = template_layers(cfg).roots
+    if len(roots) != 1:
+        sys.exit(mcat['layered'])
+    path = os.path.join(cdir, mcat['bundle'])
+    count, size = bundle.pack(roots[0], path, cachedir=cdir)
+    print("{} {} files ({} bytes) into {}".format(mcat['packed'], count,
+                                                  size, path), file=out)
+
+
+# -----------------------------------------------------------------------------
+@command('store')
+def store_profile(**kwa):
+    """
+    Store a project template tree as a named profile, or list the profiles
+    """
+    _debug(kwa)
+    from pytool import compress
+    from pytool import manifest
+    from pytool import store
+    out = _streams(kwa)[0]
+    cfg = initialize(out=out)
+    cdir, _ = cfgdir()
+    root = os.path.join(cdir, mcat['store'])
+    if not kwa['NAME']:
+        for name in store.names(root):
+            print(name, file=out)
+        return
+    srcdir = kwa['DIR']
+    if srcdir is None:
+        tmpl = template_layers(cfg)
+        tree = tmpl.tree("prjdir")
+
+        def source_of(relpath):
+            return tmpl.source(os.path.join("prjdir", relpath))
+    elif os.path.isdir(srcdir):
+        tree = manifest.load(srcdir, cachedir=cdir)
+
+        def source_of(relpath):
+            return os.path.join(srcdir, relpath)
+    else:
+        sys.exit("{} {}".format(srcdir, mcat['notdir']))
+    try:
+        ext = compress.configured(cfg)
+    except ValueError as exc:
+        sys.exit(str(exc))
+    count, added, size = store.save(root, kwa['NAME'], tree, source_of,
+                                    ext=ext)
+    print("{} {} files as profile '{}' ({} new, {} bytes)".format(
+        mcat['stored'], count, kwa['NAME'], added, size), file=out)
+
+
+# -----------------------------------------------------------------------------
+@command('serve')
+def run_server(**kwa):
+    """
+    Run the generation daemon until interrupted
+    """
+    _debug(kwa)
+    from pytool import server
+    server.serve(out=_streams(kwa)[0])
 
 
 # -----------------------------------------------------------------------------
-def create_project(trgdir_s):
+def _via_daemon(kwa, cmd, options=None):
     """
-    Create directory if it doesn't exist, then populate the template files
+    With --client, hand the request to a running 'pytool serve' and return
+    True. Return False if --client wasn't given or no daemon is listening,
+    and the caller should do the work itself.
     """
-    cfg = initialize()
-    tmpldir = py.path.local(cfg.get(mcat['pytool'], 'templates_dir'))
-    prjdir = tmpldir.join("prjdir")
+    if not kwa.get('client'):
+        return False
+    from pytool import server
+    result = server.request({'command': cmd,
+                             'path': os.path.abspath(kwa['PATH']),
+                             'options': options or {}})
+    if result is None:
+        return False
+    if not result['ok']:
+        sys.exit(result['error'])
+    return True
 
-    trgdir = py.path.local(trgdir_s)
-    pdir = trgdir.join(trgdir.basename)
 
-    for item in prjdir.visit(rec=True):
-        relpath = item.strpath.replace(prjdir.strpath, "")
-        trg = trgdir.join(relpath.replace('prjdir', pdir.basename))
-        if item.isfile():
-            py.path.local(trg.dirname).ensure(dir=True)
-            item.copy(trg)
-        elif item.isdir():
-            trg.ensure(dir=True)
+# -----------------------------------------------------------------------------
+def generate(kind, name, cfg=None, var=None):
+    """
+    Generate a 'project', 'program', or 'tool' called *name* in memory and
+    return the result as a dict mapping each file's path (starting with
+    *name*) to its content as bytes. Nothing is written to disk. *var* is as
+    for create_project().
+    """
+    from pytool import fs
+    mem = fs.MemoryFS()
+    if kind == mcat['project']:
+        create_project(name, cfg=cfg, var=var, fs=mem)
+    elif kind == mcat['program']:
+        create_prog_tool(mcat['prog_py'], name, cfg=cfg, var=var, fs=mem)
+    elif kind == mcat['tool']:
+        create_prog_tool(mcat['tool_py'], name, cfg=cfg, var=var, fs=mem)
+    else:
+        raise ValueError("{}: {}".format(mcat['badjob'], kind))
+    return mem.files
 
 
 # -----------------------------------------------------------------------------
-@dispatch.on('version')
+@trace.spanned('create_prog_tool')
+def create_prog_tool(src, trg, cfg=None, link=None, var=None, fs=None):
+    """
+    Create a program or tool. A caller that has already loaded the config
+    can pass it in as *cfg*. *link* is one of copier.LINK_MODES. Placeholders
+    in the template are filled in (see pytool.render) from the config, *var*
+    (a dict or list of 'NAME=VALUE'), and the program's name. The file is
+    written through filesystem backend *fs* (see pytool.fs), by default the
+    local filesystem.
+    """
+    from pytool import compress
+    from pytool import copier
+    from pytool import render
+    from pytool.fs import LocalFS
+    copier.check_link(link)
+    cfg = cfg or initialize()
+    fs = fs or LocalFS()
+    bufsize = _copy_buffer(cfg)
+    tmpl = template_layers(cfg)
+
+    def exists(relpath):
+        try:
+            return os.path.exists(tmpl.source(relpath))
+        except FileNotFoundError:
+            return False
+    src = compress.find(src, exists)
+    pysrc = tmpl.source(src)
+    name = os.path.splitext(os.path.basename(trg))[0]
+    variables = render.variables(cfg, name, var)
+    bnd = None
+    if link in (None, 'copy') and not compress.suffix(src):
+        bnd = template_bundle(cfg)
+    local = None if bnd else template_cache(cfg)
+    if local:
+        run = local.begin()
+        pysrc = local.fetch(pysrc)
+    plan = bnd.plan(src) if bnd else render.plan_for_file(pysrc)
+    if plan:
+        fs.render(plan, trg, variables)
+    elif bnd:
+        fs.write(trg, bnd.data(src))
+    else:
+        fs.place(pysrc, trg, link=link or 'copy', bufsize=bufsize)
+    if local:
+        local.trim(run)
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('create_project')
+def create_project(trgdir_s, cfg=None, tree=None, jobs=None, link=None,
+                   var=None, fs=None, profile=None):
+    """
+    Create directory if it doesn't exist, then populate the template files.
+    A caller generating many projects can pass in the loaded config as *cfg*
+    and the result of template_tree() as *tree* to avoid reloading them.
+    Directories are created first, then the files are written, up to *jobs*
+    at a time. Templates with placeholders are rendered (see pytool.render)
+    with variables from the config, *var* (a dict or list of 'NAME=VALUE'),
+    and the project name. The rest are copied, from the bundle if the
+    templates have been packed, unless *link* (one of copier.LINK_MODES)
+    asks for them to be linked to the template files. A generation manifest
+    is left in the project for update_project(). Everything is written
+    through filesystem backend *fs* (see pytool.fs), by default the local
+    filesystem. With *profile*, the templates come from that stored
+    profile (see pytool.store) instead of the templates directory.
+    """
+    from pytool import copier
+    pairs, emit, finish = prepare_project(trgdir_s, cfg=cfg, tree=tree,
+                                          link=link, var=var, fs=fs,
+                                          profile=profile)
+    jobs = jobs or copier.DEFAULT_JOBS
+    with trace.span('copy', files=len(pairs), jobs=jobs):
+        copier.run_pool(emit, pairs, jobs=jobs)
+    with trace.span('record'):
+        finish(jobs)
+
+
+# -----------------------------------------------------------------------------
+def prepare_project(trgdir_s, cfg=None, tree=None, link=None, var=None,
+                    fs=None, profile=None):
+    """
+    Do the first part of create_project(): load what's needed and create the
+    project's directories. Return (pairs, emit, finish), where the caller
+    calls *emit(src, dst)* (in any order, on any thread) to write each file
+    in *pairs*, then *finish(jobs)* to write the generation manifest.
+    """
+    from pytool import compress
+    from pytool import copier
+    from pytool import render
+    from pytool import update
+    from pytool.fs import LocalFS
+    copier.check_link(link)
+    cfg = cfg or initialize()
+    fs = fs or LocalFS()
+    bufsize = _copy_buffer(cfg)
+    bnd = prof = None
+    if profile:
+        prof = template_profile(profile)
+        tree = prof.tree()
+    elif link in (None, 'copy'):
+        bnd = template_bundle(cfg)
+    if tree is None:
+        tree = bnd.tree("prjdir") if bnd else template_tree(cfg)
+    tmpl = template_layers(cfg)
+
+    # the name comes from the full path ('.' names the current dir) but the
+    # files are written under the path as given, so it can stay relative
+    trgdir = os.path.normpath(trgdir_s)
+    name = os.path.basename(os.path.abspath(trgdir_s))
+    variables = render.variables(cfg, name, var)
+
+    # the tree lists each directory ahead of its contents, so dirs does too
+    dirs = [trgdir]
+    pairs = []
+    generated = []
+    with trace.span('mkdir'):
+        for entry in tree:
+            relpath = project_relpath(entry.path, name)
+            trg = os.path.join(trgdir, relpath)
+            if entry.isdir:
+                dirs.append(trg)
+                continue
+            generated.append((entry.path, relpath))
+            if prof:
+                pairs.append((prof.source(entry.path), trg))
+            elif bnd and compress.suffix(entry.path):
+                # decompressed from the templates dir, not the bundle
+                pairs.append((os.path.join(bnd.root, "prjdir", entry.path),
+                              trg))
+            elif bnd:
+                pairs.append(("prjdir/" + entry.path, trg))
+            else:
+                pairs.append((tmpl.source(os.path.join("prjdir",
+                                                       entry.path)), trg))
+        fs.makedirs_tree(dirs)
+
+    # (template hash, file hash) for each file written, by target path
+    digests = {}
+    local = None if bnd else template_cache(cfg)
+    run = local.begin() if local else None
+
+    def emit(src, dst):
+        inbnd = bnd and not compress.suffix(src)
+        if local:
+            src = local.fetch(src)
+        plan = bnd.plan(src) if inbnd else render.plan_for_file(src)
+        # the hashes come from the template and the rendered pieces, so
+        # nothing written has to be read back
+        if inbnd:
+            digest = update.cached_digest(
+                (bnd.path, src), bnd.stamp,
+                lambda: update.data_hash(bnd.data(src)))
+        else:
+            digest = update.template_digest(src)
+        if plan:
+            digests[dst] = (digest, update.render_hash(plan, variables))
+            return fs.render(plan, dst, variables)
+        digests[dst] = (digest, digest)
+        if inbnd:
+            return fs.write(dst, bnd.data(src))
+        return fs.place(src, dst, link=link or 'copy', bufsize=bufsize)
+
+    def finish(jobs):
+        update.record(trgdir, generated, variables,
+                      {os.path.relpath(dst, trgdir): pair
+                       for dst, pair in digests.items()},
+                      jobs=jobs, fs=fs, profile=profile)
+        if local:
+            local.trim(run)
+
+    return pairs, emit, finish
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('plan_project')
+def plan_project(trgdir_s, cfg=None, tree=None, link=None, var=None,
+                 profile=None):
+    """
+    Work out what create_project() with the same arguments would do and
+    return it as a pytool.plan.Plan for plan.apply() to carry out later.
+    Nothing is written. Templates are named by the files holding them, so
+    the plan doesn't depend on the bundle or the local template cache.
+    """
+    from pytool import copier
+    from pytool import plan
+    from pytool import render
+    copier.check_link(link)
+    cfg = cfg or initialize()
+    if profile:
+        prof = template_profile(profile)
+        tree, source = prof.tree(), prof.source
+    else:
+        tmpl = template_layers(cfg)
+        if tree is None:
+            tree = tmpl.tree("prjdir")
+
+        def source(relpath):
+            return tmpl.source(os.path.join("prjdir", relpath))
+
+    trgdir = os.path.abspath(trgdir_s)
+    name = os.path.basename(trgdir)
+    ops = []
+    for entry in tree:
+        target = os.path.join(name, project_relpath(entry.path, name))
+        if entry.isdir:
+            ops.append(plan.Op('mkdir', target, None, None))
+            continue
+        src = os.path.abspath(source(entry.path))
+        kind = 'render' if render.plan_for_file(src) else 'copy'
+        ops.append(plan.Op(kind, target, entry.path, src))
+    return plan.Plan(name, os.path.dirname(trgdir),
+                     render.variables(cfg, name, var), link or 'copy',
+                     profile, ops)
+
+
+# -----------------------------------------------------------------------------
+def _copy_buffer(cfg):
+    """
+    Return the size of the buffer for copies done in Python (see
+    pytool.copier) from copy_buffer in pytool.ini, or the default if it
+    isn't set
+    """
+    from pytool import cache
+    from pytool import copier
+    value = cfg.get(mcat['pytool'], 'copy_buffer', fallback=None)
+    return max(4096, cache.parse_size(value)) if value else copier.BUFSIZE
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('update_project')
+def update_project(trgdir_s, cfg=None):
+    """
+    Rewrite the files in the project at *trgdir_s* whose templates have
+    changed since it was generated, unless they've been edited since. Return
+    a dict listing the project paths 'written', 'conflicts' (edited files
+    whose templates changed), and 'unchanged'. A project generated from a
+    profile is updated from that profile.
+    """
+    from pytool import render
+    from pytool import update
+    cfg = cfg or initialize()
+    trgdir = os.path.abspath(trgdir_s)
+    name = os.path.basename(trgdir)
+    profile = update.read_manifest(trgdir)['profile']
+    if profile:
+        prof = template_profile(profile)
+        tree, source = prof.tree(), prof.source
+    else:
+        tmpl = template_layers(cfg)
+        tree = tmpl.tree("prjdir")
+
+        def source(relpath):
+            return tmpl.source(os.path.join("prjdir", relpath))
+    local = template_cache(cfg)
+    run = local.begin() if local else None
+
+    def source_of(relpath):
+        return local.fetch(source(relpath)) if local else source(relpath)
+    rval = update.update_project(trgdir, source_of, tree,
+                                 lambda relpath: project_relpath(relpath,
+                                                                 name),
+                                 render.variables(cfg, name),
+                                 bufsize=_copy_buffer(cfg))
+    if local:
+        local.trim(run)
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def project_relpath(relpath, name):
+    """
+    Map the path of a project template to the path of the file generated
+    from it in project *name*: each 'prjdir' becomes *name*, and a
+    compression suffix is dropped (see pytool.compress)
+    """
+    from pytool import compress
+    return compress.strip(relpath.replace('prjdir', name))
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('template_tree')
+def template_tree(cfg):
+    """
+    Return the manifest of the project template directory: a list of
+    manifest.Entry tuples, each directory ahead of its contents. The
+    manifest is cached in the config dir and only rebuilt when a directory
+    in the template tree changes. With several template layers, it's the
+    merged tree.
+    """
+    return template_layers(cfg).tree("prjdir")
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('template_layers')
+def template_layers(cfg):
+    """
+    Return the templates in the directories named by templates_dir, as a
+    pytool.layers Single or (for several layers) merged Index
+    """
+    from pytool import layers
+    cdir, _ = cfgdir()
+    return layers.load(layers.split(cfg.get(mcat['pytool'], 'templates_dir'),
+                                    cdir), cachedir=cdir)
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('template_bundle')
+def template_bundle(cfg):
+    """
+    Return the packed template bundle (see 'pytool pack-templates'), brought
+    up to date with the templates directory, or None if the templates
+    haven't been packed. Layered templates are never read from a bundle.
+    """
+    from pytool import bundle
+    cdir, _ = cfgdir()
+    roots = template_layers(cfg).roots
+    if len(roots) != 1:
+        return None
+    return bundle.current(roots[0], os.path.join(cdir, mcat['bundle']),
+                          cachedir=cdir)
+
+
+# -----------------------------------------------------------------------------
+def template_cache(cfg):
+    """
+    Return the local template cache set up in pytool.ini's [cache] section
+    (see pytool.cache), or None if there isn't one
+    """
+    from pytool import cache
+    cdir, _ = cfgdir()
+    return cache.get(cfg, cdir)
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('template_profile')
+def template_profile(name):
+    """
+    Return template profile *name* from the store in the config dir (see
+    'pytool store')
+    """
+    from pytool import store
+    cdir, _ = cfgdir()
+    return store.load(os.path.join(cdir, mcat['store']), name)
+
+
+# -----------------------------------------------------------------------------
+@command('version')
 def show_version(**kwa):
     """
     Report the current version
     """
-    if kwa['d']:
-        pdb.set_trace()
-    print("pytool version {}".format(version.__version__))
+    _debug(kwa)
+    print("pytool version {}".format(version.__version__),
+          file=_streams(kwa)[0])
 
 
 # -----------------------------------------------------------------------------
+@trace.spanned('cfgdir')
 def cfgdir():
     """
     This function's task is to return the path of the configuration dir. If env
@@ -183,6 +958,7 @@ def cfgdir():
 
 
 # -----------------------------------------------------------------------------
+@trace.spanned('ini_path')
 def ini_path():
     """
     The task for this function is to return the path of an existing pytool.ini
@@ -190,101 +966,276 @@ def ini_path():
     FileNotFoundError.
     """
     (cdir, _) = cfgdir()
-    fpath = py.path.local(os.path.join(cdir, mcat['ptini']))
-    if fpath.exists():
-        return fpath.strpath
+    fpath = os.path.join(cdir, mcat['ptini'])
+    if os.path.exists(fpath):
+        return fpath
     else:
         raise FileNotFoundError("{}: '{}'".format(mcat['nosuch'], fpath))
 
 
 # -----------------------------------------------------------------------------
-def initialize():
+@trace.spanned('initialize')
+def initialize(out=None):
     """
-    Find the path of pytool.ini if it exists
+    Find the path of pytool.ini, setting up the config dir if it doesn't
+    exist yet (telling the user so on *out*, by default sys.stdout), and
+    return the loaded config. The path is remembered for the life of the
+    process (as long as PYTOOL_DIR and HOME don't change) and the parsed
+    config is reused until pytool.ini changes, so callers can call this as
+    often as they like.
     """
-    try:
-        ptini = ini_path()
-    except FileNotFoundError:
-        setup_config_dir()
+    env = (os.getenv(mcat['ptdir']), os.getenv(mcat['uchome']))
+    with _cfglock:
+        if _cfgctx.get('env') == env:
+            ptini = _cfgctx['ini']
+        else:
+            try:
+                ptini = ini_path()
+            except FileNotFoundError:
+                setup_config_dir(out=out)
+                ptini = ini_path()
+
+        try:
+            cfg = load_config(ptini)
+        except FileNotFoundError:
+            # pytool.ini went away since we last looked -- start over
+            invalidate_config()
+            return initialize(out)
+        _cfgctx.update(env=env, ini=ptini)
+        return cfg
+
 
-    ptini = ini_path()
-    cfg = load_config(ptini)
-    return cfg
+# -----------------------------------------------------------------------------
+def invalidate_config():
+    """
+    Forget the remembered config dir and parsed config, and remove the
+    parsed sidecar for the current pytool.ini so the next load re-reads it
+    """
+    _cfgctx.clear()
+    try:
+        os.unlink(ini_path() + mcat['sidecar'])
+    except OSError:
+        pass
 
 
 # -----------------------------------------------------------------------------
+@trace.spanned('load_config')
 def load_config(ptini=None):
     """
     Load the config info from cfgdir()/pytool.ini
+
+    The parsed config is kept for the life of the process and, to save
+    parsing on the next cold start, a compact JSON copy is written next to
+    pytool.ini. Both are keyed by the file's mtime and size, so a changed
+    pytool.ini is re-read. The same ConfigParser object is returned to every
+    caller until then, so callers should not modify it.
     """
     if ptini is None:
         cdir, _ = cfgdir()
-        ptpath = py.path.local(os.path.join(cdir, mcat['ptini']))
+        ptpath = os.path.join(cdir, mcat['ptini'])
     else:
-        ptpath = py.path.local(ptini)
+        ptpath = ptini
 
-    if ptpath.exists():
-        rval = configparser.ConfigParser()
-        rval.read(ptpath.strpath)
-        return(rval)
+    try:
+        st = os.stat(ptpath)
+    except OSError:
+        raise FileNotFoundError(ptpath)
+    stamp = [st.st_mtime_ns, st.st_size]
+
+    cached = _cfgctx.setdefault('parsed', {}).get(ptpath)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    import configparser
+    rval = configparser.ConfigParser()
+    data = _read_sidecar(ptpath, stamp)
+    if data is None:
+        rval.read(ptpath)
+        _write_sidecar(ptpath, stamp, rval)
     else:
-        raise FileNotFoundError(ptpath.strpath)
+        rval.read_dict(data)
+    _cfgctx['parsed'][ptpath] = (stamp, rval)
+    return(rval)
 
 
 # -----------------------------------------------------------------------------
-def setup_config_dir():
+def _read_sidecar(ptpath, stamp):
     """
-    Create (if necessary) and populate the config dir
+    Return the section dict saved next to *ptpath* if it was saved for the
+    current *stamp* ([mtime, size]), otherwise None
     """
-    cdir, src = cfgdir()
-    cdir = py.path.local(cdir)
-    hdir = py.path.local(cdir.dirname)
-    if src == mcat['lchome'] and not hdir.exists():
-        raise FileNotFoundError("{} {}".format(hdir.strpath, mcat['notdir']))
+    import json
+    try:
+        with open(ptpath + mcat['sidecar']) as rbl:
+            saved = json.load(rbl)
+        if saved['stamp'] == stamp:
+            return saved['data']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
 
+
+# -----------------------------------------------------------------------------
+def _write_sidecar(ptpath, stamp, cfg):
+    """
+    Save the raw values of *cfg* next to *ptpath*. Failing to write it (a
+    read-only config dir, say) just means parsing pytool.ini next time.
+    """
+    import json
+    data = {sect: dict(cfg.items(sect, raw=True))
+            for sect in cfg.sections()}
+    data[cfg.default_section] = dict(cfg.defaults())
+    path = ptpath + mcat['sidecar']
+    tmp = "{}.{}".format(path, os.getpid())
     try:
-        if not cdir.exists():
-            print("{} '{}'".format(mcat['stupdir'], cdir.strpath))
-            if src == mcat['lchome']:
-                print(mcat['stupmv'])
-        cdir.ensure(dir=True)
-    except py.error.EEXIST:
-        msg = "{} {}".format(cdir.strpath, mcat['isfile'])
-        raise FileExistsError(msg)
+        with open(tmp, 'w') as wbl:
+            json.dump({'stamp': stamp, 'data': data}, wbl,
+                      separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError:
+        pass
 
-    print("{} in {}".format(mcat['stupflz'], cdir.strpath))
-    ptini = cdir.join(mcat['ptini'])
-    ptini.write(file_pytool_ini())
 
-    tmpl = cdir.join("templates")  # .../templates
-    tmpl.ensure(dir=True)
+# -----------------------------------------------------------------------------
+@trace.spanned('setup_config_dir')
+def setup_config_dir(fs=None, out=None):
+    """
+    Create (if necessary) and populate the config dir, through filesystem
+    backend *fs* (see pytool.fs), by default the local filesystem, saying
+    so on *out* (by default sys.stdout). The files come from the package's
+    defaults (see pytool.builtin) and are written in one go. On the local
+    filesystem, this is safe to run in many processes at once: see
+    _publish_config_dir().
+    """
+    from pytool import builtin
+    from pytool.fs import LocalFS
+    fs = fs or LocalFS()
+    cdir, src = cfgdir()
+    hdir = os.path.dirname(cdir)
+    if src == mcat['lchome'] and not fs.exists(hdir):
+        raise FileNotFoundError("{} {}".format(hdir, mcat['notdir']))
+    if fs.exists(cdir) and not fs.isdir(cdir):
+        raise FileExistsError("{} {}".format(cdir, mcat['isfile']))
+
+    files = {os.path.join(*relpath.split("/")): data.encode()
+             for relpath, data in builtin.files().items()}
+    # pytool.ini goes last: once it's there, initialize() takes the config
+    # dir to be ready, so everything else has to be in place first
+    files.pop(mcat['ptini'], None)
+    files[mcat['ptini']] = file_pytool_ini().encode()
+    if isinstance(fs, LocalFS):
+        _publish_config_dir(cdir, src, files, out)
+    else:
+        _announce_setup(fs.exists(cdir), cdir, src, out)
+        try:
+            fs.makedirs(cdir)
+        except (FileExistsError, NotADirectoryError):
+            msg = "{} {}".format(cdir, mcat['isfile'])
+            raise FileExistsError(msg) from None
+        fs.write_tree({os.path.join(cdir, relpath): data
+                       for relpath, data in files.items()})
+    invalidate_config()
 
-    pdir = tmpl.join("prjdir")    # .../templates/prjdir
-    pdir.ensure(dir=True)
 
-    ppdir = pdir.join("prjdir")   # .../templates/prjdir/prjdir
-    ppdir.ensure(dir=True)
+# -----------------------------------------------------------------------------
+def _publish_config_dir(cdir, src, files, out=None):
+    """
+    Holding an advisory lock on <cdir>.lock, write *files* (relative path ->
+    bytes) into a temporary sibling of *cdir* and rename it into place, so
+    other processes see either no config dir or a complete one. If another
+    process set it up while we waited for the lock, use that instead. Return
+    True if we did the work.
+
+    Whoever holds the lock and finds pytool.ini in place removes the lock
+    file. That's safe because nobody can need the lock any more: whoever
+    gets this lock file or a new one will find pytool.ini too. No lock file
+    is made (or left) when *cdir* turns out to be a regular file.
+    """
+    import shutil
+    from pytool.fs import LocalFS
+    isfile = "{} {}".format(cdir, mcat['isfile'])
+    if os.path.isfile(cdir):
+        raise FileExistsError(isfile)
+    try:
+        if src == mcat['env']:
+            os.makedirs(os.path.dirname(cdir) or ".", exist_ok=True)
+        lockfd = os.open(cdir + mcat['lockext'], os.O_RDWR | os.O_CREAT,
+                         0o666)
+    except (FileExistsError, NotADirectoryError):
+        raise FileExistsError(isfile) from None
 
-    tdir = pdir.join("test")      # .../templates/prjdir/test
-    tdir.ensure(dir=True)
+    try:
+        _lock_file(lockfd)
+        if os.path.exists(os.path.join(cdir, mcat['ptini'])):
+            _unlink_quietly(cdir + mcat['lockext'])
+            return False
+        if os.path.exists(cdir) and not os.path.isdir(cdir):
+            # made while we waited for the lock
+            _unlink_quietly(cdir + mcat['lockext'])
+            raise FileExistsError(isfile)
+
+        _announce_setup(os.path.exists(cdir), cdir, src, out)
+        tmp = "{}.tmp.{}.{}".format(cdir, os.getpid(), threading.get_ident())
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            LocalFS().write_tree({os.path.join(tmp, relpath): data
+                                  for relpath, data in files.items()})
+            try:
+                # replaces cdir if it's an empty directory
+                os.rename(tmp, cdir)
+            except OSError:
+                # cdir has other things in it: move our files in one by
+                # one, pytool.ini last
+                for relpath in files:
+                    dst = os.path.join(cdir, relpath)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    os.replace(os.path.join(tmp, relpath), dst)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        _unlink_quietly(cdir + mcat['lockext'])
+        return True
+    finally:
+        # closing the file drops the lock
+        os.close(lockfd)
 
-    prog = tmpl.join(mcat["prog_py"])   # .../templates/prog.py
-    prog.write(file_prog_py())
 
-    tool = tmpl.join(mcat["tool_py"])   # .../templates/tool.py
-    tool.write(file_tool_py())
+# -----------------------------------------------------------------------------
+def _unlink_quietly(path):
+    """
+    Remove file *path* if it's still there
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
 
-    init = ppdir.join("__init__.py")  # .../templates/prjdir/prjdir/__init__.py
-    init.write(file_init_py())
 
-    rdme = pdir.join("README.md")  # .../templates/prjdir/README.md
-    rdme.write(file_readme())
+# -----------------------------------------------------------------------------
+def _lock_file(fd):
+    """
+    Wait for an exclusive advisory lock on open file *fd*. Where there's no
+    flock(), the atomic rename in _publish_config_dir() still keeps others
+    from seeing a partial config dir.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return
+    fcntl.flock(fd, fcntl.LOCK_EX)
 
-    stup = pdir.join("setup.py")  # .../templates/prjdir/setup.py
-    stup.write(file_setup_py())
 
-    stub = tdir.join("test_stub.py")  # .../templates/prjdir/test/test_stub.py
-    stub.write(file_test_stub_py())
+# -----------------------------------------------------------------------------
+def _announce_setup(existed, cdir, src, out=None):
+    """
+    Tell the user on *out* (by default sys.stdout) that we're setting up the
+    config dir
+    """
+    out = out or sys.stdout
+    if not existed:
+        print("{} '{}'".format(mcat['stupdir'], cdir), file=out)
+        if src == mcat['lchome']:
+            print(mcat['stupmv'], file=out)
+    print("{} in {}".format(mcat['stupflz'], cdir), file=out)
 
 
 # -----------------------------------------------------------------------------
@@ -292,15 +1243,9 @@ def file_pytool_ini():
     """
     Return content for pytool.ini
     """
+    from pytool import builtin
     cdir, _ = cfgdir()
-    rval = "".join([x + mcat['newline'] for x in [
-        mcat['sqpt'],
-        "{}{} = {}/{}".format(mcat['tmpl'],
-                              mcat['udir'],
-                              cdir,
-                              mcat['tmpl'])
-        ]])
-    return rval
+    return builtin.content(mcat['ptini']).replace(builtin.CFGDIR, cdir)
 
 
 # -----------------------------------------------------------------------------
@@ -308,27 +1253,8 @@ def file_prog_py():
     """
     Return content for prog.py
     """
-    rval = "".join([x + mcat['newline'] for x in [
-        mcat['triquo'],
-        mcat['descp'],
-        mcat['triquo'],
-        mcat['impsys'],
-        mcat['empty'],
-        mcat['empty'],
-        mcat['divider'],
-        mcat['defmn'],
-        mcat['indent'] + mcat['triquo'],
-        mcat['indent'] + mcat['mcom'],
-        mcat['indent'] + mcat['triquo'],
-        mcat['indent'] + mcat['prargs'],
-        mcat['indent'] + mcat['where'],
-        mcat['empty'],
-        mcat['empty'],
-        mcat['divider'],
-        mcat['ifneqm'],
-        mcat['indent'] + mcat['callmain'],
-        ]])
-    return rval
+    from pytool import builtin
+    return builtin.content("templates/prog.py")
 
 
 # -----------------------------------------------------------------------------
@@ -336,35 +1262,8 @@ def file_tool_py():
     """
     Return content for tool.py
     """
-    rval = "".join([x + "\n" for x in [
-        mcat['triquo'],
-        mcat['usage'],
-        mcat['indent'] + mcat['cmdline'],
-        mcat['empty'],
-        mcat['options'],
-        mcat['indent'] + mcat['debug'],
-        mcat['triquo'],
-        mcat['impdd'],
-        mcat['impsys'],
-        mcat['empty'],
-        mcat['divider'],
-        mcat['defmn'],
-        mcat['indent'] + mcat['triquo'],
-        mcat['indent'] + mcat['mcom'],
-        mcat['indent'] + mcat['triquo'],
-        mcat['indent'] + mcat['dispatch'],
-        mcat['empty'],
-        mcat['empty'],
-        mcat['divider'],
-        mcat['dispon'],
-        mcat['deffunc'],
-        mcat['indent'] + mcat['handle'],
-        mcat['empty'],
-        mcat['empty'],
-        mcat['ifneqm'],
-        mcat['indent'] + mcat['callmain'],
-        ]])
-    return rval
+    from pytool import builtin
+    return builtin.content("templates/tool.py")
 
 
 # -----------------------------------------------------------------------------
@@ -372,7 +1271,8 @@ def file_init_py():
     """
     Return content for __init__.py
     """
-    return file_prog_py()
+    from pytool import builtin
+    return builtin.content("templates/prjdir/prjdir/__init__.py")
 
 
 # -----------------------------------------------------------------------------
@@ -380,12 +1280,8 @@ def file_readme():
     """
     Return content for README.md
     """
-    rval = "".join([x + "\n" for x in [
-        mcat['title'],
-        mcat['empty'],
-        mcat['describe']
-        ]])
-    return rval
+    from pytool import builtin
+    return builtin.content("templates/prjdir/README.md")
 
 
 # -----------------------------------------------------------------------------
@@ -393,16 +1289,8 @@ def file_setup_py():
     """
     Return content for setup.py
     """
-    rval = "".join([x + "\n" for x in [
-        mcat['impstp'],
-        mcat['empty'],
-        mcat['callstp'],
-        mcat['indent'] + mcat['author'],
-        mcat['indent'] + mcat['authmail'],
-        mcat['indent'] + mcat['entpts'],
-        mcat['indent'] + mcat['closep'],
-        ]])
-    return rval
+    from pytool import builtin
+    return builtin.content("templates/prjdir/setup.py")
 
 
 # -----------------------------------------------------------------------------
@@ -410,16 +1298,8 @@ def file_test_stub_py():
     """
     Return content for test_stub.py
     """
-    rval = "".join([x + "\n" for x in [
-        mcat['imppytst'],
-        mcat['empty'],
-        mcat['deftest'],
-        mcat['indent'] + mcat['triquo'],
-        mcat['indent'] + mcat['testdoc'],
-        mcat['indent'] + mcat['triquo'],
-        mcat['indent'] + mcat['writst'],
-        ]])
-    return rval
+    from pytool import builtin
+    return builtin.content("templates/prjdir/test/test_stub.py")
 
 
 # -----------------------------------------------------------------------------
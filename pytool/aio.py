@@ -0,0 +1,139 @@
+"""
+pytool.aio - generation for asyncio programs
+
+create_project(), create_program(), and create_tool() here are coroutines
+that do the same work as their counterparts in pytool without blocking the
+event loop: the config and template loading and every file write run on a
+thread pool shared by all the generations in flight, so the total amount of
+filesystem work going on at once is bounded by its size (MAX_WORKERS unless
+the caller passes its own executor). They use the same config, manifest,
+bundle, and render caches as the synchronous functions.
+
+If a generation is cancelled, the writes that haven't started are dropped,
+the ones already running are waited for, and then what was generated is
+removed: the whole target if it didn't exist before, otherwise just the
+files that weren't there before.
+"""
+import asyncio
+from concurrent import futures
+import functools
+import os
+import threading
+
+import pytool
+from pytool.msgcat import mcat
+
+
+MAX_WORKERS = 8
+
+_executor = None
+_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+def default_executor():
+    """
+    Return the thread pool shared by generations that don't bring their own
+    """
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="pytool-aio")
+    return _executor
+
+
+# -----------------------------------------------------------------------------
+async def create_project(trgdir, cfg=None, link=None, var=None, fs=None,
+                         executor=None, profile=None):
+    """
+    Generate a project at *trgdir* as pytool.create_project() does
+    """
+    from pytool.fs import LocalFS
+    fs = fs or LocalFS()
+    ex = executor or default_executor()
+    loop = asyncio.get_running_loop()
+    existed = fs.exists(trgdir)
+    fresh = []
+    pending = []
+    genmani = os.path.join(trgdir, mcat['genmani'])
+    if not fs.exists(genmani):
+        fresh.append(genmani)
+
+    def emit(src, dst):
+        if not fs.exists(dst):
+            fresh.append(dst)
+        return emit_file(src, dst)
+
+    try:
+        pending.append(ex.submit(functools.partial(
+            pytool.prepare_project, trgdir, cfg=cfg, link=link, var=var,
+            fs=fs, profile=profile)))
+        pairs, emit_file, finish = await asyncio.wrap_future(pending[0])
+        pending = [ex.submit(emit, src, dst) for src, dst in pairs]
+        await asyncio.gather(*[asyncio.wrap_future(x) for x in pending])
+        pending = [ex.submit(finish, 1)]
+        await asyncio.wrap_future(pending[0])
+    except asyncio.CancelledError:
+        await _cleanup(loop, pending, fs, [] if existed else [trgdir], fresh)
+        raise
+
+
+# -----------------------------------------------------------------------------
+async def create_program(trg, cfg=None, link=None, var=None, fs=None,
+                         executor=None):
+    """
+    Generate a program at *trg* as 'pytool program' does
+    """
+    await _create_prog_tool(mcat['prog_py'], trg, cfg, link, var, fs,
+                            executor)
+
+
+# -----------------------------------------------------------------------------
+async def create_tool(trg, cfg=None, link=None, var=None, fs=None,
+                      executor=None):
+    """
+    Generate a tool at *trg* as 'pytool tool' does
+    """
+    await _create_prog_tool(mcat['tool_py'], trg, cfg, link, var, fs,
+                            executor)
+
+
+# -----------------------------------------------------------------------------
+async def _create_prog_tool(src, trg, cfg, link, var, fs, executor):
+    """
+    Run pytool.create_prog_tool() on the executor, removing *trg* if the
+    generation is cancelled and it wasn't there before
+    """
+    from pytool.fs import LocalFS
+    fs = fs or LocalFS()
+    ex = executor or default_executor()
+    loop = asyncio.get_running_loop()
+    existed = fs.exists(trg)
+    pending = [ex.submit(functools.partial(pytool.create_prog_tool, src, trg,
+                                           cfg=cfg, link=link, var=var,
+                                           fs=fs))]
+    try:
+        await asyncio.wrap_future(pending[0])
+    except asyncio.CancelledError:
+        await _cleanup(loop, pending, fs, [] if existed else [trg], [])
+        raise
+
+
+# -----------------------------------------------------------------------------
+async def _cleanup(loop, pending, fs, trees, files):
+    """
+    After a cancellation: cancel the *pending* work that hasn't started,
+    wait for the rest, then remove *trees* (if any) or else *files*. This is
+    shielded so that it completes even though the caller was cancelled.
+    """
+    def undo():
+        for item in pending:
+            item.cancel()
+        futures.wait(pending)
+        for path in trees or files:
+            fs.remove(path)
+
+    # not on the generation's executor: its workers may all be busy with
+    # the pending work
+    await asyncio.shield(loop.run_in_executor(None, undo))
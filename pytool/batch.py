@@ -0,0 +1,136 @@
+"""
+pytool.batch - run many generation jobs in one process
+
+Each input line is a JSON object describing one job:
+
+    {"command": "project", "path": "/some/where", "options": {}}
+
+'command' is one of 'project', 'program', or 'tool'. 'options', if present,
+is passed as keyword arguments to the generation function. The config is
+resolved and the project template tree is walked once, up front, and the
+jobs are then run on a pool of worker threads or processes. One JSON result
+line is written per job as each job finishes, so a failing job does not stop
+the rest. Input is read only a few jobs ahead of the workers, so results
+stream back from a pipe that stays open.
+"""
+from concurrent import futures
+import functools
+import json
+import sys
+import threading
+import time
+
+import pytool
+from pytool.msgcat import mcat
+
+
+# jobs read ahead per worker
+WINDOW = 2
+
+# worker state, filled in once per process by _init_worker()
+_state = {}
+
+
+# -----------------------------------------------------------------------------
+def run_batch(lines, out=None, jobs=4, pool='thread'):
+    """
+    Run the jobs described by *lines* (an iterable of JSON strings) on a pool
+    of *jobs* workers. *pool* is 'thread' or 'process'. Results are written to
+    *out* as JSON lines in completion order, each as soon as its job is
+    done. Return the number of failed jobs.
+    """
+    out = out or sys.stdout
+    if pool not in ('thread', 'process'):
+        raise ValueError("{}: {}".format(mcat['badpool'], pool))
+
+    cfg = pytool.initialize()
+    tree = pytool.template_tree(cfg)
+    if pool == 'process':
+        executor = futures.ProcessPoolExecutor(max_workers=jobs,
+                                               initializer=_init_worker,
+                                               initargs=(cfg, tree))
+    else:
+        _init_worker(cfg, tree)
+        executor = futures.ThreadPoolExecutor(max_workers=jobs)
+
+    # at most WINDOW jobs per worker are read ahead of the results, and
+    # each result is written as soon as its job is done, so a long-lived
+    # input pipe gets its results back while it's still open
+    failed = [0]
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max(1, jobs) * WINDOW)
+
+    def report(idx, done):
+        try:
+            exc = done.exception()
+            result = done.result() if exc is None else {
+                'job': idx, 'ok': False, 'elapsed': None,
+                'error': "{}: {}".format(type(exc).__name__, exc)}
+            with lock:
+                if not result['ok']:
+                    failed[0] += 1
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+        finally:
+            slots.release()
+
+    with executor:
+        for idx, line in enumerate(lines):
+            if line.strip():
+                slots.acquire()
+                executor.submit(run_job, idx, line).add_done_callback(
+                    functools.partial(report, idx))
+    return failed[0]
+
+
+# -----------------------------------------------------------------------------
+def run_job(idx, line, state=None):
+    """
+    Parse and run one job, returning a result dict. Exceptions are caught and
+    reported in the result rather than raised. *state* holds the 'cfg' and
+    'tree' to use and defaults to what _init_worker() loaded.
+    """
+    start = time.perf_counter()
+    rval = {'job': idx, 'ok': True, 'error': None}
+    try:
+        job = json.loads(line)
+        rval['command'] = job.get('command')
+        rval['path'] = job.get('path')
+        _dispatch(job, state or _state)
+    except Exception as err:
+        rval['ok'] = False
+        rval['error'] = "{}: {}".format(type(err).__name__, err)
+    rval['elapsed'] = time.perf_counter() - start
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def _dispatch(job, state):
+    """
+    Call the generation function for *job* using the config and template
+    tree in *state*
+    """
+    cmd = job.get('command')
+    path = job.get('path')
+    opts = job.get('options') or {}
+    if not path:
+        raise ValueError(mcat['nopath'])
+
+    cfg = state['cfg']
+    if cmd == mcat['project']:
+        pytool.create_project(path, cfg=cfg, tree=state['tree'], **opts)
+    elif cmd == mcat['program']:
+        pytool.create_prog_tool(mcat['prog_py'], path, cfg=cfg, **opts)
+    elif cmd == mcat['tool']:
+        pytool.create_prog_tool(mcat['tool_py'], path, cfg=cfg, **opts)
+    else:
+        raise ValueError("{}: {}".format(mcat['badjob'], cmd))
+
+
+# -----------------------------------------------------------------------------
+def _init_worker(cfg, tree):
+    """
+    Stash the resolved config and template tree for the jobs in this process
+    """
+    _state['cfg'] = cfg
+    _state['tree'] = tree
@@ -0,0 +1,223 @@
+"""
+pytool.bench - run the benchmarks in benchmarks/ and report JSON
+
+A suite is a directory of bench_*.py files. Each bench_* function in them is
+called with a Context and times what it likes with ctx.time():
+
+    def bench_initialize(ctx):
+        with ctx.config_dir() as cdir:
+            ctx.time("initialize.warm", pytool.initialize)
+
+Every case is run ctx.repeat times after its (untimed) setup. A bench
+function can also measure something else itself (peak memory, say) and hand
+the values to ctx.record(). The report is one JSON document: the pytool and
+python versions, the platform, and for each case its name, parameters, unit
+('s' for times), every value measured, and the min and median. compare()
+reads two reports and lists the cases whose median got slower (or bigger).
+"""
+import contextlib
+import fnmatch
+import glob
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import pytool
+from pytool import version
+from pytool.msgcat import mcat
+
+
+DEFAULT_SIZES = (10, 1000, 10000, 100000)
+DEFAULT_REPEAT = 3
+SLOWER = 1.25
+
+
+# -----------------------------------------------------------------------------
+class Context(object):
+    """
+    What a bench function gets: *sizes* (the template tree sizes to try),
+    *repeat*, and a scratch directory *tmpdir* removed after the run
+    """
+    def __init__(self, tmpdir, sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT,
+                 pattern=None):
+        self.tmpdir = tmpdir
+        self.sizes = sizes
+        self.repeat = repeat
+        self.pattern = pattern
+        self.results = []
+        self._count = 0
+
+    def scratch(self, name):
+        """
+        Return a new, empty directory under tmpdir whose name starts with
+        *name*
+        """
+        self._count += 1
+        path = os.path.join(self.tmpdir, "{}.{}".format(name, self._count))
+        os.makedirs(path)
+        return path
+
+    @contextlib.contextmanager
+    def config_dir(self, path=None):
+        """
+        Point PYTOOL_DIR at *path* (or a new scratch directory, not yet
+        created) for the duration, forgetting the remembered config on the
+        way in and out. Yield the path.
+        """
+        path = path or os.path.join(self.scratch("cfg"), mcat['dot_pt'])
+        old = os.environ.get(mcat['ptdir'])
+        os.environ[mcat['ptdir']] = path
+        pytool._cfgctx.clear()
+        try:
+            yield path
+        finally:
+            pytool._cfgctx.clear()
+            if old is None:
+                del os.environ[mcat['ptdir']]
+            else:
+                os.environ[mcat['ptdir']] = old
+
+    def wanted(self, name):
+        """
+        Return False if case *name* is filtered out
+        """
+        return not self.pattern or fnmatch.fnmatch(name, self.pattern)
+
+    def time(self, name, func, setup=None, **params):
+        """
+        Unless *name* is filtered out, call *setup()* (if given, untimed)
+        then *func(state)* ctx.repeat times, where *state* is what setup
+        returned, and record the timings under *name* and *params*
+        """
+        if not self.wanted(name):
+            return
+        times = []
+        for _ in range(self.repeat):
+            args = (setup(),) if setup else ()
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+        self.record(name, times, 's', **params)
+
+    def record(self, name, values, unit, **params):
+        """
+        Unless *name* is filtered out, record *values*, measured in *unit*,
+        under *name* and *params*
+        """
+        if not self.wanted(name):
+            return
+        self.results.append({'name': name,
+                             'params': params,
+                             'unit': unit,
+                             'times': values,
+                             'min': min(values),
+                             'median': statistics.median(values)})
+
+
+# -----------------------------------------------------------------------------
+def default_suite():
+    """
+    Return the benchmarks directory of the source tree pytool was loaded
+    from
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(pytool.__file__)),
+                        "benchmarks")
+
+
+# -----------------------------------------------------------------------------
+def discover(suite):
+    """
+    Return the bench_* functions from the bench_*.py files in directory
+    *suite*, in file then definition order
+    """
+    rval = []
+    for path in sorted(glob.glob(os.path.join(suite, "bench_*.py"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        spec = importlib.util.spec_from_file_location(
+            "pytool_benchmarks." + name, path)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+        funcs = [x for key, x in vars(mod).items()
+                 if key.startswith("bench_") and callable(x)]
+        rval.extend(sorted(funcs, key=lambda x: x.__code__.co_firstlineno))
+    if not rval:
+        raise FileNotFoundError("{}: {}".format(mcat['nobench'], suite))
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def run(suite=None, sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT,
+        pattern=None):
+    """
+    Run the benchmarks in *suite* (default: default_suite()) and return the
+    report as a dict. *pattern* is a glob limiting which cases are timed.
+    """
+    funcs = discover(suite or default_suite())
+    tmpdir = tempfile.mkdtemp(prefix="pytool-bench.")
+    ctx = Context(tmpdir, sizes=sizes, repeat=repeat, pattern=pattern)
+    try:
+        for func in funcs:
+            func(ctx)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return {'pytool': version.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'started': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'results': ctx.results}
+
+
+# -----------------------------------------------------------------------------
+def compare(old, new, threshold=SLOWER):
+    """
+    Return a line for each case in report *new* that's also in report *old*,
+    giving the ratio of their medians and flagging the ones more than
+    *threshold* times slower
+    """
+    def key(result):
+        return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+    before = {key(x): x for x in old['results']}
+    rval = []
+    for result in new['results']:
+        prev = before.get(key(result))
+        if prev is None or not prev['median']:
+            continue
+        ratio = result['median'] / prev['median']
+        rval.append("{:<40} {:>24} {:6.2f}x{}".format(
+            result['name'], key(result)[1], ratio,
+            "  " + mcat['slower'] if ratio > threshold else ""))
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def write_tree(root, count, sizes=(0, 100, 4096, 65536), fanout=100):
+    """
+    Write a synthetic template tree of *count* files under *root*, at most
+    *fanout* to a directory, cycling through file *sizes*
+    """
+    chunk = b"# pytool benchmark template line\n" * (max(sizes) // 33 + 1)
+    for idx in range(count):
+        sub = os.path.join(root, "d{:04d}".format(idx // fanout))
+        if idx % fanout == 0:
+            os.makedirs(sub, exist_ok=True)
+        with open(os.path.join(sub, "f{:06d}.py".format(idx)), 'wb') as wbl:
+            wbl.write(chunk[:sizes[idx % len(sizes)]])
+
+
+# -----------------------------------------------------------------------------
+def subprocess_argv(*args):
+    """
+    Return the argv to run 'pytool *args*' with this interpreter
+    """
+    return [sys.executable, "-c",
+            "import sys, pytool; sys.argv[0] = 'pytool'; pytool.main()"
+            ] + list(args)
@@ -0,0 +1,217 @@
+"""
+pytool.builtin - the default contents of the config dir
+
+The files setup_config_dir() writes are assembled from msgcat by the
+build_* functions here, but only when the package is built: 'make defaults'
+(python -m pytool.builtin) saves them in the package resource
+defaults.json, which is what pytool reads at run time, once per process.
+test_builtin_fresh checks that the resource matches what the functions
+produce.
+
+In pytool.ini, the config dir is left as a {{cfgdir}} placeholder and filled
+in by setup_config_dir().
+"""
+import os
+import posixpath
+
+from pytool.msgcat import mcat
+
+
+RESOURCE = "defaults.json"
+CFGDIR = "{{cfgdir}}"
+
+# relpath in the config dir -> content, loaded from RESOURCE
+_cache = {}
+
+
+# -----------------------------------------------------------------------------
+def files():
+    """
+    Return a dict mapping the path of each default file, relative to the
+    config dir and with '/' separators, to its content (str). Don't modify
+    it; it's shared.
+    """
+    if not _cache:
+        import json
+        from importlib import resources
+        text = resources.files('pytool').joinpath(RESOURCE).read_text(
+            encoding='utf-8')
+        _cache.update(json.loads(text))
+    return _cache
+
+
+# -----------------------------------------------------------------------------
+def content(relpath):
+    """
+    Return the content of the default file at *relpath* in the config dir
+    """
+    return files()[relpath]
+
+
+# -----------------------------------------------------------------------------
+def build():
+    """
+    Assemble the default files from msgcat, in the same form as files()
+    """
+    tmpl = mcat['tmpl']
+    prjdir = posixpath.join(tmpl, "prjdir")
+    return {mcat['ptini']: build_pytool_ini(),
+            posixpath.join(tmpl, mcat['prog_py']): build_prog_py(),
+            posixpath.join(tmpl, mcat['tool_py']): build_tool_py(),
+            posixpath.join(prjdir, "prjdir", "__init__.py"): build_init_py(),
+            posixpath.join(prjdir, "README.md"): build_readme(),
+            posixpath.join(prjdir, "setup.py"): build_setup_py(),
+            posixpath.join(prjdir, "test", "test_stub.py"):
+            build_test_stub_py()}
+
+
+# -----------------------------------------------------------------------------
+def write(path=None):
+    """
+    Save build() as the package resource (or at *path*)
+    """
+    import json
+    path = path or os.path.join(os.path.dirname(__file__), RESOURCE)
+    with open(path, 'w', encoding='utf-8') as wbl:
+        json.dump(build(), wbl, indent=1, sort_keys=True)
+        wbl.write("\n")
+
+
+# -----------------------------------------------------------------------------
+def build_pytool_ini():
+    """
+    Return content for pytool.ini, with a {{cfgdir}} placeholder for the
+    config dir
+    """
+    rval = "".join([x + mcat['newline'] for x in [
+        mcat['sqpt'],
+        "{}{} = {}/{}".format(mcat['tmpl'],
+                              mcat['udir'],
+                              CFGDIR,
+                              mcat['tmpl'])
+        ]])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def build_prog_py():
+    """
+    Return content for prog.py
+    """
+    rval = "".join([x + mcat['newline'] for x in [
+        mcat['triquo'],
+        mcat['descp'],
+        mcat['triquo'],
+        mcat['impsys'],
+        mcat['empty'],
+        mcat['empty'],
+        mcat['divider'],
+        mcat['defmn'],
+        mcat['indent'] + mcat['triquo'],
+        mcat['indent'] + mcat['mcom'],
+        mcat['indent'] + mcat['triquo'],
+        mcat['indent'] + mcat['prargs'],
+        mcat['indent'] + mcat['where'],
+        mcat['empty'],
+        mcat['empty'],
+        mcat['divider'],
+        mcat['ifneqm'],
+        mcat['indent'] + mcat['callmain'],
+        ]])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def build_tool_py():
+    """
+    Return content for tool.py
+    """
+    rval = "".join([x + "\n" for x in [
+        mcat['triquo'],
+        mcat['usage'],
+        mcat['indent'] + mcat['cmdline'],
+        mcat['empty'],
+        mcat['options'],
+        mcat['indent'] + mcat['debug'],
+        mcat['triquo'],
+        mcat['impdd'],
+        mcat['impsys'],
+        mcat['empty'],
+        mcat['divider'],
+        mcat['defmn'],
+        mcat['indent'] + mcat['triquo'],
+        mcat['indent'] + mcat['mcom'],
+        mcat['indent'] + mcat['triquo'],
+        mcat['indent'] + mcat['dispatch'],
+        mcat['empty'],
+        mcat['empty'],
+        mcat['divider'],
+        mcat['dispon'],
+        mcat['deffunc'],
+        mcat['indent'] + mcat['handle'],
+        mcat['empty'],
+        mcat['empty'],
+        mcat['ifneqm'],
+        mcat['indent'] + mcat['callmain'],
+        ]])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def build_init_py():
+    """
+    Return content for __init__.py
+    """
+    return build_prog_py()
+
+
+# -----------------------------------------------------------------------------
+def build_readme():
+    """
+    Return content for README.md
+    """
+    rval = "".join([x + "\n" for x in [
+        mcat['title'],
+        mcat['empty'],
+        mcat['describe']
+        ]])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def build_setup_py():
+    """
+    Return content for setup.py
+    """
+    rval = "".join([x + "\n" for x in [
+        mcat['impstp'],
+        mcat['empty'],
+        mcat['callstp'],
+        mcat['indent'] + mcat['author'],
+        mcat['indent'] + mcat['authmail'],
+        mcat['indent'] + mcat['entpts'],
+        mcat['indent'] + mcat['closep'],
+        ]])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def build_test_stub_py():
+    """
+    Return content for test_stub.py
+    """
+    rval = "".join([x + "\n" for x in [
+        mcat['imppytst'],
+        mcat['empty'],
+        mcat['deftest'],
+        mcat['indent'] + mcat['triquo'],
+        mcat['indent'] + mcat['testdoc'],
+        mcat['indent'] + mcat['triquo'],
+        mcat['indent'] + mcat['writst'],
+        ]])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
+    write()
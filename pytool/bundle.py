@@ -0,0 +1,205 @@
+"""
+pytool.bundle - the template directory packed into one indexed file
+
+'pytool pack-templates' writes the templates directory into a bundle in the
+config dir so generation can read one memory-mapped file instead of opening
+every template. The templates directory stays the authoring format; once a
+bundle exists it is repacked automatically whenever an mtime in the
+templates directory no longer matches the one recorded in the bundle.
+
+Layout (all integers little-endian):
+
+    header   magic (8 bytes), entry count (u32), root length (u32),
+             content offset (u64), root mtime in ns (i64)
+    root     the templates directory the bundle was packed from (utf-8)
+    table    per entry: path length (u16), isdir (u8), pad (u8), mode (u32),
+             mtime in ns (i64), offset (u64), size (u64), then the path
+             (utf-8)
+    content  file contents back to back, starting at the content offset
+
+Paths are relative to the templates directory and use '/' separators.
+"""
+import mmap
+import os
+import struct
+import threading
+
+from pytool import copier
+from pytool import manifest
+from pytool import render
+
+
+MAGIC = b"PTBUNDL2"
+_HEADER = struct.Struct("<8sIIQq")
+_ENTRY = struct.Struct("<HBxIqQQ")
+
+# bundle path -> Bundle
+_memo = {}
+_lock = threading.RLock()
+
+
+# -----------------------------------------------------------------------------
+class Bundle(object):
+    """
+    A read-only, memory-mapped template bundle
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as rbl:
+            st = os.fstat(rbl.fileno())
+            self.stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self._map = mmap.mmap(rbl.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        (magic, count, rootlen, dataoff,
+         self.mtime) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("{}: not a template bundle".format(path))
+        pos = _HEADER.size
+        self.root = bytes(self._view[pos:pos + rootlen]).decode()
+        pos += rootlen
+        self.index = {}
+        for _ in range(count):
+            (plen, isdir, mode, mtime,
+             offset, size) = _ENTRY.unpack_from(self._map, pos)
+            pos += _ENTRY.size
+            relpath = bytes(self._view[pos:pos + plen]).decode()
+            pos += plen
+            self.index[relpath] = (bool(isdir), mode, mtime,
+                                   dataoff + offset, size)
+
+    def close(self):
+        """
+        Release the mapping
+        """
+        self._view.release()
+        self._map.close()
+
+    def data(self, relpath):
+        """
+        Return a memoryview of the content of *relpath* (no copy is made)
+        """
+        _, _, _, offset, size = self.index[relpath]
+        return self._view[offset:offset + size]
+
+    def plan(self, relpath):
+        """
+        Return the (cached) render.Plan for *relpath*, or None if it has no
+        placeholders
+        """
+        return render.plan_for_data((self.path, relpath), self.stamp,
+                                    self.data(relpath))
+
+    def tree(self, prefix):
+        """
+        Return manifest.Entry tuples for everything below directory *prefix*,
+        with paths relative to it, in walk order
+        """
+        lead = prefix + "/"
+        return [manifest.Entry(relpath[len(lead):], isdir, size, mtime, mode)
+                for relpath, (isdir, mode, mtime, _, size)
+                in self.index.items()
+                if relpath.startswith(lead)]
+
+    def is_stale(self):
+        """
+        Return True if the mtime of the templates directory or of anything
+        recorded in the bundle has changed since it was packed. Adding or
+        removing a template changes its directory's mtime. This costs a stat
+        per entry but no opens or reads.
+        """
+        try:
+            if os.stat(self.root).st_mtime_ns != self.mtime:
+                return True
+            for relpath, (_, _, mtime, _, _) in self.index.items():
+                if os.stat(os.path.join(self.root,
+                                        relpath)).st_mtime_ns != mtime:
+                    return True
+        except OSError:
+            return True
+        return False
+
+
+# -----------------------------------------------------------------------------
+def pack(root, path, cachedir=None):
+    """
+    Pack the templates directory *root* into a bundle at *path*, replacing
+    any old one atomically. Return (file count, content bytes).
+    """
+    root = os.path.abspath(root)
+    rootb = root.encode()
+    table = []
+    offset = 0
+    for entry in manifest.load(root, cachedir=cachedir):
+        st = os.stat(os.path.join(root, entry.path))
+        size = 0 if entry.isdir else st.st_size
+        table.append((entry, entry.path.replace(os.sep, "/").encode(),
+                      st.st_mode & 0o7777, st.st_mtime_ns, offset, size))
+        offset += size
+    dataoff = _HEADER.size + len(rootb) + sum(_ENTRY.size + len(x[1])
+                                              for x in table)
+
+    tmp = "{}.{}.{}".format(path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as wbl:
+        wbl.write(_HEADER.pack(MAGIC, len(table), len(rootb), dataoff,
+                               os.stat(root).st_mtime_ns))
+        wbl.write(rootb)
+        for entry, pathb, mode, mtime, off, size in table:
+            wbl.write(_ENTRY.pack(len(pathb), entry.isdir, mode, mtime, off,
+                                  size))
+            wbl.write(pathb)
+        for entry, _, _, _, _, size in table:
+            if entry.isdir:
+                continue
+            with open(os.path.join(root, entry.path), 'rb') as rbl:
+                # a chunk at a time, so big files needn't fit in memory
+                left = size
+                while left:
+                    data = rbl.read(min(left, copier.BUFSIZE))
+                    if not data:
+                        break
+                    wbl.write(data)
+                    left -= len(data)
+            if left:
+                raise IOError("{}: changed while packing".format(entry.path))
+    os.replace(tmp, path)
+    return (len([x for x in table if not x[0].isdir]), offset)
+
+
+# -----------------------------------------------------------------------------
+def current(root, path, cachedir=None):
+    """
+    If there's a bundle at *path*, return it as an open Bundle, repacking it
+    first if it was packed from somewhere else or is stale. Return None if
+    there's no bundle.
+    """
+    root = os.path.abspath(root)
+    with _lock:
+        bnd = _open(path)
+        if bnd is not None and (bnd.root != root or bnd.is_stale()):
+            pack(root, path, cachedir)
+            bnd = _open(path)
+        return bnd
+
+
+# -----------------------------------------------------------------------------
+def _open(path):
+    """
+    Return the Bundle at *path*, reusing the open one if the file hasn't been
+    replaced, or None if there's no bundle there
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _memo.get(path)
+    if cached and cached.stamp == (st.st_ino, st.st_mtime_ns, st.st_size):
+        return cached
+    bnd = Bundle(path)
+    _memo[path] = bnd
+    if cached:
+        # the plans cached for the old bundle hold views of its mapping.
+        # Without them, it's unmapped as soon as any generation still
+        # reading it is done with it.
+        render.forget(path)
+    return bnd
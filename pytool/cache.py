@@ -0,0 +1,254 @@
+"""
+pytool.cache - a local read-through cache of template files
+
+When the config dir (and so the templates) is on a slow shared mount, a
+[cache] section in pytool.ini has generation read templates through a
+cache on a local disk:
+
+    [cache]
+    dir = /var/tmp/pytool-cache
+    max_size = 200M
+
+Before a template is read, it is stat'ed where it lives, and a copy named
+for its path, mtime, and size is looked up in the cache directory. If the
+copy is there (a hit), it's used instead; if not (a miss), the template is
+copied into the cache first. So each run costs one stat per template on the
+mount, plus a read for templates that are new or have changed. A template
+edited in place gets a new mtime, so its stale copy is never used again
+and ages out.
+
+Each copy's mtime records when it was last used. When a run leaves the
+cache bigger than max_size (bytes, or with a K, M, or G suffix), the least
+recently used copies are removed until it's back under 90% of that.
+Eviction waits for the end of the run, and skips copies used since the
+oldest run still going in this process began (see Cache.begin()), so it
+never removes a copy that a run is still reading. Hits, misses, and
+evictions are counted in the trace counters (cache_hits, cache_misses,
+cache_evictions; see pytool.trace) and on the Cache object.
+
+The cache is only ever an optimization: if it can't be written, templates
+are read from where they are.
+"""
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+from pytool import compress
+from pytool import copier
+from pytool import trace
+from pytool.msgcat import mcat
+
+
+LOW_WATER = 0.9
+
+# (root, limit) -> Cache
+_memo = {}
+_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+class Cache(object):
+    """
+    A cache of template files in directory *root* holding up to *limit*
+    bytes
+    """
+    def __init__(self, root, limit):
+        self.root = root
+        self.limit = limit
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._runs = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """
+        Start a run that will fetch copies, and return a token to pass to
+        trim() when it's done with them. Until then, copies it may have
+        fetched aren't evicted. A run that fails before calling trim() ends
+        when its token is dropped.
+        """
+        run = _Run()
+        with self._lock:
+            self._runs.add(run)
+        return run
+
+    def fetch(self, src):
+        """
+        Return the path of an up to date local copy of template *src*,
+        copying it into the cache if need be, or *src* itself if the cache
+        can't be used
+        """
+        try:
+            st = os.stat(src)
+        except OSError:
+            return src
+        key = hashlib.sha1("{}\0{}\0{}".format(
+            os.path.abspath(src), st.st_mtime_ns,
+            st.st_size).encode()).hexdigest()
+        # a compressed template's copy keeps its suffix (see pytool.compress)
+        path = os.path.join(self.root, key[:2],
+                            key[2:] + compress.suffix(src))
+        try:
+            # a hit: mark the copy as just used
+            os.utime(path)
+            self._count('hits')
+            return path
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return src
+
+        tmp = os.path.join(os.path.dirname(path), ".{}.{}.{}".format(
+            os.path.basename(path), os.getpid(), threading.get_ident()))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            size = copier.copy_file(src, tmp)
+            os.chmod(tmp, st.st_mode & 0o7777)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return src
+        self._count('misses')
+        with self._lock:
+            if self.size is not None:
+                self.size += size
+        return path
+
+    def usage(self):
+        """
+        Scan the cache and return (number of copies, total bytes)
+        """
+        entries = self._entries()
+        return (len(entries), sum(x[1] for x in entries))
+
+    def clear(self):
+        """
+        Remove every copy in the cache
+        """
+        for path, _, _ in self._entries():
+            _unlink(path)
+        with self._lock:
+            self.size = 0
+
+    def _count(self, what, amount=1):
+        """
+        Add *amount* to counter *what* here and in the trace
+        """
+        with self._lock:
+            setattr(self, what, getattr(self, what) + amount)
+        trace.count("cache_" + what, amount)
+
+    def trim(self, run=None):
+        """
+        End *run* (from begin()), and if the cache has grown past its
+        limit, remove the least recently used copies until it's back under
+        LOW_WATER of it. Copies used since the oldest run still going began
+        are kept.
+        """
+        with self._lock:
+            if run is not None:
+                self._runs.discard(run)
+            keep = min((x.started for x in list(self._runs)), default=None)
+            if self.size is None:
+                self.size = self.usage()[1]
+            if self.size <= self.limit:
+                return
+            # other processes may have added or removed copies, so look at
+            # what's really there
+            entries = sorted(self._entries(), key=lambda x: x[2])
+            self.size = sum(x[1] for x in entries)
+            evicted = 0
+            for victim, vsize, used in entries:
+                if self.size <= self.limit * LOW_WATER:
+                    break
+                if keep is not None and used >= keep:
+                    # this and the rest may be in use
+                    break
+                _unlink(victim)
+                self.size -= vsize
+                evicted += 1
+        if evicted:
+            self._count('evictions', evicted)
+
+    def _entries(self):
+        """
+        Return (path, size, mtime) for each copy in the cache
+        """
+        rval = []
+        try:
+            subdirs = [x.path for x in os.scandir(self.root) if x.is_dir()]
+        except FileNotFoundError:
+            return rval
+        for sub in subdirs:
+            with os.scandir(sub) as ents:
+                for ent in ents:
+                    if ent.is_file() and not ent.name.startswith("."):
+                        st = ent.stat()
+                        rval.append((ent.path, st.st_size, st.st_mtime_ns))
+        return rval
+
+
+# -----------------------------------------------------------------------------
+class _Run(object):
+    """
+    A run using the cache, for Cache.begin(). *started* is when it began,
+    less a second to allow for coarse filesystem timestamps.
+    """
+    def __init__(self):
+        self.started = time.time_ns() - 10 ** 9
+
+
+# -----------------------------------------------------------------------------
+def get(cfg, base):
+    """
+    Return the Cache configured in the [cache] section of *cfg*, or None if
+    there isn't one. A relative dir is taken relative to *base*.
+    """
+    if not cfg.has_section(mcat['cache']):
+        return None
+    root = cfg.get(mcat['cache'], 'dir', fallback=None)
+    if not root:
+        return None
+    root = os.path.join(base, os.path.expanduser(root))
+    limit = parse_size(cfg.get(mcat['cache'], 'max_size',
+                               fallback=mcat['cachemax']))
+    with _lock:
+        key = (root, limit)
+        if key not in _memo:
+            _memo[key] = Cache(root, limit)
+        return _memo[key]
+
+
+# -----------------------------------------------------------------------------
+def parse_size(text):
+    """
+    Return the number of bytes in *text*, a number optionally followed by
+    K, M, or G (powers of 1024). Raise ValueError if it isn't one.
+    """
+    text = text.strip().upper().rstrip("B")
+    scale = 1
+    if text and text[-1] in "KMG":
+        scale = 1024 ** ("KMG".index(text[-1]) + 1)
+        text = text[:-1]
+    try:
+        return int(float(text) * scale)
+    except ValueError:
+        raise ValueError("{}: '{}'".format(mcat['badsize'], text)) from None
+
+
+# -----------------------------------------------------------------------------
+def _unlink(path):
+    """
+    Remove *path*, which another process may have removed already
+    """
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,71 @@
+"""
+pytool.cli - run pytool commands in this process
+
+run() takes the arguments you would type after 'pytool', runs the command
+the way the pytool script does, and hands back what a subprocess would
+have: the exit status and everything written to stdout and stderr.
+
+    code, out, err = cli.run(["project", "--var", "author=me", "demo"])
+
+sys.argv is left alone, and nothing reaches the real stdout or stderr.
+The captured stdout has a binary buffer, as the real one does, and is
+decoded with surrogateescape, so binary output (an archive) comes back
+intact as out.encode(errors='surrogateescape').
+The command is handed its own output buffers (and, with *stdin*, its
+input) by pytool.main(), and writes there: sys.stdout, sys.stderr, and
+sys.stdin are never swapped, so calls from several threads run side by
+side, and other threads' printing goes where it always does. The config,
+manifest, bundle, and render caches carry over from one call to the next,
+as they do for any other caller in the process.
+"""
+import io
+import traceback
+
+import pytool
+from pytool import trace
+
+
+# -----------------------------------------------------------------------------
+def run(argv, stdin=None):
+    """
+    Run 'pytool *argv*' (a list of arguments) in this process, with *stdin*
+    (a string) as its standard input if given. Return (exit code, stdout,
+    stderr). Usage errors and sys.exit() give the exit code pytool would;
+    an exception from the command gives 1 with its traceback on stderr.
+    """
+    outb = io.BytesIO()
+    out = io.TextIOWrapper(outb, encoding='utf-8', errors='surrogateescape',
+                           newline="\n", write_through=True)
+    err = io.StringIO()
+    tracing = trace.enabled
+    try:
+        pytool.main(list(argv), out=out, err=err,
+                    stdin=None if stdin is None else io.StringIO(stdin))
+        code = 0
+    except SystemExit as exc:
+        code = _exit_code(exc.code, err)
+    except Exception:
+        traceback.print_exc(file=err)
+        code = 1
+    finally:
+        if trace.enabled and not tracing:
+            # --trace was given: finish the trace into err, as the script
+            # would at exit
+            trace.close()
+    out.flush()
+    rval = outb.getvalue().decode('utf-8', 'surrogateescape')
+    return (code, rval, err.getvalue())
+
+
+# -----------------------------------------------------------------------------
+def _exit_code(code, err):
+    """
+    Turn the argument to sys.exit() into an exit status the way the
+    interpreter does, writing a message to *err*
+    """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=err)
+    return 1
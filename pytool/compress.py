@@ -0,0 +1,169 @@
+"""
+pytool.compress - templates stored compressed
+
+A template file ending in .pytool.gz, .pytool.xz, or .pytool.bz2 is stored
+compressed. It's decompressed as it's read, a buffer at a time (see
+copier.BUFSIZE), and the file generated from it is named without the
+suffix: a project template data/fixtures.csv.pytool.xz becomes
+data/fixtures.csv in the project. A compressed template small enough to be
+a template (see render.MAX_TEMPLATE) can have placeholders like any other.
+
+The .pytool part is what marks it: a template that's just named .gz (a
+test fixture sample.tar.gz, say) is copied as it is, under its own name.
+
+Compressed templates are never linked (--link), since the target has to be
+the decompressed content. With a bundle, they're read from the templates
+directory the bundle was packed from.
+
+To have 'pytool store' keep the blobs it writes compressed, set
+
+    [pytool]
+    compress = xz
+
+(gz, xz, or bz2) in pytool.ini. Templates that are already compressed are
+stored as they are.
+"""
+import os
+
+from pytool import copier
+from pytool.msgcat import mcat
+
+
+MARK = '.pytool'
+SUFFIXES = ('.gz', '.xz', '.bz2')
+
+
+# -----------------------------------------------------------------------------
+def suffix(path):
+    """
+    Return the compression suffix of *path* (MARK followed by '.gz', '.xz',
+    or '.bz2'), or '' if it isn't a compressed template
+    """
+    stem, ext = os.path.splitext(path)
+    if (ext in SUFFIXES and stem.endswith(MARK) and
+            os.path.basename(stem) != MARK):
+        return MARK + ext
+    return ''
+
+
+# -----------------------------------------------------------------------------
+def strip(path):
+    """
+    Return *path* without its compression suffix, if it has one
+    """
+    ext = suffix(path)
+    return path[:-len(ext)] if ext else path
+
+
+# -----------------------------------------------------------------------------
+def find(relpath, exists):
+    """
+    Return *relpath*, or if *exists(relpath)* is false, the first of
+    *relpath* with a compression suffix added that *exists()* says is
+    there. Return *relpath* if none is.
+    """
+    if exists(relpath):
+        return relpath
+    for ext in SUFFIXES:
+        if exists(relpath + MARK + ext):
+            return relpath + MARK + ext
+    return relpath
+
+
+# -----------------------------------------------------------------------------
+def reader(path, ext=None):
+    """
+    Open file *path* for reading in binary mode, decompressing it as it's
+    read if it's compressed. *ext* overrides the suffix of *path* as the
+    way it's compressed.
+    """
+    ext = _bare(suffix(path) if ext is None else ext)
+    if ext == '.gz':
+        import gzip
+        return gzip.open(path, 'rb')
+    if ext == '.xz':
+        import lzma
+        return lzma.open(path, 'rb')
+    if ext == '.bz2':
+        import bz2
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+# -----------------------------------------------------------------------------
+def writer(path, ext):
+    """
+    Open file *path* for writing in binary mode, compressing what's written
+    the way suffix *ext* says
+    """
+    ext = _bare(ext)
+    if ext == '.gz':
+        import gzip
+        return gzip.open(path, 'wb')
+    if ext == '.xz':
+        import lzma
+        return lzma.open(path, 'wb')
+    if ext == '.bz2':
+        import bz2
+        return bz2.open(path, 'wb')
+    raise ValueError("{}: '{}'".format(mcat['badcomp'], ext))
+
+
+# -----------------------------------------------------------------------------
+def decompress_file(src, dst, bufsize=copier.BUFSIZE):
+    """
+    Write the decompressed content of compressed file *src* to *dst*, with
+    at most *bufsize* bytes of it in memory at once. Return the number of
+    bytes written.
+    """
+    buf = bytearray(bufsize)
+    view = memoryview(buf)
+    done = 0
+    copier.unshare(dst)
+    with reader(src) as rbl, open(dst, 'wb') as wbl:
+        while True:
+            count = rbl.readinto(buf)
+            if not count:
+                break
+            wbl.write(view[:count])
+            done += count
+    return done
+
+
+# -----------------------------------------------------------------------------
+def compress_file(src, dst, ext):
+    """
+    Write the content of *src* to *dst* compressed the way suffix *ext*
+    says, a buffer at a time. Return the number of bytes read.
+    """
+    done = 0
+    with open(src, 'rb') as rbl, writer(dst, ext) as wbl:
+        for chunk in iter(lambda: rbl.read(copier.BUFSIZE), b""):
+            wbl.write(chunk)
+            done += len(chunk)
+    return done
+
+
+# -----------------------------------------------------------------------------
+def configured(cfg):
+    """
+    Return the suffix (see suffix()) for the compression set by compress
+    in pytool.ini's [pytool] section, or '' if it isn't set. Raise
+    ValueError if it's not one pytool knows.
+    """
+    value = cfg.get(mcat['pytool'], 'compress', fallback='') if cfg else ''
+    value = value.strip().lstrip(".").lower()
+    if value in ('', 'no', 'none', 'off'):
+        return ''
+    ext = "." + value
+    if ext not in SUFFIXES:
+        raise ValueError("{}: '{}'".format(mcat['badcomp'], value))
+    return MARK + ext
+
+
+# -----------------------------------------------------------------------------
+def _bare(ext):
+    """
+    Return suffix *ext* without MARK: just the kind of compression
+    """
+    return ext[len(MARK):] if ext.startswith(MARK) else ext
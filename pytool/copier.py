@@ -0,0 +1,338 @@
+"""
+pytool.copier - copy template files into place
+
+Copies are done in the kernel where possible (os.copy_file_range, then
+os.sendfile) and fall back to a buffered read/write loop when the source and
+target don't support that (different filesystems, special files, older
+kernels). run_pool() runs independent copies on a bounded thread pool.
+
+A sparse source (one with fewer blocks allocated than its size needs) is
+copied extent by extent, finding the data with SEEK_DATA/SEEK_HOLE and
+skipping the holes, so the copy is just as sparse. Whichever way a file is
+copied, at most *bufsize* bytes of it (BUFSIZE unless the caller passes
+another size, as generation does from copy_buffer in pytool.ini) are in
+memory at once, however big it is.
+
+Instead of copying, place_file() can share the source's storage:
+
+    reflink   clone the source's extents (FICLONE; btrfs, XFS, ...). The
+              target is an independent file that can be edited freely.
+    hard      hard link read-only sources; writable ones are copied, since
+              editing a hard link would edit the template
+    auto      reflink if the filesystem can, else hard link if the source
+              is read-only, else copy
+"""
+from concurrent import futures
+import errno
+import os
+import shutil
+
+from pytool import trace
+from pytool.msgcat import mcat
+
+
+BUFSIZE = 1024 * 1024
+DEFAULT_JOBS = 4
+LINK_MODES = ('copy', 'hard', 'reflink', 'auto')
+
+# from <linux/fs.h>: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# errno values that mean "this kernel copy method can't be used here", as
+# opposed to a real I/O error
+_FALLBACK = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+             errno.ENOTSUP, errno.EBADF, errno.EPERM}
+
+# ... and "can't clone here" and "can't hard link here"
+_NOCLONE = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL,
+            errno.ENOTTY, errno.ENOSYS, errno.EBADF}
+_NOLINK = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP,
+           errno.EOPNOTSUPP}
+
+
+# -----------------------------------------------------------------------------
+def copy_file(src, dst, bufsize=BUFSIZE):
+    """
+    Copy the contents of file *src* to *dst*, creating or truncating *dst*,
+    with at most *bufsize* bytes in memory at once. Return the number of
+    bytes copied (for a sparse file, the bytes of data outside the holes).
+    """
+    unshare(dst)
+    if trace.enabled:
+        # open x2, fstat, close x2
+        trace.est_syscalls(5)
+    with open(src, 'rb') as rbl, open(dst, 'wb') as wbl:
+        st = os.fstat(rbl.fileno())
+        size = st.st_size
+        if _is_sparse(st):
+            done = _copy_sparse(rbl.fileno(), wbl.fileno(), size, bufsize)
+            if done is not None:
+                return done
+        for method in (_copy_range, _copy_sendfile):
+            done = method(rbl.fileno(), wbl.fileno(), size, bufsize)
+            if done is not None:
+                return done
+        rbl.seek(0)
+        wbl.seek(0)
+        wbl.truncate()
+        shutil.copyfileobj(rbl, wbl, bufsize)
+        if trace.enabled:
+            # the seeks and truncate, then a read and a write per buffer
+            # plus the read that finds the end
+            trace.est_syscalls(3 + 2 * (wbl.tell() // bufsize + 1))
+        return wbl.tell()
+
+
+# -----------------------------------------------------------------------------
+def check_link(link):
+    """
+    Raise ValueError unless *link* is one of LINK_MODES (or None, meaning
+    copy)
+    """
+    if link is not None and link not in LINK_MODES:
+        raise ValueError("{}: '{}'".format(mcat['badlink'], link))
+
+
+# -----------------------------------------------------------------------------
+def place_file(src, dst, link='auto', bufsize=BUFSIZE):
+    """
+    Put the content of *src* at *dst* by reflink, hard link, or copy as
+    *link* directs. Explicit 'reflink' or 'hard' raise OSError if the link
+    can't be made; 'auto' falls back to copying. A compressed *src* (see
+    pytool.compress) is always decompressed into *dst*. Copies go through
+    at most *bufsize* bytes of memory. Return the number of bytes copied (0
+    for a link).
+    """
+    check_link(link)
+    from pytool import compress
+    if compress.suffix(src):
+        # the target is the decompressed content: nothing to link to
+        return compress.decompress_file(src, dst, bufsize)
+    if link in ('reflink', 'auto'):
+        try:
+            reflink_file(src, dst)
+            return 0
+        except OSError as err:
+            if link == 'reflink' or err.errno not in _NOCLONE:
+                raise
+    if link in ('hard', 'auto') and not os.stat(src).st_mode & 0o222:
+        try:
+            hardlink_file(src, dst)
+            return 0
+        except OSError as err:
+            if link == 'hard' or err.errno not in _NOLINK:
+                raise
+    return copy_file(src, dst, bufsize)
+
+
+# -----------------------------------------------------------------------------
+def reflink_file(src, dst):
+    """
+    Make *dst* a clone of *src* sharing its extents. Raise OSError if the
+    filesystem can't do that (or *src* and *dst* are on different ones).
+    """
+    import fcntl
+    unshare(dst)
+    if trace.enabled:
+        # open x2, ioctl, close x2
+        trace.est_syscalls(5)
+    with open(src, 'rb') as rbl, open(dst, 'wb') as wbl:
+        try:
+            fcntl.ioctl(wbl.fileno(), FICLONE, rbl.fileno())
+        except OSError:
+            wbl.close()
+            os.unlink(dst)
+            raise
+
+
+# -----------------------------------------------------------------------------
+def hardlink_file(src, dst):
+    """
+    Make *dst* a hard link to *src*, replacing anything already at *dst*
+    """
+    if trace.enabled:
+        trace.est_syscalls(1)
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        if trace.enabled:
+            trace.est_syscalls(2)
+        os.unlink(dst)
+        os.link(src, dst)
+
+
+# -----------------------------------------------------------------------------
+def unshare(path):
+    """
+    Remove *path* if it's hard linked (to a read-only template or a stored
+    blob, by --link), so that writing it makes a new file instead of
+    truncating the one it's linked to
+    """
+    if trace.enabled:
+        trace.est_syscalls(1)
+    try:
+        if os.stat(path).st_nlink > 1:
+            if trace.enabled:
+                trace.est_syscalls(1)
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+# -----------------------------------------------------------------------------
+def run_pool(func, pairs, jobs=DEFAULT_JOBS):
+    """
+    Call *func(src, dst)* for each pair in *pairs* on up to *jobs* threads
+    and return the sum of the results. Small batches run inline.
+    """
+    pairs = list(pairs)
+    jobs = max(1, int(jobs or 1))
+    if jobs == 1 or len(pairs) < 2:
+        return sum(func(src, dst) for src, dst in pairs)
+
+    with futures.ThreadPoolExecutor(max_workers=min(jobs, len(pairs))) as ex:
+        return sum(ex.map(lambda pair: func(*pair), pairs))
+
+
+# -----------------------------------------------------------------------------
+def _copy_range(rfd, wfd, size, bufsize):
+    """
+    Copy with os.copy_file_range(). Return the byte count, or None if nothing
+    was copied and the caller should try something else.
+    """
+    if not hasattr(os, 'copy_file_range'):
+        return None
+    return _kernel_loop(lambda left: os.copy_file_range(rfd, wfd, left),
+                        size, bufsize)
+
+
+# -----------------------------------------------------------------------------
+def _copy_sendfile(rfd, wfd, size, bufsize):
+    """
+    Copy with os.sendfile(). Return the byte count, or None if nothing was
+    copied and the caller should try something else.
+    """
+    if not hasattr(os, 'sendfile'):
+        return None
+    offset = [0]
+
+    def chunk(left):
+        sent = os.sendfile(wfd, rfd, offset[0], left)
+        offset[0] += sent
+        return sent
+
+    return _kernel_loop(chunk, size, bufsize)
+
+
+# -----------------------------------------------------------------------------
+def _is_sparse(st):
+    """
+    Return True if the file with stat result *st* has holes we can find
+    """
+    return (hasattr(os, 'SEEK_DATA') and hasattr(st, 'st_blocks') and
+            st.st_blocks * 512 < st.st_size)
+
+
+# -----------------------------------------------------------------------------
+def _copy_sparse(rfd, wfd, size, bufsize):
+    """
+    Copy just the data extents of *rfd* to the same offsets in *wfd*, then
+    set *wfd*'s size, leaving holes where *rfd* has them. Return the bytes
+    of data copied, or None if the filesystem can't report holes and the
+    caller should copy the ordinary way.
+    """
+    pos = 0
+    done = 0
+    while pos < size:
+        if trace.enabled:
+            trace.est_syscalls(2)
+        try:
+            start = os.lseek(rfd, pos, os.SEEK_DATA)
+        except OSError as err:
+            if err.errno == errno.ENXIO:
+                # nothing but a hole from pos to the end
+                break
+            if pos == 0 and err.errno in _FALLBACK:
+                return None
+            raise
+        end = min(os.lseek(rfd, start, os.SEEK_HOLE), size)
+        done += _copy_extent(rfd, wfd, start, end - start, bufsize)
+        pos = end
+    os.ftruncate(wfd, size)
+    return done
+
+
+# -----------------------------------------------------------------------------
+def _copy_extent(rfd, wfd, offset, length, bufsize):
+    """
+    Copy *length* bytes at *offset* in *rfd* to the same place in *wfd*, in
+    the kernel if possible, else through one buffer of *bufsize* bytes.
+    Return *length*.
+    """
+    left = length
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while left:
+                if trace.enabled:
+                    trace.est_syscalls(1)
+                count = os.copy_file_range(rfd, wfd, min(left, bufsize),
+                                           offset + length - left,
+                                           offset + length - left)
+                if count == 0:
+                    raise IOError("file shrank while copying")
+                left -= count
+            return length
+        except OSError as err:
+            if left != length or err.errno not in _FALLBACK:
+                raise
+
+    buf = memoryview(bytearray(min(bufsize, length)))
+    while left:
+        pos = offset + length - left
+        if trace.enabled:
+            trace.est_syscalls(2)
+        count = _pread_into(rfd, buf[:min(left, len(buf))], pos)
+        if count == 0:
+            raise IOError("file shrank while copying")
+        written = 0
+        while written < count:
+            written += os.pwrite(wfd, buf[written:count], pos + written)
+        left -= count
+    return length
+
+
+# -----------------------------------------------------------------------------
+def _pread_into(fd, buf, offset):
+    """
+    Read into *buf* from *offset* in *fd* without allocating. Return the
+    byte count.
+    """
+    if hasattr(os, 'preadv'):
+        return os.preadv(fd, [buf], offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.readv(fd, [buf])
+
+
+# -----------------------------------------------------------------------------
+def _kernel_loop(chunk, size, bufsize):
+    """
+    Call *chunk(bytes_left)* until it reports end of file. If the very first
+    call fails with one of the fallback errnos, return None. A size of 0 may
+    just mean the file is in a pseudo-filesystem that doesn't report sizes,
+    so in that case we let the buffered copy handle it.
+    """
+    if size == 0:
+        return None
+    done = 0
+    while True:
+        if trace.enabled:
+            trace.est_syscalls(1)
+        try:
+            count = chunk(max(size - done, bufsize))
+        except OSError as err:
+            if done == 0 and err.errno in _FALLBACK:
+                return None
+            raise
+        if count == 0:
+            return done
+        done += count
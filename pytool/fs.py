@@ -0,0 +1,524 @@
+"""
+pytool.fs - where generated files go
+
+The generation functions (create_project(), create_prog_tool(),
+setup_config_dir()) write through a filesystem backend passed as *fs*:
+
+    LocalFS     the real filesystem (the default), with the kernel copy,
+                link, and single-pass render paths
+    MemoryFS    a dict of path -> bytes; nothing touches the disk
+    OverlayFS   a MemoryFS on top of another backend: reads fall through to
+                the lower one, writes stay in memory
+    ArchiveFS   a tar or zip archive streamed to a file or pipe as files are
+                written; nothing else touches the disk
+
+Template files are always read from the real filesystem (or the bundle);
+only the output goes through the backend. Paths are used as given, after
+normalizing, so a MemoryFS filled by generating 'demo' has keys like
+'demo/setup.py'.
+"""
+import collections
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+from pytool import copier
+from pytool import render
+from pytool import trace
+from pytool.msgcat import mcat
+
+
+ARCHIVE_KINDS = ('tar', 'tar.gz', 'zip')
+
+
+# -----------------------------------------------------------------------------
+class Backend(object):
+    """
+    What the backends have in common
+    """
+    def write_tree(self, files):
+        """
+        Write *files*, a dict mapping paths to content, creating each
+        directory they need once. Return the number of bytes written.
+        """
+        self.makedirs_tree(sorted({os.path.dirname(x) for x in files} -
+                                  {''}))
+        return sum(self.write(path, data) for path, data in files.items())
+
+    def makedirs_tree(self, paths):
+        """
+        Create the directories in *paths*, which lists each one ahead of
+        anything below it
+        """
+        for path in paths:
+            self.makedirs(path)
+
+
+# -----------------------------------------------------------------------------
+class LocalFS(Backend):
+    """
+    Write to the real filesystem
+    """
+    def makedirs(self, path):
+        """
+        Create directory *path* and any missing parents. Raise
+        FileExistsError if *path* (or a parent) is a file.
+        """
+        if trace.enabled:
+            # a stat of the parent and a mkdir, at least
+            trace.est_syscalls(2)
+        os.makedirs(path, exist_ok=True)
+
+    def makedirs_tree(self, paths):
+        """
+        Create the directories in *paths*, which lists each one ahead of
+        anything below it, each once. A directory whose parent was just
+        made here needs no checking, only a mkdir; the others (normally
+        just the top) go through makedirs().
+        """
+        made = set()
+        for path in paths:
+            path = os.path.normpath(path)
+            if path in made:
+                continue
+            if os.path.dirname(path) in made:
+                if trace.enabled:
+                    trace.est_syscalls(1)
+                try:
+                    os.mkdir(path)
+                except FileExistsError:
+                    if not os.path.isdir(path):
+                        raise
+            else:
+                self.makedirs(path)
+            made.add(path)
+
+    def exists(self, path):
+        """
+        Return True if anything is at *path*
+        """
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        """
+        Return True if *path* is a directory
+        """
+        return os.path.isdir(path)
+
+    def read(self, path):
+        """
+        Return the content of file *path*
+        """
+        with open(path, 'rb') as rbl:
+            return rbl.read()
+
+    def write(self, path, data, atomic=False):
+        """
+        Write *data* (bytes or a memoryview) to file *path*. With *atomic*,
+        write a temporary file next to it and rename it into place. Return
+        the number of bytes written.
+        """
+        if trace.enabled:
+            return trace.file_op(path, self._write, path, data, atomic)
+        return self._write(path, data, atomic)
+
+    def _write(self, path, data, atomic):
+        """
+        Do the work of write()
+        """
+        if atomic:
+            dst = "{}.{}".format(path, os.getpid())
+        else:
+            dst = path
+            copier.unshare(path)
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            done = 0
+            while done < len(data):
+                done += os.write(fd, data[done:])
+                if trace.enabled:
+                    trace.est_syscalls(1)
+        finally:
+            os.close(fd)
+        if atomic:
+            os.replace(dst, path)
+        if trace.enabled:
+            # open, close, rename
+            trace.est_syscalls(3 if atomic else 2)
+        return done
+
+    def place(self, src, dst, link='copy', bufsize=copier.BUFSIZE):
+        """
+        Put template file *src* at *dst* as copier.place_file() does
+        """
+        if trace.enabled:
+            return trace.file_op(dst, copier.place_file, src, dst, link=link,
+                                 bufsize=bufsize)
+        return copier.place_file(src, dst, link=link, bufsize=bufsize)
+
+    def remove(self, path):
+        """
+        Remove file or directory tree *path*, if it's there
+        """
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def render(self, plan, dst, variables):
+        """
+        Write *plan* rendered with *variables* to *dst* in one pass
+        """
+        if trace.enabled:
+            return trace.file_op(dst, render.write, plan, dst, variables)
+        return render.write(plan, dst, variables)
+
+    def digest(self, path):
+        """
+        Return the sha256 hex digest of file *path*, or None if it's missing
+        """
+        from pytool import update
+        return update.file_hash(path)
+
+
+# -----------------------------------------------------------------------------
+class MemoryFS(Backend):
+    """
+    Keep written files in memory. *files* maps each path written to its
+    content; *dirs* is the set of directories created.
+    """
+    def __init__(self):
+        self.files = {}
+        self.dirs = set()
+
+    def makedirs(self, path):
+        """
+        Record directory *path* and its parents. Raise FileExistsError if
+        one of them is a file.
+        """
+        path = os.path.normpath(path)
+        while path not in ('', '.', os.sep) and not self.isdir(path):
+            if self.exists(path):
+                raise FileExistsError("{}: file exists".format(path))
+            self.dirs.add(path)
+            path = os.path.dirname(path)
+
+    def exists(self, path):
+        """
+        Return True if *path* is a file or directory here
+        """
+        path = os.path.normpath(path)
+        return path in self.files or path in self.dirs
+
+    def isdir(self, path):
+        """
+        Return True if *path* is a directory here
+        """
+        return os.path.normpath(path) in self.dirs
+
+    def read(self, path):
+        """
+        Return the content of file *path*. Raise FileNotFoundError if there
+        isn't one.
+        """
+        try:
+            return self.files[os.path.normpath(path)]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def write(self, path, data, atomic=False):
+        """
+        Store *data* as the content of *path*. Replacing a dict entry is
+        already atomic, so *atomic* changes nothing.
+        """
+        self.files[os.path.normpath(path)] = bytes(data)
+        return len(data)
+
+    def place(self, src, dst, link='copy', bufsize=copier.BUFSIZE):
+        """
+        Store the content of template file *src* (decompressed, if it's
+        compressed) at *dst*. There's nothing to link to in memory, so
+        *link* is ignored, and the content is all in memory anyway, so
+        *bufsize* is too.
+        """
+        from pytool import compress
+        with compress.reader(src) as rbl:
+            return self.write(dst, rbl.read())
+
+    def remove(self, path):
+        """
+        Forget file or directory *path* and everything below it
+        """
+        path = os.path.normpath(path)
+        lead = path + os.sep
+        for key in [x for x in self.files if x == path or x.startswith(lead)]:
+            del self.files[key]
+        self.dirs = {x for x in self.dirs
+                     if x != path and not x.startswith(lead)}
+
+    def render(self, plan, dst, variables):
+        """
+        Store *plan* rendered with *variables* at *dst*
+        """
+        return self.write(dst, render.render_bytes(plan, variables))
+
+    def digest(self, path):
+        """
+        Return the sha256 hex digest of *path*, or None if it's missing
+        """
+        from pytool import update
+        try:
+            return update.data_hash(self.read(path))
+        except FileNotFoundError:
+            return None
+
+
+# -----------------------------------------------------------------------------
+class OverlayFS(MemoryFS):
+    """
+    A MemoryFS over *lower* (by default the real filesystem). Lookups that
+    miss in memory go to *lower*; nothing is ever written to it.
+    """
+    def __init__(self, lower=None):
+        super(OverlayFS, self).__init__()
+        self.lower = lower or LocalFS()
+
+    def exists(self, path):
+        """
+        Return True if *path* is here or below
+        """
+        return (super(OverlayFS, self).exists(path) or
+                self.lower.exists(path))
+
+    def isdir(self, path):
+        """
+        Return True if *path* is a directory here or below
+        """
+        return (super(OverlayFS, self).isdir(path) or
+                self.lower.isdir(path))
+
+    def read(self, path):
+        """
+        Return the content of file *path* from memory, else from below
+        """
+        try:
+            return super(OverlayFS, self).read(path)
+        except FileNotFoundError:
+            return self.lower.read(path)
+
+    def digest(self, path):
+        """
+        Return the sha256 hex digest of *path* here, else below
+        """
+        if os.path.normpath(path) in self.files:
+            return super(OverlayFS, self).digest(path)
+        return self.lower.digest(path)
+
+
+# -----------------------------------------------------------------------------
+class ArchiveFS(Backend):
+    """
+    Stream what's written into an archive on *out*, a binary file object
+    that needn't be seekable (a pipe will do). *kind* is one of
+    ARCHIVE_KINDS. Members are named by their paths, made relative, and
+    stamped with *mtime* (default: now). File contents are streamed from
+    the templates a buffer at a time, so memory use doesn't depend on their
+    size. Call close() to finish the archive.
+    """
+    def __init__(self, out, kind, mtime=None):
+        if kind not in ARCHIVE_KINDS:
+            raise ValueError("{}: '{}'".format(mcat['badarch'], kind))
+        self.kind = kind
+        self.mtime = int(time.time() if mtime is None else mtime)
+        self.dirs = set()
+        self.files = {}
+        self._lock = threading.Lock()
+        if kind == 'zip':
+            import zipfile
+            self._tar = None
+            self._zip = zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            import tarfile
+            self._zip = None
+            self._tar = tarfile.open(fileobj=out, mode='w|' + kind[4:],
+                                     format=tarfile.PAX_FORMAT)
+
+    def close(self):
+        """
+        Write the end of the archive. *out* is left open.
+        """
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+
+    def makedirs(self, path):
+        """
+        Add directory *path*, and each parent not already added, to the
+        archive
+        """
+        missing = []
+        path = _member(path)
+        while path not in ('', '.') and path not in self.dirs:
+            if path in self.files:
+                raise FileExistsError("{}: file exists".format(path))
+            missing.append(path)
+            path = os.path.dirname(path)
+        with self._lock:
+            for path in reversed(missing):
+                if path not in self.dirs:
+                    self.dirs.add(path)
+                    self._add(path, 0o755, None, 0)
+
+    def exists(self, path):
+        """
+        Return True if *path* has been added to the archive
+        """
+        path = _member(path)
+        return path in self.files or path in self.dirs
+
+    def isdir(self, path):
+        """
+        Return True if directory *path* has been added to the archive
+        """
+        return _member(path) in self.dirs
+
+    def write(self, path, data, atomic=False):
+        """
+        Add file *path* holding *data* (bytes or a memoryview). A member
+        appears all at once, so *atomic* changes nothing.
+        """
+        return self._add_file(path, 0o644, _Chunks([data]), len(data))
+
+    def place(self, src, dst, link='copy', bufsize=copier.BUFSIZE):
+        """
+        Add file *dst* holding the content of template file *src*
+        (decompressed, if it's compressed), with its permissions, read
+        *bufsize* bytes at a time. There's nothing to link to in an archive,
+        so *link* is ignored.
+        """
+        from pytool import compress
+        mode = os.stat(src).st_mode & 0o777
+        if compress.suffix(src):
+            # the header needs the size before the content goes out, so
+            # decompress it once just to count
+            size = 0
+            with compress.reader(src) as rbl:
+                for chunk in iter(lambda: rbl.read(bufsize), b""):
+                    size += len(chunk)
+        else:
+            size = os.stat(src).st_size
+        with compress.reader(src) as rbl:
+            return self._add_file(dst, mode, rbl, size, bufsize)
+
+    def render(self, plan, dst, variables):
+        """
+        Add file *dst* holding *plan* rendered with *variables*
+        """
+        bufs = render.chunks(plan, variables)
+        return self._add_file(dst, 0o644, _Chunks(bufs),
+                              sum(len(x) for x in bufs))
+
+    def digest(self, path):
+        """
+        Return the sha256 hex digest of file *path* as it was added, or None
+        if it wasn't
+        """
+        return self.files.get(_member(path))
+
+    def _add_file(self, path, mode, rbl, size, bufsize=copier.BUFSIZE):
+        """
+        Add file *path* with permissions *mode*, reading its *size* bytes
+        from *rbl* (*bufsize* at a time, where we do the reading), and
+        remember its digest. Return *size*.
+        """
+        path = _member(path)
+        hashed = _Hashing(rbl)
+        with self._lock:
+            self._add(path, mode, hashed, size, bufsize)
+            self.files[path] = hashed.digest.hexdigest()
+        return size
+
+    def _add(self, name, mode, rbl, size, bufsize=copier.BUFSIZE):
+        """
+        Write a member to the archive: a directory if *rbl* is None, else a
+        file of *size* bytes read from *rbl*
+        """
+        if self._zip is not None:
+            import zipfile
+            info = zipfile.ZipInfo(name + ("/" if rbl is None else ""),
+                                   time.localtime(self.mtime)[:6])
+            ftype = 0o040000 if rbl is None else 0o100000
+            info.external_attr = (ftype | mode) << 16
+            if rbl is None:
+                self._zip.writestr(info, b"")
+                return
+            info.compress_type = zipfile.ZIP_DEFLATED
+            big = size >= zipfile.ZIP64_LIMIT
+            with self._zip.open(info, 'w', force_zip64=big) as wbl:
+                shutil.copyfileobj(rbl, wbl, bufsize)
+            return
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.mode = mode
+        info.mtime = self.mtime
+        if rbl is None:
+            info.type = tarfile.DIRTYPE
+        else:
+            info.size = size
+        self._tar.addfile(info, rbl)
+
+
+# -----------------------------------------------------------------------------
+class _Chunks(object):
+    """
+    A file-like reader over a list of buffers
+    """
+    def __init__(self, bufs):
+        self._bufs = collections.deque(memoryview(x).cast('B') for x in bufs)
+
+    def read(self, size=-1):
+        """
+        Return up to *size* bytes (all that's left if *size* is negative)
+        """
+        rval = bytearray()
+        while self._bufs and (size < 0 or len(rval) < size):
+            buf = self._bufs.popleft()
+            want = len(buf) if size < 0 else min(len(buf), size - len(rval))
+            rval += buf[:want]
+            if want < len(buf):
+                self._bufs.appendleft(buf[want:])
+        return bytes(rval)
+
+
+# -----------------------------------------------------------------------------
+class _Hashing(object):
+    """
+    A reader passing reads through to *rbl*, hashing what they return
+    """
+    def __init__(self, rbl):
+        self._rbl = rbl
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        """
+        Read from the wrapped reader
+        """
+        data = self._rbl.read(size)
+        self.digest.update(data)
+        return data
+
+
+# -----------------------------------------------------------------------------
+def _member(path):
+    """
+    Return *path* as an archive member name: normalized, relative, with '/'
+    separators
+    """
+    path = os.path.normpath(path).lstrip(os.sep)
+    return path.replace(os.sep, "/")
@@ -0,0 +1,144 @@
+"""
+pytool.layers - templates_dir as a stack of overlay directories
+
+templates_dir in pytool.ini may name several directories separated by ':',
+lowest layer first:
+
+    templates_dir = /srv/templates/base:team:~/.pytool/templates
+
+Relative layers are taken relative to the config dir. Each template path
+comes from the highest layer that has it, so a team or personal layer only
+needs the files it changes (a file replaces a directory of the same name
+below it, and the other way around).
+
+Rather than probing each layer for each file, the layers' manifests (see
+pytool.manifest) are merged once into an index mapping each path to the
+layer it comes from. The index is kept for the life of the process and
+rebuilt only when one of the manifests is, that is, when a directory in one
+of the layers changes; checking costs a stat per directory per layer, as
+for a single templates directory. With one layer, there is nothing to merge
+and paths are joined to it directly.
+"""
+import errno
+import os
+import threading
+
+from pytool import manifest
+from pytool import trace
+
+
+# tuple of roots -> (list of the layer manifests, Index)
+_memo = {}
+_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+class Single(object):
+    """
+    The templates when templates_dir names one directory, *root*
+    """
+    def __init__(self, root, cachedir=None):
+        self.roots = [root]
+        self.cachedir = cachedir
+
+    def tree(self, prefix):
+        """
+        Return manifest.Entry tuples for everything below directory *prefix*,
+        with paths relative to it, each directory ahead of its contents
+        """
+        return manifest.load(os.path.join(self.roots[0], prefix),
+                             cachedir=self.cachedir)
+
+    def source(self, relpath):
+        """
+        Return the path of the file holding template *relpath*
+        """
+        return os.path.join(self.roots[0], relpath)
+
+
+# -----------------------------------------------------------------------------
+class Index(object):
+    """
+    The merged view of the layers *roots* (lowest first), built from their
+    manifests *trees*
+    """
+    def __init__(self, roots, trees):
+        self.roots = roots
+        # relpath -> (root, Entry), in walk order
+        self.winner = {}
+        self._trees = {}
+        for root, tree in zip(roots, trees):
+            for entry in tree:
+                prev = self.winner.get(entry.path)
+                if prev is not None and prev[1].isdir != entry.isdir:
+                    self._drop(entry.path)
+                self.winner[entry.path] = (root, entry)
+
+    def _drop(self, relpath):
+        """
+        Forget *relpath* and, if it was a directory, what was below it
+        """
+        lead = relpath + os.sep
+        for key in [x for x in self.winner
+                    if x == relpath or x.startswith(lead)]:
+            del self.winner[key]
+
+    def tree(self, prefix):
+        """
+        Return manifest.Entry tuples for everything below directory *prefix*
+        in any layer, with paths relative to it, each directory ahead of its
+        contents
+        """
+        if prefix not in self._trees:
+            lead = prefix + os.sep
+            self._trees[prefix] = [
+                entry._replace(path=relpath[len(lead):])
+                for relpath, (_, entry) in self.winner.items()
+                if relpath.startswith(lead)]
+        return self._trees[prefix]
+
+    def source(self, relpath):
+        """
+        Return the path of the file holding template *relpath* in the
+        highest layer that has it. Raise FileNotFoundError if none does.
+        """
+        try:
+            root, _ = self.winner[os.path.normpath(relpath)]
+        except KeyError:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT),
+                                    relpath) from None
+        return os.path.join(root, relpath)
+
+
+# -----------------------------------------------------------------------------
+def split(value, base):
+    """
+    Return the directories named in templates_dir *value*, lowest first,
+    with '~' expanded and relative ones taken relative to *base*
+    """
+    return [os.path.normpath(os.path.join(base, os.path.expanduser(x)))
+            for x in value.split(":") if x.strip()]
+
+
+# -----------------------------------------------------------------------------
+def load(roots, cachedir=None):
+    """
+    Return the templates in the layers *roots* (lowest first) as a Single
+    or an Index, reusing the Index built last time unless a layer has
+    changed since
+    """
+    if len(roots) == 1:
+        return Single(roots[0], cachedir)
+    roots = [os.path.abspath(x) for x in roots]
+    trees = [manifest.load(x, cachedir=cachedir) if os.path.isdir(x) else ()
+             for x in roots]
+    key = tuple(roots)
+    with _lock:
+        cached = _memo.get(key)
+        if cached and all(x is y for x, y in zip(cached[0], trees)):
+            return cached[1]
+    with trace.span('merge', layers=len(roots)):
+        index = Index(roots, trees)
+    with _lock:
+        _memo[key] = (trees, index)
+    return index
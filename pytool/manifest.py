@@ -0,0 +1,164 @@
+"""
+pytool.manifest - remember what's in a template tree
+
+Walking a template tree costs a stat per entry, which adds up when the
+config dir lives on a network filesystem. A manifest records each entry's
+relative path, type, size, mtime, and mode, along with the mtime of every
+directory in the tree. As long as none of the directory mtimes has changed,
+no entry has been added, removed, or renamed, so the manifest can be used
+instead of a fresh walk. That takes one stat per directory rather than one
+per entry.
+
+Manifests are kept in memory for the life of the process and on disk in
+cfgdir()/manifests, one JSON file per template root. Sizes and mtimes
+describe the files as of the last rebuild; a file edited in place (which
+doesn't touch its directory's mtime) is still copied with its current
+content.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import os
+import threading
+
+from pytool import trace
+
+
+VERSION = 1
+
+Entry = namedtuple('Entry', ['path', 'isdir', 'size', 'mtime', 'mode'])
+
+# root -> (dirs, entries)
+_memo = {}
+
+
+# -----------------------------------------------------------------------------
+def load(root, cachedir=None):
+    """
+    Return the list of Entry tuples for the tree below *root*, in walk order
+    (each directory precedes its contents). If *cachedir* is given, the
+    manifest is read from and saved to a file there.
+    """
+    root = os.path.abspath(root)
+    dirs, entries = _memo.get(root, (None, None))
+    if dirs is None and cachedir:
+        dirs, entries = _read(manifest_path(root, cachedir), root)
+    if dirs is not None and is_current(root, dirs):
+        _memo[root] = (dirs, entries)
+        return entries
+
+    dirs, entries = build(root)
+    _memo[root] = (dirs, entries)
+    if cachedir:
+        _write(manifest_path(root, cachedir), root, dirs, entries)
+    return entries
+
+
+# -----------------------------------------------------------------------------
+@trace.spanned('walk')
+def build(root):
+    """
+    Walk *root* and return (dirs, entries) where dirs maps each directory's
+    relative path ('' for root) to its mtime and entries is a list of Entry
+    tuples in walk order
+    """
+    dirs = {'': os.stat(root).st_mtime_ns}
+    entries = []
+    _walk(root, '', dirs, entries)
+    return dirs, entries
+
+
+# -----------------------------------------------------------------------------
+def is_current(root, dirs):
+    """
+    Return True if every directory recorded in *dirs* still has the recorded
+    mtime
+    """
+    if trace.enabled:
+        trace.est_syscalls(len(dirs))
+    for relpath, mtime in dirs.items():
+        try:
+            if os.stat(os.path.join(root, relpath)).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+# -----------------------------------------------------------------------------
+def invalidate(root=None):
+    """
+    Forget the in-memory manifest for *root*, or for all roots if *root* is
+    None. The on-disk copy will be revalidated on the next load().
+    """
+    if root is None:
+        _memo.clear()
+    else:
+        _memo.pop(os.path.abspath(root), None)
+
+
+# -----------------------------------------------------------------------------
+def manifest_path(root, cachedir):
+    """
+    Return the path of the manifest file for *root* in *cachedir*
+    """
+    key = hashlib.sha1(root.encode()).hexdigest()[:16]
+    return os.path.join(cachedir, "manifests", key + ".json")
+
+
+# -----------------------------------------------------------------------------
+def _walk(top, reltop, dirs, entries):
+    """
+    Add the entries below *top* to *entries*, recursing into directories
+    """
+    with os.scandir(top) as ents:
+        ents = sorted(ents, key=lambda x: x.name)
+    if trace.enabled:
+        # open, getdents until it comes back empty, close, and a stat per
+        # entry; is_dir() and is_file() come from the dirent type
+        trace.est_syscalls(4 + len(ents))
+    for ent in ents:
+        relpath = os.path.join(reltop, ent.name)
+        st = ent.stat()
+        if ent.is_dir():
+            dirs[relpath] = st.st_mtime_ns
+            entries.append(Entry(relpath, True, 0, st.st_mtime_ns,
+                                 st.st_mode & 0o7777))
+            _walk(ent.path, relpath, dirs, entries)
+        elif ent.is_file():
+            entries.append(Entry(relpath, False, st.st_size, st.st_mtime_ns,
+                                 st.st_mode & 0o7777))
+
+
+# -----------------------------------------------------------------------------
+def _read(path, root):
+    """
+    Read a manifest file. Return (dirs, entries), or (None, None) if the file
+    is missing, unreadable, or for some other root or format version.
+    """
+    try:
+        with open(path) as rbl:
+            data = json.load(rbl)
+        if data['version'] != VERSION or data['root'] != root:
+            return None, None
+        return data['dirs'], [Entry(*x) for x in data['entries']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, None
+
+
+# -----------------------------------------------------------------------------
+def _write(path, root, dirs, entries):
+    """
+    Save a manifest file, replacing any old one atomically. A config dir we
+    can't write to just means we'll walk the tree again next time.
+    """
+    data = {'version': VERSION, 'root': root, 'dirs': dirs,
+            'entries': [list(x) for x in entries]}
+    tmp = "{}.{}.{}".format(path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'w') as wbl:
+            json.dump(data, wbl, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError:
+        pass
@@ -1,10 +1,23 @@
-mcat = {'author':   "author=\"Your Name\",",
-        'authmail': "author_email=\"your_address@domain.com\",",
+mcat = {'author':   "author=\"{{author}}\",",
+        'authmail': "author_email=\"{{author_email}}\",",
+        'badarch':  "Archive must be tar, tar.gz, or zip",
+        'badcomp':  "Compression must be gz, xz, or bz2",
+        'badjob':   "Unknown batch command",
+        'badlink':  "Link must be copy, hard, reflink, or auto",
+        'badplan':  "Not a pytool generation plan",
+        'badpool':  "Pool must be 'process' or 'thread'",
+        'badprof':  "Not a usable profile name or index",
+        'badvar':   "--var wants NAME=VALUE",
+        'badsize':  "Not a size (bytes, or a number with K, M, or G)",
+        'bundle':   "templates.bundle",
+        'cache':    "cache",
+        'cachemax': "100M",
         'callmain': "main()",
-        'callstp':  "setup(name=\"PROJECT\"",
+        'callstp':  "setup(name=\"{{project}}\",",
         'closep':   ")",
         'cmd':      "command not found",
         'cmdline':  "prog [-d] ARG ARG ...",
+        'conflicts': "conflict (edited locally, template changed)",
         'debug':    "-d      use the debugger",
         'defmn':    "def main():",
         'deffunc':  "def function_name(**kwa):",
@@ -17,10 +30,66 @@ mcat = {'author':   "author=\"Your Name\",",
                      "--------------------------------"),
         'dot_pt':   ".pytool",
         'empty':    "",
-        'entpts':   "entry_points={'console_scripts': [proj = proj:main]}",
+        'entpts':   ("entry_points={'console_scripts': "
+                     "['{{project}} = {{project}}:main']},"),
         'env':      "env",
         'flake':    "flake8 pytool test",
+        'genmani':  ".pytool-manifest.json",
         'handle':   "print(\"Handle 'prog cmd ARGS' here\")",
+        'hlpapplytxt': """
+        'pytool apply PLAN [ROOT]' carries out a generation plan written by
+        'pytool project --plan PLAN PATH' ('-' reads it from stdin). The
+        project is created in ROOT, or where PATH was if ROOT isn't given,
+        exactly as 'pytool project' would have created it, with up to -j N
+        files written at a time. pytool.ini isn't read and the templates
+        aren't walked; only the template files the plan names are.
+        """,
+        'hlpbatchtxt': """
+        'pytool batch [FILE]' reads jobs from FILE (or stdin), one JSON object
+        per line, like
+
+           {"command": "project", "path": "/tmp/proj", "options": {}}
+
+        where command is 'project', 'program', or 'tool'. The config and
+        templates are loaded once and the jobs are run on a pool of -j N
+        workers (--pool thread or --pool process). A JSON result line with
+        the job number, success, error, and elapsed time is written for each
+        job as it finishes.
+        """,
+        'hlpbenchtxt': """
+        'pytool bench' runs the benchmarks in the benchmarks directory of the
+        source tree (or --suite DIR): startup, config resolution, and
+        create_project() against synthetic template trees of --sizes files
+        (default 10,1000,10000,100000). Each case is run --repeat times and
+        the results are written as JSON to -o FILE (default stdout). With
+        --compare OLD, each case's median is compared with the one in OLD
+        and the ones that got slower are flagged on stderr. -k GLOB runs
+        only the cases whose names match.
+        """,
+        'hlpcachetxt': """
+        'pytool cache' reports how many template copies the local template
+        cache holds and how big it is; --clear empties it. The cache is set
+        up in pytool.ini:
+
+           [cache]
+           dir = /var/tmp/pytool-cache
+           max_size = 200M
+
+        With it, project, program, and tool read each template from a copy
+        in dir, made the first time it's used and again whenever it changes.
+        The least recently used copies are removed when the cache grows past
+        max_size. Run with PYTOOL_TRACE to see the cache_hits and
+        cache_misses counts for a run.
+        """,
+        'hlppacktxt': """
+        'pytool pack-templates' packs the templates directory into a single
+        indexed file, templates.bundle, in the config dir. While the bundle
+        exists, project, program, and tool read their templates from it
+        through mmap instead of opening each template file. Keep editing the
+        templates directory as usual; the bundle is repacked automatically
+        when anything there changes. Remove the bundle to go back to reading
+        the directory.
+        """,
         'hlpprogtxt': """
         'pytool program PATH' will create a python program at PATH. If PATH
         ends with '.py', your code will be importable. You can run your program
@@ -38,13 +107,41 @@ mcat = {'author':   "author=\"Your Name\",",
         """,
         'hlpprojtxt': """
         'pytool project PATH' will create a directory at PATH and drop in the
-        skeleton of a python project. After creating your project, to add
-        version control, you might do:
+        skeleton of a python project. With --profile NAME, the skeleton comes
+        from template profile NAME (see 'pytool help store'). With --plan
+        FILE, nothing is created: what would be done is written to FILE for
+        'pytool apply' (see 'pytool help apply'). With --archive tar,
+        tar.gz, or zip, the project is streamed into an archive on -o FILE
+        (default: stdout) instead, with its top directory named for the
+        last component of PATH. After creating your project, to add version
+        control, you might do:
 
            $ cd PATH
            $ git init
            $ git add .
         """,
+        'hlpservetxt': """
+        'pytool serve' runs a generation daemon listening on a Unix socket
+        (pytool.sock in the config dir, or $PYTOOL_SOCKET). It keeps the
+        config and template manifests loaded, checking them for changes on
+        each request, and handles requests concurrently. Use
+
+           $ pytool --client project PATH
+
+        (or program, or tool) to have the daemon do the work. If no daemon is
+        running, the client does the work itself.
+        """,
+        'hlpstoretxt': """
+        'pytool store NAME [DIR]' stores the project template tree DIR
+        (default: templates/prjdir) as profile NAME in the content-addressed
+        store in the config dir, replacing any profile of that name. Each
+        distinct file content is stored once however many profiles use it.
+        'pytool project --profile NAME PATH' generates from the profile.
+        Storing the same NAME again updates it from DIR. 'pytool store' with
+        no NAME lists the stored profiles. With compress = gz, xz, or bz2 in
+        the [pytool] section of pytool.ini, new contents are stored
+        compressed.
+        """,
         'hlptooltxt': """
         'pytool tool PATH' will create a python program at PATH that has
         command line dispatchable entry points (i.e., sub-commands). pytool is
@@ -69,15 +166,24 @@ mcat = {'author':   "author=\"Your Name\",",
         'impsys':   "import sys",
         'isfile':   "is a file, cannot mkdir",
         'lchome':   "home",
+        'layered':  ("Can't pack layered templates (templates_dir names"
+                     " several directories)"),
+        'lockext':  ".lock",
         'mbdir':    "$HOME must be a directory",
         'mbset':    "PYTOOL_DIR or HOME must be set",
         'mcom':     "main entrypoint",
         'newline':  "\n",
+        'nobench':  "No bench_*.py files (try --suite DIR)",
+        'nocache':  "No template cache (set dir in pytool.ini's [cache])",
         'nonesuch': "nonesuch",
+        'nomani':   "No generation manifest (not made by pytool project?)",
+        'nopath':   "Job has no path",
+        'noprof':   "No such template profile",
         'nosuch':   "No such file or directory",
         'notdir':   "is not a directory",
         'options':  "Options:",
         'please':   "Please set PYTOOL_DIR or HOME",
+        'packed':   "Packed",
         'prargs':   "print(sys.argv)",
         'prog_py':  "prog.py",
         'program':  "program",
@@ -86,15 +192,25 @@ mcat = {'author':   "author=\"Your Name\",",
         'pthelp':   "pytool --help",
         'pthlpcmd': "pytool help",
         'ptini':    "pytool.ini",
+        'ptsock':   "pytool.sock",
+        'ptsockenv': "PYTOOL_SOCKET",
+        'pttrace':  "PYTOOL_TRACE",
         'pyhelp':   "pytool help",
         'pytool':   "pytool",
+        'running':  "A pytool daemon is already listening on",
+        'serving':  "pytool daemon listening on",
+        'sidecar':  ".cache",
         'skel':     "produce skeletons for python programs",
+        'slower':   "SLOWER",
         'sqpt':     "[pytool]",
+        'store':    "store",
+        'stored':   "Stored",
         'stupdir':  "Setting up config dir",
         'stupflz':  "Writing config files",
         'stupmv':   "You can move the config dir by setting $PYTOOL_DIR",
         'testdoc':  "Test function description",
-        'title':    "# Project Title",
+        'textout':  "stdout takes only text here: use -o FILE",
+        'title':    "# {{project}}",
         'tmpl':     "templates",
         'tmpldir':  "templates_dir",
         'tool':     "tool",
@@ -107,6 +223,7 @@ mcat = {'author':   "author=\"Your Name\",",
         'usage':    "Usage:",
         'where':    "print(\"This is where your code goes\")",
         'writst':   "print(\"Put your test code here\")",
+        'written':  "updated",
         }
 
 mcat['hlpnone'] = "{} {}".format(mcat['pyhelp'], mcat['nonesuch'])
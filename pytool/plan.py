@@ -0,0 +1,141 @@
+"""
+pytool.plan - generation plans that can be written out and replayed
+
+'pytool project --plan FILE PATH' works out everything generating a
+project at PATH would do (the template tree walked, 'prjdir' mapped to the
+project name, each template checked for placeholders) and writes it to FILE
+instead of doing it. 'pytool apply FILE [ROOT]' then carries it out, in
+ROOT or where PATH was, without reading pytool.ini or walking the
+templates. Generating the same skeleton into many places costs the planning
+once, and plans are a dry run that can be reviewed or diffed.
+
+A plan is a text file of JSON lines. The first holds what applies to the
+whole plan:
+
+    {"link":"copy","name":"demo","profile":null,"pytool_plan":1,
+     "root":"/home/me","variables":{"author":"Ann Author",...}}
+
+and each line after it is one operation, in the order they're done:
+
+    ["mkdir","demo/test"]
+    ["copy","demo/setup.py","setup.py","/home/me/.pytool/templates/..."]
+    ["render","demo/README.md","README.md","/home/me/.pytool/templates/..."]
+
+that is, the kind, the path to create relative to the root, and for files
+the template path (as recorded in the generation manifest) and the file
+holding the template. Templates are read when the plan is applied, so a
+plan picks up edits to the template files, but not added or removed ones.
+"""
+from collections import namedtuple
+import json
+import os
+
+from pytool import trace
+from pytool.msgcat import mcat
+
+
+VERSION = 1
+
+Plan = namedtuple('Plan', ['name', 'root', 'variables', 'link', 'profile',
+                           'ops'])
+Op = namedtuple('Op', ['kind', 'target', 'template', 'source'])
+
+
+# -----------------------------------------------------------------------------
+def dump(plan, wbl):
+    """
+    Write *plan* to the open text file *wbl*
+    """
+    head = {'pytool_plan': VERSION, 'name': plan.name, 'root': plan.root,
+            'link': plan.link, 'profile': plan.profile,
+            'variables': plan.variables}
+    wbl.write(_line(head))
+    for op in plan.ops:
+        wbl.write(_line(list(op[:2]) if op.kind == 'mkdir' else list(op)))
+
+
+# -----------------------------------------------------------------------------
+def load(rbl):
+    """
+    Read a plan from the open text file *rbl* and return it. Raise
+    ValueError if it isn't one.
+    """
+    from pytool import copier
+    try:
+        head = json.loads(rbl.readline())
+        if head.get('pytool_plan') != VERSION:
+            raise ValueError
+        copier.check_link(head['link'])
+        ops = []
+        for line in rbl:
+            if line.strip():
+                fields = json.loads(line)
+                op = Op(*fields, *[None] * (4 - len(fields)))
+                if op.kind not in ('mkdir', 'copy', 'render'):
+                    raise ValueError
+                ops.append(op)
+        return Plan(head['name'], head['root'], head['variables'],
+                    head['link'], head['profile'], ops)
+    except (ValueError, TypeError, AttributeError, KeyError):
+        raise ValueError(mcat['badplan']) from None
+
+
+# -----------------------------------------------------------------------------
+def apply(plan, root=None, jobs=None, fs=None):
+    """
+    Carry out *plan* in directory *root* (default: the one it was made
+    for), writing through filesystem backend *fs* (see pytool.fs) with up
+    to *jobs* files at a time, and leave a generation manifest as
+    create_project() does. Return the number of files written.
+    """
+    from pytool import copier
+    from pytool import render
+    from pytool import update
+    from pytool.fs import LocalFS
+    fs = fs or LocalFS()
+    jobs = jobs or copier.DEFAULT_JOBS
+    root = root or plan.root
+    trgdir = os.path.join(root, plan.name)
+    dirs = [trgdir]
+    pairs = []
+    generated = []
+    with trace.span('mkdir'):
+        for op in plan.ops:
+            if op.kind == 'mkdir':
+                dirs.append(os.path.join(root, op.target))
+            else:
+                pairs.append((op, os.path.join(root, op.target)))
+                generated.append((op.template,
+                                  os.path.relpath(pairs[-1][1], trgdir)))
+        fs.makedirs_tree(dirs)
+
+    # (template hash, file hash) for each file written, by target path
+    digests = {}
+
+    def emit(op, dst):
+        tplan = None
+        if op.kind == 'render':
+            tplan = render.plan_for_file(op.source)
+        digest = update.template_digest(op.source)
+        target = os.path.relpath(dst, trgdir)
+        if tplan:
+            digests[target] = (digest,
+                               update.render_hash(tplan, plan.variables))
+            return fs.render(tplan, dst, plan.variables)
+        digests[target] = (digest, digest)
+        return fs.place(op.source, dst, link=plan.link)
+
+    with trace.span('copy', files=len(pairs), jobs=jobs):
+        copier.run_pool(emit, pairs, jobs=jobs)
+    with trace.span('record'):
+        update.record(trgdir, generated, plan.variables, digests, jobs=jobs,
+                      fs=fs, profile=plan.profile)
+    return len(pairs)
+
+
+# -----------------------------------------------------------------------------
+def _line(obj):
+    """
+    Return *obj* as one compact line of JSON
+    """
+    return json.dumps(obj, separators=(',', ':'), sort_keys=True) + "\n"
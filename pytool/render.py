@@ -0,0 +1,197 @@
+"""
+pytool.render - fill in {{name}} placeholders in templates
+
+A template is compiled once into a plan: its content plus the offsets and
+names of the placeholders in it. Rendering walks the plan and hands the
+literal slices and the variable values to a single os.writev() call, so the
+output is written in one pass without building the whole result in memory.
+A template with no placeholders compiles to None, and the caller copies it
+with the ordinary (fast) copy path instead.
+
+Plans are cached for the life of the process, by the template's path, and
+reused while its mtime and size match, so each template is scanned once
+until it changes. A changed template's plan replaces the old one. Files
+bigger than MAX_TEMPLATE (data sets, disk images, ...) are taken to be
+assets rather than templates: they're never read in to be scanned, just
+copied as they are. Compressed templates (see pytool.compress) are
+decompressed to be scanned, as far as MAX_TEMPLATE.
+
+Variables come from the [variables] section of pytool.ini, then from the
+command line (--var NAME=VALUE), then from the target: 'project' is the
+name of the project or program being generated. Variable names are not
+case sensitive ({{Author}} and {{author}} are the same variable, since
+pytool.ini's keys are read in lower case), and values are taken as they
+are, '%' included. Placeholders naming no known variable are left as they
+are.
+"""
+from collections import namedtuple
+import os
+import re
+import threading
+
+from pytool import copier
+from pytool import trace
+from pytool.msgcat import mcat
+
+
+PLACEHOLDER = re.compile(rb"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+MAX_TEMPLATE = 4 * 1024 * 1024
+DEFAULTS = {'author': "Your Name",
+            'author_email': "your_address@domain.com"}
+
+Plan = namedtuple('Plan', ['data', 'spans'])
+
+# template -> (stamp, Plan or None)
+_memo = {}
+_lock = threading.Lock()
+
+# os.writev() takes at most this many buffers per call
+_IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+
+
+# -----------------------------------------------------------------------------
+def compile_template(data):
+    """
+    Return a Plan for *data* (bytes or a memoryview), or None if it has no
+    placeholders. spans is a list of (start, end, name) giving the position
+    of each placeholder.
+    """
+    spans = [(mobj.start(), mobj.end(), mobj.group(1).decode())
+             for mobj in PLACEHOLDER.finditer(data)]
+    if not spans:
+        return None
+    return Plan(data, spans)
+
+
+# -----------------------------------------------------------------------------
+def plan_for_file(path):
+    """
+    Return the (cached) Plan for the template file at *path*, or None if it
+    has no placeholders or is too big to be a template
+    """
+    from pytool import compress
+    st = os.stat(path)
+    packed = compress.suffix(path)
+    if st.st_size > MAX_TEMPLATE and not packed:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _memo.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with compress.reader(path) as rbl:
+        # a compressed file's size says little about its content's
+        data = rbl.read(MAX_TEMPLATE + 1)
+    plan = None if len(data) > MAX_TEMPLATE else compile_template(data)
+    with _lock:
+        _memo[path] = (stamp, plan)
+    return plan
+
+
+# -----------------------------------------------------------------------------
+def plan_for_data(ident, stamp, data):
+    """
+    Return the (cached) Plan for template content *data*, identified by
+    *ident*. *stamp* must change whenever the content does; a plan cached
+    under an older stamp is replaced.
+    """
+    if len(data) > MAX_TEMPLATE:
+        return None
+    cached = _memo.get(ident)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    plan = compile_template(data)
+    with _lock:
+        _memo[ident] = (stamp, plan)
+    return plan
+
+
+# -----------------------------------------------------------------------------
+def forget(owner):
+    """
+    Drop the cached plans for templates identified by (*owner*, ...), such
+    as those read from a bundle that has been replaced
+    """
+    with _lock:
+        for ident in [x for x in _memo
+                      if isinstance(x, tuple) and x[0] == owner]:
+            del _memo[ident]
+
+
+# -----------------------------------------------------------------------------
+def chunks(plan, variables):
+    """
+    Return the list of buffers making up *plan* rendered with *variables*
+    (as returned by variables(), keyed by lower case name)
+    """
+    view = memoryview(plan.data)
+    rval = []
+    pos = 0
+    for start, end, name in plan.spans:
+        key = name.lower()
+        if key not in variables:
+            continue
+        rval.append(view[pos:start])
+        rval.append(str(variables[key]).encode())
+        pos = end
+    rval.append(view[pos:])
+    return rval
+
+
+# -----------------------------------------------------------------------------
+def render_bytes(plan, variables):
+    """
+    Return *plan* rendered with *variables* as bytes
+    """
+    return b"".join(chunks(plan, variables))
+
+
+# -----------------------------------------------------------------------------
+def write(plan, dst, variables):
+    """
+    Write *plan* rendered with *variables* to file *dst*. Return the number
+    of bytes written.
+    """
+    bufs = [x for x in chunks(plan, variables) if len(x)]
+    copier.unshare(dst)
+    fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        done = 0
+        while bufs:
+            count = os.writev(fd, bufs[:_IOV_MAX])
+            if trace.enabled:
+                trace.est_syscalls(1)
+            done += count
+            while bufs and count >= len(bufs[0]):
+                count -= len(bufs[0])
+                bufs.pop(0)
+            if count:
+                bufs[0] = memoryview(bufs[0])[count:]
+    finally:
+        os.close(fd)
+        if trace.enabled:
+            trace.est_syscalls(2)
+    return done
+
+
+# -----------------------------------------------------------------------------
+def variables(cfg, name, overrides=None):
+    """
+    Return the substitution variables for generating *name*: the built-in
+    defaults, updated from the [variables] section of *cfg*, then from
+    *overrides* (a dict or a list of 'NAME=VALUE' strings). Names are
+    folded to lower case, and values are used raw, without interpolation.
+    """
+    rval = dict(DEFAULTS)
+    if cfg is not None and cfg.has_section('variables'):
+        rval.update((key.lower(), value) for key, value
+                    in cfg.items('variables', raw=True))
+    if isinstance(overrides, dict):
+        rval.update((key.lower(), value) for key, value in overrides.items())
+    else:
+        for item in overrides or []:
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError("{}: {}".format(mcat['badvar'], item))
+            rval[key.strip().lower()] = value
+    rval['project'] = name
+    return rval
@@ -0,0 +1,165 @@
+"""
+pytool.server - a long-running generation daemon on a Unix socket
+
+'pytool serve' keeps one warm process: the config, the template manifests,
+and the imports all stay loaded, and are revalidated (not reloaded) for each
+request, so edits to pytool.ini or the templates are picked up as they
+happen. Clients connect to the socket and send one JSON job per line, in the
+same format 'pytool batch' reads:
+
+    {"command": "project", "path": "/abs/path", "options": {}}
+
+and get back one JSON result line per job. Each connection is handled in
+its own thread.
+
+The socket is $PYTOOL_SOCKET if that's set, otherwise pytool.sock in the
+config dir. Jobs write wherever they say, as the daemon's user, so the
+socket is made readable and writable only by that user, and connections
+from any other user (by SO_PEERCRED, where the platform has it) are
+dropped.
+"""
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+
+import pytool
+from pytool import batch
+from pytool.msgcat import mcat
+
+
+# -----------------------------------------------------------------------------
+def socket_path():
+    """
+    Return the path of the daemon's socket
+    """
+    env = os.getenv(mcat['ptsockenv'])
+    if env:
+        return env
+    cdir, _ = pytool.cfgdir()
+    return os.path.join(cdir, mcat['ptsock'])
+
+
+# -----------------------------------------------------------------------------
+def make_server(path=None, out=None):
+    """
+    Bind the daemon's socket and return the server, ready for
+    serve_forever(). A stale socket left by a dead daemon is removed; if a
+    live daemon is already answering on it, raise FileExistsError. Setting
+    up the config dir, if that's needed first, is reported on *out*.
+    """
+    path = path or socket_path()
+    pytool.initialize(out=out)
+    if os.path.exists(path):
+        if _connect(path) is not None:
+            raise FileExistsError("{}: {}".format(mcat['running'], path))
+        os.unlink(path)
+    # owner only from the moment it exists
+    umask = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    server.path = path
+    server.uid = os.getuid()
+    return server
+
+
+# -----------------------------------------------------------------------------
+def serve(path=None, out=None):
+    """
+    Run the daemon until interrupted or terminated, then remove the socket.
+    Say where it's listening on *out* (by default sys.stdout).
+    """
+    out = out or sys.stdout
+    server = make_server(path, out)
+    print("{} {}".format(mcat['serving'], server.path), file=out)
+    out.flush()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            os.unlink(server.path)
+        except OSError:
+            pass
+
+
+# -----------------------------------------------------------------------------
+def request(job, path=None):
+    """
+    Send *job* (a dict) to the daemon and return its result dict, or None if
+    no daemon is listening (or it drops the connection) so the caller can do
+    the work itself
+    """
+    sock = _connect(path or socket_path())
+    if sock is None:
+        return None
+    try:
+        with sock, sock.makefile('rwb') as stream:
+            stream.write(json.dumps(job).encode() + b"\n")
+            stream.flush()
+            line = stream.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    return json.loads(line.decode())
+
+
+# -----------------------------------------------------------------------------
+def _connect(path):
+    """
+    Return a socket connected to *path*, or None if nothing is listening
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+# -----------------------------------------------------------------------------
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    One thread per connection; don't wait for them at shutdown. Only
+    connections from the daemon's own user (*uid*) are served.
+    """
+    daemon_threads = True
+    uid = None
+
+    def verify_request(self, request, client_address):
+        """
+        Accept the connection only if the peer is running as *uid*
+        """
+        if not hasattr(socket, 'SO_PEERCRED'):
+            # the socket's mode is all there is
+            return True
+        creds = request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                   struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', creds)
+        return uid == self.uid
+
+
+# -----------------------------------------------------------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Run each JSON line received as a job and write back its result
+    """
+    def handle(self):
+        for idx, line in enumerate(self.rfile):
+            if not line.strip():
+                continue
+            state = {'cfg': pytool.initialize(), 'tree': None}
+            result = batch.run_job(idx, line.decode(), state=state)
+            self.wfile.write(json.dumps(result).encode() + b"\n")
+            self.wfile.flush()
@@ -0,0 +1,204 @@
+"""
+pytool.store - project template profiles in a content-addressed store
+
+A profile is a variant of the project template tree (templates/prjdir) kept
+under a name: 'pytool store NAME DIR' stores one, and 'pytool project
+--profile NAME PATH' generates from it. Variants usually share most of their
+files, so the store keeps each distinct file content once, as a blob named
+by its sha256, and a profile is just an index mapping the tree's paths to
+blobs. Every profile generating the same file reads the same blob, so the
+page cache holds one copy of it however many profiles use it.
+
+Layout, under cfgdir()/store:
+
+    blobs/ab/cdef...      one file per content, named by its sha256 hex
+                          digest and split after two characters. Blobs are
+                          never changed once written.
+    profiles/NAME.json    the profile: one entry per file and directory
+                          (path, isdir, size, mtime, mode, digest), each
+                          directory ahead of its contents
+
+Blobs of read-only templates are read-only and the rest are not (they're
+named with a '-w' suffix), so --link hard and auto treat a profile's files
+as they would the template files it was stored from. With compress set in
+pytool.ini, blobs are written compressed and named with the compression
+suffix (see pytool.compress); the digest is still that of the content.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from pytool import compress
+from pytool import copier
+from pytool import manifest
+from pytool.msgcat import mcat
+
+
+VERSION = 1
+
+# profile path -> Profile
+_memo = {}
+_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+class Profile(object):
+    """
+    A stored profile, loaded from its index file at *path* in *store*
+    """
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        with open(path) as rbl:
+            st = os.fstat(rbl.fileno())
+            self.stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            data = json.load(rbl)
+        if data.get('version') != VERSION:
+            raise ValueError("{}: {}".format(mcat['badprof'], path))
+        self.name = data['name']
+        self.entries = [manifest.Entry(*x[:5]) for x in data['entries']]
+        self.blobs = {x[0]: x[5] for x in data['entries'] if not x[1]}
+
+    def tree(self):
+        """
+        Return the profile's manifest.Entry tuples, as template_tree() does
+        for the templates directory
+        """
+        return self.entries
+
+    def source(self, relpath):
+        """
+        Return the path of the blob holding the content of *relpath*
+        """
+        return blob_path(self.store, self.blobs[relpath])
+
+
+# -----------------------------------------------------------------------------
+def blob_path(store, blob):
+    """
+    Return the path in *store* of the blob named *blob*
+    """
+    return os.path.join(store, "blobs", blob[:2], blob[2:])
+
+
+# -----------------------------------------------------------------------------
+def profile_path(store, name):
+    """
+    Return the path of the index file for profile *name*. Raise ValueError
+    if *name* can't be a profile name.
+    """
+    if not name or name.startswith(".") or os.sep in name or "/" in name:
+        raise ValueError("{}: '{}'".format(mcat['badprof'], name))
+    return os.path.join(store, "profiles", name + ".json")
+
+
+# -----------------------------------------------------------------------------
+def load(store, name):
+    """
+    Return profile *name* from *store*, reusing the one already loaded if
+    its index hasn't been replaced. Raise FileNotFoundError if there's no
+    such profile.
+    """
+    path = profile_path(store, name)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise FileNotFoundError("{}: '{}'".format(mcat['noprof'],
+                                                  name)) from None
+    with _lock:
+        cached = _memo.get(path)
+        if cached and cached.stamp == (st.st_ino, st.st_mtime_ns, st.st_size):
+            return cached
+        prof = Profile(store, path)
+        _memo[path] = prof
+        return prof
+
+
+# -----------------------------------------------------------------------------
+def names(store):
+    """
+    Return the names of the profiles in *store*, sorted
+    """
+    try:
+        found = os.listdir(os.path.join(store, "profiles"))
+    except FileNotFoundError:
+        return []
+    return sorted(x[:-5] for x in found if x.endswith(".json"))
+
+
+# -----------------------------------------------------------------------------
+def save(store, name, tree, source_of, ext=''):
+    """
+    Store a template tree as profile *name*, replacing any profile of that
+    name. *tree* is its manifest (a list of manifest.Entry tuples) and
+    *source_of(relpath)* gives the file holding each template. Only
+    contents the store doesn't already have are written, compressed as
+    suffix *ext* says if it's given. Return (file count, blobs added,
+    bytes added).
+    """
+    profile_path(store, name)
+    entries = []
+    added = 0
+    nbytes = 0
+    for entry in tree:
+        if entry.isdir:
+            entries.append(list(entry) + [None])
+            continue
+        blob, size = put(store, source_of(entry.path),
+                         readonly=not entry.mode & 0o222, ext=ext)
+        if size is not None:
+            added += 1
+            nbytes += size
+        entries.append(list(entry) + [blob])
+
+    path = profile_path(store, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.{}".format(path, os.getpid(), threading.get_ident())
+    with open(tmp, 'w') as wbl:
+        json.dump({'version': VERSION, 'name': name, 'entries': entries},
+                  wbl, separators=(',', ':'))
+    os.replace(tmp, path)
+    return (len([x for x in entries if not x[1]]), added, nbytes)
+
+
+# -----------------------------------------------------------------------------
+def put(store, path, readonly=True, ext=''):
+    """
+    Add the content of file *path* to *store* unless it's already there,
+    compressed the way suffix *ext* says if it's given (see
+    pytool.compress) and *path* isn't compressed already. Return (blob
+    name, bytes written), with None for the bytes if the blob already
+    existed.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as rbl:
+        for chunk in iter(lambda: rbl.read(copier.BUFSIZE), b""):
+            digest.update(chunk)
+    packed = compress.suffix(path)
+    ext = packed or ext
+    blob = digest.hexdigest() + ("" if readonly else "-w") + ext
+    dst = blob_path(store, blob)
+    if os.path.exists(dst):
+        return (blob, None)
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = "{}.{}.{}".format(dst, os.getpid(), threading.get_ident())
+    try:
+        if ext and not packed:
+            compress.compress_file(path, tmp, ext)
+            size = os.path.getsize(tmp)
+        else:
+            size = copier.copy_file(path, tmp)
+        with compress.reader(tmp, '' if packed else ext) as rbl:
+            check = hashlib.sha256()
+            for chunk in iter(lambda: rbl.read(copier.BUFSIZE), b""):
+                check.update(chunk)
+        if check.hexdigest() != blob[:64]:
+            raise IOError("{}: changed while storing".format(path))
+        os.chmod(tmp, 0o444 if readonly else 0o644)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return (blob, size)
@@ -0,0 +1,226 @@
+"""
+pytool.trace - per-phase timing spans and per-file counters
+
+Set PYTOOL_TRACE (or pass --trace) to see where the time goes. PYTOOL_TRACE
+is '1' or '-' for stderr, or the path of a file to append to; --trace
+alone means stderr unless PYTOOL_TRACE names a file. Each record is one
+JSON line:
+
+    {"event": "span", "name": "walk", "elapsed": 0.0012, ...}
+    {"event": "file", "path": "proj/setup.py", "bytes": 214,
+     "est_syscalls": 5, "elapsed": 0.0001, ...}
+    {"event": "counters", "files": 6, "bytes": 1570, "est_syscalls": 41,
+     ...}
+
+A span reports the counters that went up while it was open; the counters
+record totals everything at exit. est_syscalls is an estimate: each I/O
+path adds what it expects to cost (an open, a read per buffer, ...) rather
+than anything counting the calls the kernel actually sees, so use it to
+compare runs of the same code, and strace for exact numbers.
+
+While tracing is off, span() returns a shared no-op context manager, a
+@spanned function goes straight to the real one, and the per-file and
+per-syscall hooks are skipped at their call sites by a check of *enabled*,
+so turning tracing off costs nothing more than those checks.
+"""
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+
+from pytool.msgcat import mcat
+
+
+enabled = False
+
+_out = None
+_owned = False
+_lock = threading.Lock()
+_local = threading.local()
+_counters = {}
+
+
+# -----------------------------------------------------------------------------
+class _NullSpan(object):
+    """
+    What span() returns while tracing is off
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+# -----------------------------------------------------------------------------
+class _Span(object):
+    """
+    Time the enclosed block and emit it, with the counter deltas, on exit
+    """
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        with _lock:
+            self.before = dict(_counters)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *args):
+        elapsed = time.perf_counter() - self.start
+        with _lock:
+            deltas = {key: val - self.before.get(key, 0)
+                      for key, val in _counters.items()
+                      if val != self.before.get(key, 0)}
+        record = dict(self.fields, name=self.name, elapsed=elapsed, **deltas)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        emit('span', record)
+        return False
+
+
+# -----------------------------------------------------------------------------
+def configure(dest, err=None):
+    """
+    Start tracing to *dest* ('1' or '-' for *err*, by default sys.stderr,
+    else a file path) with the counters at zero, or stop if *dest* is empty
+    or '0'
+    """
+    global enabled, _out, _owned
+    with _lock:
+        if _owned:
+            _out.close()
+        _out = None
+        _owned = False
+        enabled = dest not in (None, '', '0')
+        if not enabled:
+            return
+        _counters.clear()
+        if dest in ('1', '-'):
+            _out = err or sys.stderr
+        else:
+            _out = open(dest, 'a', buffering=1)
+            _owned = True
+
+
+# -----------------------------------------------------------------------------
+def configure_from_env(force=False, err=None):
+    """
+    Configure from $PYTOOL_TRACE. With *force* (--trace), trace to stderr
+    (or *err*) even if it's unset.
+    """
+    dest = os.getenv(mcat['pttrace'])
+    if force and dest in (None, '', '0'):
+        dest = '-'
+    configure(dest, err)
+
+
+# -----------------------------------------------------------------------------
+def span(name, **fields):
+    """
+    Return a context manager timing the phase *name*. *fields* are added to
+    its record.
+    """
+    if not enabled:
+        return _NULL
+    return _Span(name, fields)
+
+
+# -----------------------------------------------------------------------------
+def spanned(name):
+    """
+    Decorator timing each call of the function as a span called *name*
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwa):
+            if not enabled:
+                return func(*args, **kwa)
+            with _Span(name, {}):
+                return func(*args, **kwa)
+        return wrapper
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+def count(name, amount=1):
+    """
+    Add *amount* to counter *name*
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+# -----------------------------------------------------------------------------
+def est_syscalls(amount=1):
+    """
+    Count an estimated *amount* system calls made by this thread
+    """
+    _local.est_syscalls = getattr(_local, 'est_syscalls', 0) + amount
+    count('est_syscalls', amount)
+
+
+# -----------------------------------------------------------------------------
+def counters():
+    """
+    Return a copy of the counter totals so far
+    """
+    with _lock:
+        return dict(_counters)
+
+
+# -----------------------------------------------------------------------------
+def file_op(path, func, *args, **kwa):
+    """
+    Call *func(*args, **kwa)*, which writes file *path* and returns the
+    bytes written, and emit a file record for it. Return what *func* did.
+    """
+    before = getattr(_local, 'est_syscalls', 0)
+    start = time.perf_counter()
+    nbytes = func(*args, **kwa)
+    elapsed = time.perf_counter() - start
+    calls = getattr(_local, 'est_syscalls', 0) - before
+    count('files')
+    count('bytes', nbytes or 0)
+    emit('file', {'path': path, 'bytes': nbytes or 0, 'est_syscalls': calls,
+                  'elapsed': elapsed})
+    return nbytes
+
+
+# -----------------------------------------------------------------------------
+def emit(event, record):
+    """
+    Write *record* as a JSON line tagged with *event*, the time, the pid,
+    and the thread
+    """
+    import json
+    line = json.dumps(dict(record, event=event, ts=time.time(),
+                           pid=os.getpid(), thread=threading.get_ident()),
+                      sort_keys=True)
+    with _lock:
+        if _out is not None:
+            _out.write(line + "\n")
+            _out.flush()
+
+
+# -----------------------------------------------------------------------------
+def close():
+    """
+    Emit the counter totals and stop tracing
+    """
+    if not enabled:
+        return
+    with _lock:
+        totals = dict(_counters)
+    emit('counters', totals)
+    configure(None)
+
+
+configure_from_env()
+atexit.register(close)
@@ -0,0 +1,245 @@
+"""
+pytool.update - bring a generated project up to date with its templates
+
+create_project() leaves a generation manifest, .pytool-manifest.json, in the
+project it creates. For each file it wrote, the manifest records the
+template it came from, a hash of that template's content, and a hash of what
+was written (which differ if the template had placeholders). The variables
+used to fill in placeholders are recorded too, so an update renders changed
+templates the same way. 'pytool project --update PATH' compares the hashes
+with the templates as they are now and the files as they are now:
+
+    template unchanged                      leave the file alone
+    template changed, file as generated     rewrite the file
+    template changed, file already matches  just record the new hashes
+    template changed, file edited/removed   report a conflict, leave it
+    new template, no file there yet         write the file
+
+so only the files that need it are written.
+"""
+import hashlib
+import json
+import os
+import threading
+
+from pytool import copier
+from pytool import render
+from pytool.msgcat import mcat
+
+
+VERSION = 1
+
+# template -> (stamp, sha256 hex digest of its content)
+_digests = {}
+_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+def file_hash(path):
+    """
+    Return the sha256 hex digest of the file at *path*, or None if it
+    doesn't exist
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as rbl:
+            for chunk in iter(lambda: rbl.read(copier.BUFSIZE), b""):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+def template_hash(path):
+    """
+    Return the sha256 hex digest of the content of template *path*,
+    decompressed if it's compressed (see pytool.compress)
+    """
+    from pytool import compress
+    if not compress.suffix(path):
+        return file_hash(path)
+    digest = hashlib.sha256()
+    with compress.reader(path) as rbl:
+        for chunk in iter(lambda: rbl.read(copier.BUFSIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+def template_digest(path):
+    """
+    Return template_hash(*path*), reusing the digest from the last call
+    while the template's mtime and size are unchanged
+    """
+    st = os.stat(path)
+    return cached_digest(path, (st.st_mtime_ns, st.st_size),
+                         lambda: template_hash(path))
+
+
+# -----------------------------------------------------------------------------
+def cached_digest(ident, stamp, compute):
+    """
+    Return the digest of the template identified by *ident*, calling
+    *compute()* for it unless it was cached under the same *stamp*, which
+    must change whenever the template does
+    """
+    cached = _digests.get(ident)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = compute()
+    with _lock:
+        _digests[ident] = (stamp, digest)
+    return digest
+
+
+# -----------------------------------------------------------------------------
+def data_hash(data):
+    """
+    Return the sha256 hex digest of *data* (bytes or a memoryview)
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+# -----------------------------------------------------------------------------
+def render_hash(plan, variables):
+    """
+    Return the sha256 hex digest of *plan* rendered with *variables*,
+    without joining the pieces
+    """
+    digest = hashlib.sha256()
+    for buf in render.chunks(plan, variables):
+        digest.update(buf)
+    return digest.hexdigest()
+
+
+# -----------------------------------------------------------------------------
+def read_manifest(trgdir):
+    """
+    Return the generation manifest in *trgdir* as a dict with 'files' (see
+    write_manifest()), 'variables', and 'profile'. Raise FileNotFoundError if
+    there isn't one.
+    """
+    path = os.path.join(trgdir, mcat['genmani'])
+    try:
+        with open(path) as rbl:
+            data = json.load(rbl)
+    except FileNotFoundError:
+        raise FileNotFoundError("{}: '{}'".format(mcat['nomani'],
+                                                  path)) from None
+    data.setdefault('variables', None)
+    data.setdefault('profile', None)
+    return data
+
+
+# -----------------------------------------------------------------------------
+def write_manifest(trgdir, files, variables, fs=None, profile=None):
+    """
+    Write the generation manifest for *trgdir*, through filesystem backend
+    *fs* if given (see pytool.fs). *files* maps each generated file's path
+    (relative to *trgdir*) to a dict with its 'source' template path, the
+    template's 'source_hash', and the written content's 'hash'. *variables*
+    are the placeholder values used and *profile* the template profile, if
+    any.
+    """
+    path = os.path.join(trgdir, mcat['genmani'])
+    data = json.dumps({'version': VERSION, 'variables': variables,
+                       'profile': profile, 'files': files},
+                      indent=1, sort_keys=True) + "\n"
+    if fs is not None:
+        fs.write(path, data.encode(), atomic=True)
+        return
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, 'w') as wbl:
+        wbl.write(data)
+    os.replace(tmp, path)
+
+
+# -----------------------------------------------------------------------------
+def record(trgdir, generated, variables, digests=None,
+           jobs=copier.DEFAULT_JOBS, fs=None, profile=None):
+    """
+    Write the manifest for the files just generated in *trgdir*.
+    *generated* is a list of (template relpath, target relpath) pairs.
+    *digests* maps a target relpath to (template hash, file hash), worked
+    out as it was written; any file not in it is read back and hashed
+    (through filesystem backend *fs*, if given), taken to be a copy of its
+    template. *profile* is recorded as the template profile used.
+    """
+    files = {}
+    digests = digests or {}
+    digest_of = fs.digest if fs is not None else file_hash
+
+    def hashed(source, target):
+        digest = digest_of(os.path.join(trgdir, target))
+        files[target] = {'source': source, 'source_hash': digest,
+                         'hash': digest}
+        return 0
+
+    unknown = []
+    for source, target in generated:
+        if target in digests:
+            files[target] = {'source': source,
+                             'source_hash': digests[target][0],
+                             'hash': digests[target][1]}
+        else:
+            unknown.append((source, target))
+    copier.run_pool(hashed, unknown, jobs=jobs)
+    write_manifest(trgdir, files, variables, fs=fs, profile=profile)
+
+
+# -----------------------------------------------------------------------------
+def update_project(trgdir, source_of, tree, target_of, variables,
+                   bufsize=copier.BUFSIZE):
+    """
+    Update the project in *trgdir* from its templates. *tree* is the
+    template manifest (see pytool.template_tree()), *source_of(relpath)*
+    maps a template path to the file holding its content, and
+    *target_of(relpath)* maps a template path to a project path. Files are
+    copied through a buffer of *bufsize* bytes.
+    Templates with placeholders are rendered with the variables recorded at
+    generation, or *variables* if none were. Return a dict with lists of the
+    project paths 'written', 'conflicts', and 'unchanged'.
+    """
+    saved = read_manifest(trgdir)
+    files = saved['files']
+    variables = saved['variables'] or variables
+    rval = {'written': [], 'conflicts': [], 'unchanged': []}
+    for entry in tree:
+        target = target_of(entry.path)
+        trgpath = os.path.join(trgdir, target)
+        if entry.isdir:
+            os.makedirs(trgpath, exist_ok=True)
+            continue
+
+        srcpath = source_of(entry.path)
+        plan = render.plan_for_file(srcpath)
+        if plan:
+            source_hash = data_hash(plan.data)
+            new = data_hash(render.render_bytes(plan, variables))
+        else:
+            source_hash = new = template_hash(srcpath)
+        old = files.get(target)
+        if old is not None and old['source_hash'] == source_hash:
+            rval['unchanged'].append(target)
+            continue
+
+        current = file_hash(trgpath)
+        if current == new:
+            pass
+        elif ((current is None and old is None) or
+              (old is not None and current == old['hash'])):
+            if plan:
+                render.write(plan, trgpath, variables)
+            else:
+                copier.place_file(srcpath, trgpath, link='copy',
+                                  bufsize=bufsize)
+            rval['written'].append(target)
+        else:
+            rval['conflicts'].append(target)
+            continue
+        files[target] = {'source': entry.path, 'source_hash': source_hash,
+                         'hash': new}
+
+    write_manifest(trgdir, files, variables, profile=saved['profile'])
+    return rval
@@ -17,5 +17,6 @@ setup(name="pytool",
           'py',
       ],
       packages=['pytool'],
+      package_data={'pytool': ['defaults.json']},
       entry_points={'console_scripts': ["pytool = pytool:main"]}
       )
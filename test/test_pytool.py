@@ -1,8 +1,30 @@
+import asyncio
+import io
+import json
+import os
 import py
 import pytest
 import re
+import socket
+import stat
+import subprocess
+import sys
+import threading
+import time
 
 import pytool
+from pytool import aio
+from pytool import batch
+from pytool import bench
+from pytool import builtin
+from pytool import bundle
+from pytool import cli
+from pytool import copier
+from pytool import fs
+from pytool import manifest
+from pytool import render
+from pytool import server
+from pytool import trace
 from pytool.msgcat import mcat
 from pytool import version
 import tbx
@@ -25,7 +47,8 @@ def test_flake8():
 # -----------------------------------------------------------------------------
 def test_runnable():
     """
-    Verify that pytool is runnable from the command line
+    Verify that pytool is runnable from the command line. This is the one
+    test that starts a real pytool process; the others use cli.run().
     """
     bresult = tbx.run(mcat['pthelp'])
     sresult = bresult.decode()
@@ -39,8 +62,9 @@ def test_pytool_help():
     """
     Verify that 'pytool help' runs properly
     """
-    result = tbx.run(mcat['pthlpcmd']).decode().strip()
-    assert mcat['trace'] not in result
+    code, result, err = cli.run(mcat['pthlpcmd'].split()[1:])
+    assert code == 0
+    assert mcat['trace'] not in result + err
     assert mcat['cmd'] not in result
     assert pytool.__doc__.strip() == result.strip()
 
@@ -53,7 +77,8 @@ def test_pytool_help():
     ])
 def test_pytool_help_cmd(hkey, tkey):
     exp = mcat[tkey].split("\n")
-    result = tbx.run(mcat[hkey]).decode().strip()
+    code, result, _ = cli.run(mcat[hkey].split()[1:])
+    assert code == 0
     result = re.sub("\s\s+", " ", " ".join(result.split("\n")))
     for line in exp:
         assert line.strip() in result
@@ -64,7 +89,7 @@ def test_pytool_help_nosuch():
     """
     Verify 'pytool help foobar'
     """
-    result = tbx.run(mcat['hlpnone']).decode().strip()
+    code, result, _ = cli.run(mcat['hlpnone'].split()[1:])
     assert mcat['unknown'] in result
     assert mcat['nonesuch'] in result
 
@@ -339,11 +364,89 @@ def test_pytool_initialize_envdir_create(tmpdir, fx_tmpl, capsys):
         assert ptdir.join(item).exists()
 
 
+# -----------------------------------------------------------------------------
+def test_pytool_initialize_cached(tmpdir):
+    """
+    pytool.initialize() should hand back the same parsed config until
+    pytool.ini changes, write a parsed sidecar next to pytool.ini, and use
+    the sidecar after the in-process context is invalidated
+    """
+    ptdir = tmpdir.join("envdir")
+    ptini = ptdir.join(mcat['ptini'])
+    sidecar = ptdir.join(mcat['ptini'] + mcat['sidecar'])
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        cfg = pytool.initialize()
+        assert pytool.initialize() is cfg
+        assert sidecar.exists()
+
+        # the sidecar, not pytool.ini, is what gets read on a cold start
+        pytool._cfgctx.clear()
+        saved = json.loads(sidecar.read())
+        saved['data']['pytool']['marker'] = 'sidecar'
+        sidecar.write(json.dumps(saved))
+        assert pytool.initialize().get('pytool', 'marker') == 'sidecar'
+
+        ptini.write(ptini.read() + "extra = value\n")
+        cfg = pytool.initialize()
+        assert cfg.get('pytool', 'extra') == 'value'
+        assert not cfg.has_option('pytool', 'marker')
+
+        pytool.invalidate_config()
+        assert not sidecar.exists()
+        assert pytool.initialize().get('pytool', 'extra') == 'value'
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_initialize_concurrent(tmpdir, fx_tmpl):
+    """
+    Many processes initializing a new config dir at once should set it up
+    exactly once, completely, and leave no lock or temporary files behind
+    """
+    ptdir = tmpdir.join(".pytool")
+    env = dict(os.environ, PYTOOL_DIR=ptdir.strpath)
+    procs = [subprocess.Popen([sys.executable, "-c",
+                               "import pytool; pytool.initialize()"],
+                              env=env, stdout=subprocess.PIPE)
+             for _ in range(16)]
+    outs = [x.communicate()[0].decode() for x in procs]
+    assert [x.returncode for x in procs] == [0] * 16
+    assert len([x for x in outs if mcat['stupflz'] in x]) == 1
+    assert tmpdir.listdir() == [ptdir]
+    for item in fx_tmpl:
+        assert ptdir.join(item).exists()
+    assert ptdir.join("templates/tool.py").read() == pytool.file_tool_py()
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_setup_config_dir_ini_last(tmpdir, monkeypatch, fx_tmpl):
+    """
+    Setting up a config dir that already has other things in it should
+    move pytool.ini into place after everything else
+    """
+    ptdir = tmpdir.join(".pytool")
+    ptdir.join("notes.txt").write("mine\n", ensure=True)
+    moved = []
+    real = os.replace
+
+    def replace(src, dst):
+        moved.append(os.path.relpath(dst, ptdir.strpath))
+        real(src, dst)
+    monkeypatch.setattr(os, 'replace', replace)
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.setup_config_dir()
+    monkeypatch.undo()
+    assert moved[-1] == mcat['ptini']
+    assert sorted(moved) == sorted(x for x in fx_tmpl
+                                   if ptdir.join(x).isfile())
+    assert ptdir.join("notes.txt").read() == "mine\n"
+
+
 # -----------------------------------------------------------------------------
 def test_pytool_initialize_envdir_isfile(tmpdir):
     """
     With PYTOOL_DIR set and pointed at a file, pytool.initialize() should throw
-    an exception indicating that $PYTOOL_DIR is a file, not a directory.
+    an exception indicating that $PYTOOL_DIR is a file, not a directory, and
+    leave no lock file behind.
     """
     ptdir = tmpdir.join("envdir")
     ptdir.ensure()
@@ -352,6 +455,33 @@ def test_pytool_initialize_envdir_isfile(tmpdir):
             pytool.initialize()
     assert ptdir.strpath in str(err)
     assert mcat['isfile'] in str(err)
+    assert tmpdir.listdir() == [ptdir]
+
+
+# -----------------------------------------------------------------------------
+def test_publish_config_dir_isfile(tmpdir, monkeypatch):
+    """
+    Finding the config dir is a file, before taking the lock or while
+    waiting for it, should leave no lock file behind
+    """
+    cdir = tmpdir.join("envdir")
+    files = {mcat['ptini']: b"[pytool]\n"}
+    cdir.ensure()
+    with pytest.raises(FileExistsError):
+        pytool._publish_config_dir(cdir.strpath, mcat['env'], files)
+    assert tmpdir.listdir() == [cdir]
+
+    cdir.remove()
+    lock_file = pytool._lock_file
+
+    def race(fd):
+        cdir.ensure()
+        lock_file(fd)
+    monkeypatch.setattr(pytool, '_lock_file', race)
+    with pytest.raises(FileExistsError) as err:
+        pytool._publish_config_dir(cdir.strpath, mcat['env'], files)
+    assert mcat['isfile'] in str(err)
+    assert tmpdir.listdir() == [cdir]
 
 
 # -----------------------------------------------------------------------------
@@ -407,7 +537,7 @@ def test_pytool_initialize_homedir_isfile(tmpdir):
 def test_pytool_initialize_homedir_pt_isfile(tmpdir):
     """
     If HOME/.pytool is a file, pytool.initialize() should throw a
-    FileExistsError
+    FileExistsError and leave no lock file behind
     """
     hdir = tmpdir.join("home")
     hdir.ensure(dir=True)
@@ -418,6 +548,7 @@ def test_pytool_initialize_homedir_pt_isfile(tmpdir):
             pytool.initialize()
     assert ptdir.strpath in str(err)
     assert mcat['isfile'] in str(err)
+    assert hdir.listdir() == [ptdir]
 
 
 # -----------------------------------------------------------------------------
@@ -498,6 +629,7 @@ def test_pytool_project(tmpdir, fx_tmpl):
                'program': False,
                'tool': False,
                'project': True,
+               'jobs': '4',
                'PATH': trgdir.strpath}
         pytool.make_project(**kwa)
 
@@ -521,14 +653,1269 @@ def test_pytool_project(tmpdir, fx_tmpl):
         check_proj_files(ptdir, trgdir2, fx_tmpl)
 
 
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_copier_run_pool(tmpdir, jobs):
+    """
+    copier.run_pool() with copy_file() should copy empty, small, and
+    multi-buffer files byte for byte and report the number of bytes copied
+    """
+    sizes = {'empty': 0, 'small': 17, 'big': 3 * copier.BUFSIZE + 5}
+    pairs = []
+    for name, size in sizes.items():
+        src = tmpdir.join(name)
+        src.write_binary(os.urandom(size))
+        pairs.append((src.strpath, tmpdir.join(name + ".out").strpath))
+
+    assert copier.run_pool(copier.copy_file, pairs,
+                           jobs=jobs) == sum(sizes.values())
+    for src, trg in pairs:
+        assert py.path.local(src).read_binary() == \
+            py.path.local(trg).read_binary()
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("how", ['kernel', 'buffered'])
+def test_copier_sparse(tmpdir, monkeypatch, how):
+    """
+    A sparse file should be copied with its holes intact, whether the data
+    goes through the kernel or through the (small, fixed) buffer
+    """
+    src = tmpdir.join("sparse")
+    size = 64 * 1024 * 1024
+    with open(src.strpath, 'wb') as wbl:
+        wbl.truncate(size)
+        wbl.write(b"head" * 1000)
+        wbl.seek(size // 2)
+        wbl.write(os.urandom(copier.BUFSIZE + 7))
+    if src.stat().blocks * 512 >= size:
+        pytest.skip("no sparse files on this filesystem")
+    bufsize = copier.BUFSIZE
+    if how == 'buffered':
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+        bufsize = 4096
+
+    trg = tmpdir.join("sparse.out")
+    assert copier.copy_file(src.strpath, trg.strpath,
+                            bufsize=bufsize) < size // 8
+    assert trg.size() == size
+    assert trg.stat().blocks * 512 < size // 8
+    assert trg.computehash() == src.computehash()
+
+
+# -----------------------------------------------------------------------------
+def test_big_assets(tmpdir, monkeypatch):
+    """
+    Files over render.MAX_TEMPLATE should be copied as they are, without
+    being scanned for placeholders, and copy_buffer in pytool.ini should
+    set the size of the buffer passed to the copies, leaving the module
+    default alone
+    """
+    ptdir = tmpdir.join(".pytool")
+    monkeypatch.setattr(render, 'MAX_TEMPLATE', 64)
+    sizes = set()
+    place_file = copier.place_file
+
+    def spy(src, dst, link='auto', bufsize=copier.BUFSIZE):
+        sizes.add(bufsize)
+        return place_file(src, dst, link=link, bufsize=bufsize)
+    monkeypatch.setattr(copier, 'place_file', spy)
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        asset = "{{project}}\n" * 10
+        ptdir.join("templates/prjdir/data.txt").write(asset)
+        ptini = ptdir.join(mcat['ptini'])
+        ptini.write(ptini.read() + "copy_buffer = 64K\n")
+        pytool.create_project(tmpdir.join("demo").strpath)
+        assert sizes == {64 * 1024}
+        assert copier.BUFSIZE == 1024 * 1024
+    assert tmpdir.join("demo/data.txt").read() == asset
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("ext", ['.gz', '.xz', '.bz2'])
+def test_compressed_templates(tmpdir, ext):
+    """
+    Templates stored compressed should be decompressed into targets named
+    without the suffix, rendered if they have placeholders, whether they're
+    read from the templates directory, a bundle, or a stored profile.
+    Without the .pytool mark, a compressed file is just a file.
+    """
+    from pytool import compress
+    ptdir = tmpdir.join(".pytool")
+    tmpls = ptdir.join("templates")
+    data = b"name,value\n" + b"x,1\n" * 5000
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        tmpdir.join("plain").ensure(dir=True)
+        cli.run(["tool", tmpdir.join("plain", "tool.py").strpath])
+        for relpath, content in [("prjdir/data.csv", data),
+                                 ("prjdir/NOTES.md", b"{{project}} notes\n"),
+                                 ("tool.py", tmpls.join("tool.py").read())]:
+            src = tmpdir.join("src")
+            src.write_binary(content if isinstance(content, bytes) else
+                             content.encode())
+            compress.compress_file(src.strpath, tmpls.join(
+                relpath + compress.MARK + ext).strpath, ext)
+        tmpls.join("tool.py").remove()
+        assert tmpls.join("prjdir/data.csv.pytool" + ext).size() < \
+            len(data) / 10
+        fixture = tmpls.join("prjdir/sample.csv" + ext)
+        compress.compress_file(src.strpath, fixture.strpath, ext)
+
+        demo = tmpdir.join("demo")
+        assert cli.run(["project", demo.strpath]) == (0, "", "")
+        assert demo.join("data.csv").read_binary() == data
+        assert demo.join("NOTES.md").read() == "demo notes\n"
+        assert not demo.join("data.csv.pytool" + ext).exists()
+        assert demo.join("sample.csv" + ext).read_binary() == \
+            fixture.read_binary()
+        result = pytool.update_project(demo.strpath)
+        assert (result['written'], result['conflicts']) == ([], [])
+        assert pytool.generate('project', "mem")["mem/data.csv"] == data
+
+        assert cli.run(["tool", tmpdir.join("tool.py").strpath])[0] == 0
+        assert tmpdir.join("tool.py").read() == \
+            tmpdir.join("plain", "tool.py").read()
+
+        assert cli.run(["pack-templates"])[0] == 0
+        bundled = tmpdir.join("bundled")
+        assert cli.run(["project", bundled.strpath]) == (0, "", "")
+        assert bundled.join("data.csv").read_binary() == data
+        assert bundled.join("NOTES.md").read() == "bundled notes\n"
+        ptdir.join(mcat['bundle']).remove()
+
+        ptini = ptdir.join(mcat['ptini'])
+        ptini.write(ptini.read() + "compress = {}\n".format(ext[1:]))
+        assert cli.run(["store", "lib"])[0] == 0
+        blobs = ptdir.join(mcat['store'], "blobs")
+        assert all(x.basename.endswith(compress.MARK + ext)
+                   for x in blobs.visit(lambda x: x.isfile()))
+        lib = tmpdir.join("lib")
+        assert cli.run(["project", "--profile", "lib", lib.strpath]) == \
+            (0, "", "")
+        assert lib.join("data.csv").read_binary() == data
+        assert lib.join("NOTES.md").read() == "lib notes\n"
+        assert lib.join("sample.csv" + ext).read_binary() == \
+            fixture.read_binary()
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("kind", ['tar', 'tar.gz', 'zip'])
+def test_pytool_project_archive(tmpdir, kind):
+    """
+    'pytool project --archive KIND -o FILE PATH' should write an archive
+    holding what generating the project would, and nothing else
+    """
+    import tarfile
+    import zipfile
+    from pytool import compress
+    ptdir = tmpdir.join(".pytool")
+    out = tmpdir.join("demo.out")
+    data = os.urandom(100000)
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        tmpdir.join("blob").write_binary(data)
+        compress.compress_file(
+            tmpdir.join("blob").strpath,
+            ptdir.join("templates/prjdir/blob.pytool.gz").strpath, '.gz')
+        with tmpdir.as_cwd():
+            code, _, err = cli.run(["project", "--archive", kind, "-o",
+                                    out.strpath, "demo"])
+        assert (code, err) == (0, "")
+        assert not tmpdir.join("demo").exists()
+        expected = pytool.generate('project', "demo")
+
+    def read_members(path):
+        members = {}
+        if kind == 'zip':
+            with zipfile.ZipFile(path) as zbl:
+                for info in zbl.infolist():
+                    if not info.is_dir():
+                        members[info.filename] = zbl.read(info)
+        else:
+            with tarfile.open(path) as tbl:
+                for info in tbl.getmembers():
+                    if info.isfile():
+                        members[info.name] = tbl.extractfile(info).read()
+        return members
+
+    members = read_members(out.strpath)
+    assert members == expected
+    assert members["demo/blob"] == data
+
+    # to stdout on a first run: the config dir setup messages go to stderr
+    # and the archive is all that's on stdout
+    with tbx.envset(PYTOOL_DIR=tmpdir.join("fresh").strpath):
+        with tmpdir.as_cwd():
+            code, stdout, err = cli.run(["project", "--archive", kind,
+                                         "demo"])
+        assert code == 0
+        assert mcat['stupflz'] in err
+        out.write_binary(stdout.encode(errors='surrogateescape'))
+        assert read_members(out.strpath) == pytool.generate('project',
+                                                            "demo")
+
+    code, _, err = cli.run(["project", "--archive", "cpio", "demo"])
+    assert code == 1
+    assert mcat['badarch'] in err
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_project_dot(tmpdir, fx_tmpl):
+    """
+    'pytool project .' run in the target dir should name the project after
+    that dir, for generating, updating, planning, and archiving alike
+    """
+    import tarfile
+    ptdir = tmpdir.join(".pytool")
+    trgdir = tmpdir.join("demo")
+    trgdir.ensure(dir=True)
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        with trgdir.as_cwd():
+            code, _, err = cli.run(["project", "."])
+            assert (code, err) == (0, "")
+            assert not trgdir.join("__init__.py").exists()
+            check_proj_files(ptdir, trgdir, fx_tmpl)
+            assert 'name="demo"' in trgdir.join("setup.py").read()
+
+            code, out, err = cli.run(["project", "--update", "."])
+            assert (code, err) == (0, "")
+
+            code, out, err = cli.run(["project", "--plan", "-", "."])
+            assert code == 0
+            assert json.loads(out.splitlines()[0])['name'] == "demo"
+
+            code, _, err = cli.run(["project", "--archive", "tar", "-o",
+                                    tmpdir.join("demo.tar").strpath, "."])
+            assert (code, err) == (0, "")
+        with tarfile.open(tmpdir.join("demo.tar").strpath) as tbl:
+            names = tbl.getnames()
+        assert "demo/setup.py" in names
+        assert not [x for x in names if x.startswith(".")]
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_project_jobs(tmpdir, fx_tmpl):
+    """
+    'pytool project -j N PATH' should produce the same tree as a serial copy
+    """
+    ptdir = tmpdir.join(".pytool")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        for jobs in ('1', '8'):
+            trgdir = tmpdir.join("project_" + jobs)
+            pytool.make_project(d=False, jobs=jobs, PATH=trgdir.strpath)
+            check_proj_files(ptdir, trgdir, fx_tmpl)
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_project_update(tmpdir):
+    """
+    'pytool project --update PATH' should rewrite files whose template
+    changed, add new ones, and report a conflict for files edited locally
+    whose template also changed
+    """
+    ptdir = tmpdir.join(".pytool")
+    srcdir = ptdir.join("templates/prjdir")
+    trgdir = tmpdir.join("project")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.make_project(d=False, jobs='4', PATH=trgdir.strpath)
+        assert trgdir.join(mcat['genmani']).exists()
+
+        srcdir.join("README.md").write("# New Title\n")
+        srcdir.join("setup.py").write("from setuptools import setup\n")
+        srcdir.join("NEWS").write("news\n")
+        trgdir.join("setup.py").write("# mine\n")
+        stub = trgdir.join("test/test_stub.py")
+        stub_mtime = stub.mtime()
+
+        result = pytool.update_project(trgdir.strpath)
+        assert sorted(result['written']) == ["NEWS", "README.md"]
+        assert result['conflicts'] == ["setup.py"]
+        assert "test/test_stub.py" in result['unchanged']
+        assert trgdir.join("README.md").read() == "# New Title\n"
+        assert trgdir.join("NEWS").read() == "news\n"
+        assert trgdir.join("setup.py").read() == "# mine\n"
+        assert stub.mtime() == stub_mtime
+
+        # once written, an update with no template changes writes nothing
+        result = pytool.update_project(trgdir.strpath)
+        assert result['written'] == []
+        assert result['conflicts'] == ["setup.py"]
+
+        with pytest.raises(FileNotFoundError) as err:
+            pytool.update_project(tmpdir.join("nonesuch").strpath)
+    assert mcat['nomani'] in str(err)
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("bundled", [False, True])
+def test_manifest_hashes(tmpdir, monkeypatch, bundled):
+    """
+    The generation manifest's hashes should be worked out as files are
+    written, without reading them back, and match what was written
+    """
+    from pytool import update
+    ptdir = tmpdir.join(".pytool")
+    trgdir = tmpdir.join("project")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        if bundled:
+            pytool.pack_templates(d=False)
+        real = update.file_hash
+        read = []
+
+        def file_hash(path):
+            read.append(path)
+            return real(path)
+        monkeypatch.setattr(update, 'file_hash', file_hash)
+        pytool.create_project(trgdir.strpath, var=["author=Ann"])
+        assert not [x for x in read if x.startswith(trgdir.strpath)]
+        monkeypatch.undo()
+
+        files = update.read_manifest(trgdir.strpath)['files']
+        assert len(files) == 4
+        for target, entry in files.items():
+            assert entry['hash'] == real(trgdir.join(target).strpath)
+        assert files['setup.py']['hash'] != files['setup.py']['source_hash']
+        result = pytool.update_project(trgdir.strpath)
+        assert (result['written'], result['conflicts']) == ([], [])
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_layers(tmpdir, fx_tmpl):
+    """
+    With several directories in templates_dir, each template should come
+    from the highest layer that has it, through a merged index that's
+    reused until a layer changes
+    """
+    ptdir = tmpdir.join(".pytool")
+    team = ptdir.join("team")
+    mine = tmpdir.join("mine")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        team.join("prjdir/README.md").write("# team {{project}}\n",
+                                            ensure=True)
+        team.join("prjdir/test/test_team.py").write("# team\n", ensure=True)
+        team.join("tool.py").write("# team tool\n")
+        mine.join("prjdir/setup.py").write("# mine\n", ensure=True)
+        ptini = ptdir.join(mcat['ptini'])
+        ptini.write("[pytool]\ntemplates_dir = {}:team:{}\n".format(
+            ptdir.join("templates").strpath, mine.strpath))
+        cfg = pytool.initialize()
+
+        trgdir = tmpdir.join("demo")
+        assert cli.run(["project", trgdir.strpath])[0] == 0
+        assert trgdir.join("README.md").read() == "# team demo\n"
+        assert trgdir.join("setup.py").read() == "# mine\n"
+        assert trgdir.join("test/test_team.py").read() == "# team\n"
+        assert trgdir.join("test/test_stub.py").read() == \
+            ptdir.join("templates/prjdir/test/test_stub.py").read()
+        assert cli.run(["tool", tmpdir.join("t.py").strpath])[0] == 0
+        assert tmpdir.join("t.py").read() == "# team tool\n"
+
+        tmpl = pytool.template_layers(cfg)
+        assert pytool.template_layers(cfg) is tmpl
+        mine.join("prjdir/NEWS").write("news\n")
+        assert pytool.template_layers(cfg) is not tmpl
+        assert "NEWS" in [x.path for x in pytool.template_tree(cfg)]
+
+        team.join("prjdir/README.md").write("# team v2\n")
+        result = pytool.update_project(trgdir.strpath)
+        assert sorted(result['written']) == ["NEWS", "README.md"]
+        assert trgdir.join("README.md").read() == "# team v2\n"
+
+        code, _, err = cli.run(["pack-templates"])
+        assert code == 1
+        assert mcat['layered'] in err
+
+
+# -----------------------------------------------------------------------------
+def test_template_cache(tmpdir, fx_tmpl):
+    """
+    With a [cache] section in pytool.ini, templates should be read through
+    local copies that are revalidated against each template's mtime and
+    size, with the least recently used evicted past max_size
+    """
+    from pytool import cache
+    ptdir = tmpdir.join(".pytool")
+    cachedir = tmpdir.join("cache")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        ptini = ptdir.join(mcat['ptini'])
+        ptini.write(ptini.read() +
+                    "[cache]\ndir = {}\nmax_size = 1K\n".format(
+                        cachedir.strpath))
+        cfg = pytool.initialize()
+        local = pytool.template_cache(cfg)
+        nfiles = len([x for x in pytool.template_tree(cfg) if not x.isdir])
+
+        pytool.create_project(tmpdir.join("one").strpath)
+        check_proj_files(ptdir, tmpdir.join("one"), fx_tmpl)
+        assert (local.hits, local.misses) == (0, nfiles)
+        pytool.create_project(tmpdir.join("two").strpath)
+        assert (local.hits, local.misses) == (nfiles, nfiles)
+
+        ptdir.join("templates/prjdir/README.md").write("# v2\n")
+        pytool.create_project(tmpdir.join("three").strpath)
+        assert (local.hits, local.misses) == (2 * nfiles - 1, nfiles + 1)
+        assert tmpdir.join("three/README.md").read() == "# v2\n"
+        assert local.evictions == 0
+
+        # a cache too small for all the templates is trimmed after the run
+        local.limit = 300
+        ptdir.join("templates/prjdir/README.md").write("# v3\n")
+        pytool.create_project(tmpdir.join("four").strpath)
+        check_proj_files(ptdir, tmpdir.join("four"), fx_tmpl)
+        assert local.evictions > 0
+        assert local.usage()[1] <= 300
+
+        code, out, _ = cli.run(["cache", "--clear"])
+        assert code == 0
+        assert cachedir.strpath + ": 0 files" in out
+    assert cache.parse_size("1.5K") == 1536
+    with pytest.raises(ValueError) as err:
+        cache.parse_size("lots")
+    assert mcat['badsize'] in str(err)
+
+
+# -----------------------------------------------------------------------------
+def test_template_cache_overlap(tmpdir):
+    """
+    One run ending shouldn't evict copies another run in the same process
+    may still be reading; they go once no run that could use them is left
+    """
+    import gc
+    from pytool import cache
+    srcs = []
+    for name in ("one", "two", "three"):
+        srcs.append(tmpdir.join(name))
+        srcs[-1].write_binary(b"x" * 100)
+        os.utime(srcs[-1].strpath, (1000, 1000))
+    local = cache.Cache(tmpdir.join("cache").strpath, 150)
+    old = local.fetch(srcs[0].strpath)
+    # a copy last used long ago isn't protected by anything
+    os.utime(old, (1000, 1000))
+
+    first = local.begin()
+    copy = local.fetch(srcs[1].strpath)
+    second = local.begin()
+    local.fetch(srcs[2].strpath)
+    local.trim(second)
+    assert not os.path.exists(old)
+    assert os.path.exists(copy)
+    assert local.evictions == 1
+
+    # a run that never got to trim() stops protecting anything when its
+    # token goes
+    del first
+    gc.collect()
+    local.trim()
+    assert local.usage()[1] <= 150 * cache.LOW_WATER
+    assert local.evictions == 2
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_store_profile(tmpdir, fx_tmpl):
+    """
+    'pytool store NAME DIR' should keep each distinct template content once
+    however many profiles use it, 'pytool project --profile NAME' should
+    generate from the stored profile, and --update should follow the
+    profile without touching the blobs the project was linked to
+    """
+    from pytool import store
+    ptdir = tmpdir.join(".pytool")
+    blobs = ptdir.join(mcat['store'], "blobs")
+    svcdir = tmpdir.join("svc")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        ptdir.join("templates/prjdir").copy(svcdir)
+        svcdir.join("SERVICE").write("svc\n")
+        svcdir.join("SERVICE").chmod(0o444)
+
+        assert cli.run(["store", "lib"])[0] == 0
+        code, out, err = cli.run(["store", "svc", svcdir.strpath])
+        assert (code, err) == (0, "")
+        assert "(1 new, 4 bytes)" in out
+        assert cli.run(["store"]) == (0, "lib\nsvc\n", "")
+        assert len(list(blobs.visit(lambda x: x.isfile()))) == 5
+
+        libdir = tmpdir.join("lib")
+        code, _, err = cli.run(["project", "--profile", "lib",
+                                libdir.strpath])
+        assert (code, err) == (0, "")
+        check_proj_files(ptdir, libdir, fx_tmpl)
+        assert not libdir.join("SERVICE").exists()
+
+        demo = tmpdir.join("demo")
+        code, _, err = cli.run(["project", "--profile", "svc", "--link",
+                                "hard", demo.strpath])
+        assert (code, err) == (0, "")
+        check_proj_files(ptdir, demo, fx_tmpl)
+        assert demo.join("SERVICE").stat().nlink == 2
+
+        svcdir.join("SERVICE").chmod(0o644)
+        svcdir.join("SERVICE").write("svc v2\n")
+        cli.run(["store", "svc", svcdir.strpath])
+        assert pytool.update_project(demo.strpath)['written'] == ["SERVICE"]
+        assert demo.join("SERVICE").read() == "svc v2\n"
+        assert len(list(blobs.visit(lambda x: x.isfile()))) == 6
+        for blob in blobs.visit(lambda x: x.isfile()):
+            assert blob.computehash('sha256') == \
+                blob.dirpath().basename + blob.basename[:62]
+
+        code, _, err = cli.run(["project", "--profile", "nonesuch",
+                                tmpdir.join("x").strpath])
+        assert code == 1
+        assert err == "{}: 'nonesuch'\n".format(mcat['noprof'])
+        assert not tmpdir.join("x").exists()
+        code, _, err = cli.run(["project", "--profile", "../svc",
+                                tmpdir.join("x").strpath])
+        assert (code, err) == (1, "{}: '../svc'\n".format(mcat['badprof']))
+        with pytest.raises(ValueError) as err:
+            store.load(ptdir.join(mcat['store']).strpath, "../svc")
+    assert mcat['badprof'] in str(err)
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_plan(tmpdir, monkeypatch, fx_tmpl):
+    """
+    'pytool project --plan FILE PATH' should write the plan without
+    generating anything, and 'pytool apply FILE ROOT' should generate the
+    project from it in ROOT without loading the config
+    """
+    ptdir = tmpdir.join(".pytool")
+    pfile = tmpdir.join("demo.plan")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        code, _, err = cli.run(["project", "--plan", pfile.strpath, "--var",
+                                "author=Ann", tmpdir.join("demo").strpath])
+        assert (code, err) == (0, "")
+        assert not tmpdir.join("demo").exists()
+        assert cli.run(["project", "--plan", "-", "--var", "author=Ann",
+                        tmpdir.join("demo").strpath])[1] == pfile.read()
+        kinds = [json.loads(x)[0] for x in pfile.readlines()[1:]]
+        assert kinds.count('render') > 0 and kinds.count('copy') > 0
+
+        def no_config():
+            raise AssertionError("apply read the config")
+        monkeypatch.setattr(pytool, 'initialize', no_config)
+        for root in ("a", "b"):
+            code, _, err = cli.run(["apply", pfile.strpath,
+                                    tmpdir.join(root).strpath])
+            assert (code, err) == (0, "")
+            check_proj_files(ptdir, tmpdir.join(root, "demo"),
+                             [x for x in fx_tmpl if "setup.py" not in x])
+            assert "Ann" in tmpdir.join(root, "demo/setup.py").read()
+        monkeypatch.undo()
+
+        result = pytool.update_project(tmpdir.join("a/demo").strpath)
+        assert (result['written'], result['conflicts']) == ([], [])
+        code, _, err = cli.run(["apply", "-", tmpdir.strpath],
+                               stdin=pfile.read())
+        assert (code, err) == (0, "")
+        assert tmpdir.join("demo/setup.py").read() == \
+            tmpdir.join("a/demo/setup.py").read()
+
+        pfile.write("{}\n")
+        code, _, err = cli.run(["apply", pfile.strpath])
+        assert code == 1
+        assert mcat['badplan'] in err
+
+    # on a first run, setting up the config dir mustn't mix its messages
+    # into a plan written to stdout
+    with tbx.envset(PYTOOL_DIR=tmpdir.join("fresh").strpath):
+        code, out, err = cli.run(["project", "--plan", "-",
+                                  tmpdir.join("demo").strpath])
+        assert code == 0
+        assert mcat['stupflz'] in err
+        code, _, err = cli.run(["apply", "-", tmpdir.join("c").strpath],
+                               stdin=out)
+        assert (code, err) == (0, "")
+        assert tmpdir.join("c/demo/setup.py").exists()
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_project_var(tmpdir):
+    """
+    {{name}} placeholders in the templates should be filled in from the
+    project name, pytool.ini's [variables] section, and --var, in one pass;
+    names aren't case sensitive, '%' in a value is taken literally, unknown
+    ones are left alone and bad --var values are rejected
+    """
+    ptdir = tmpdir.join(".pytool")
+    trgdir = tmpdir.join("demo")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        ptini = ptdir.join(mcat['ptini'])
+        ptini.write(ptini.read() + "[variables]\nauthor = Ini Author\n"
+                    "author_email = ini@example.com\n"
+                    "Coverage = 100% of %(author)s\n")
+        ptdir.join("templates/prjdir/NOTES").write("{{nonesuch}} {{ project }}"
+                                                   " {{Coverage}} {{Team}}\n")
+        pytool.make_project(d=False, jobs='4', var=["author=Ann Author",
+                                                    "TEAM=core"],
+                            PATH=trgdir.strpath)
+        setup = trgdir.join("setup.py").read()
+        assert 'name="demo"' in setup
+        assert 'author="Ann Author"' in setup
+        assert 'author_email="ini@example.com"' in setup
+        assert "'demo = demo:main'" in setup
+        assert "{{" not in setup
+        assert trgdir.join("NOTES").read() == \
+            "{{nonesuch}} demo 100% of %(author)s core\n"
+
+        saved = json.loads(trgdir.join(mcat['genmani']).read())
+        assert saved['variables']['author'] == "Ann Author"
+
+        # a changed template is rendered with the recorded variables
+        src = ptdir.join("templates/prjdir/setup.py")
+        src.write(src.read() + "# by {{author}}\n")
+        assert pytool.update_project(trgdir.strpath)['written'] == \
+            ["setup.py"]
+        assert trgdir.join("setup.py").read().endswith("# by Ann Author\n")
+
+        with pytest.raises(ValueError) as err:
+            pytool.make_tool(d=False, var=["author"],
+                             PATH=tmpdir.join("tool.py").strpath)
+    assert mcat['badvar'] in str(err)
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_generate(tmpdir, fx_tmpl):
+    """
+    pytool.generate() should return the rendered files in memory, matching
+    what create_project() writes to disk, and write nothing itself
+    """
+    ptdir = tmpdir.join(".pytool")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        with tmpdir.as_cwd():
+            files = pytool.generate('project', "demo")
+            assert tmpdir.listdir() == [ptdir]
+            pytool.create_project("demo")
+        assert sorted(files) == sorted(
+            x.relto(tmpdir) for x in tmpdir.join("demo").visit()
+            if x.isfile())
+        for path, content in files.items():
+            assert tmpdir.join(path).read_binary() == content
+        assert 'name="demo"' in files["demo/setup.py"].decode()
+
+        files = pytool.generate('tool', "mytool.py", var=["author=Me"])
+        assert list(files) == ["mytool.py"]
+        assert files["mytool.py"] == \
+            ptdir.join("templates/tool.py").read_binary()
+
+        with pytest.raises(ValueError):
+            pytool.generate('nonesuch', "x")
+
+
+# -----------------------------------------------------------------------------
+def test_fs_backends(tmpdir):
+    """
+    setup_config_dir() into a MemoryFS shouldn't touch the disk; an
+    OverlayFS should read through to the disk and keep its writes in memory
+    """
+    ptdir = tmpdir.join(".pytool")
+    mem = fs.MemoryFS()
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.setup_config_dir(fs=mem)
+    assert not ptdir.exists()
+    assert mem.isdir(ptdir.join("templates/prjdir/test").strpath)
+    assert mem.read(ptdir.join("templates/tool.py").strpath) == \
+        pytool.file_tool_py().encode()
+    with pytest.raises(FileExistsError):
+        mem.makedirs(ptdir.join("templates/tool.py/sub").strpath)
+
+    tmpdir.join("base.txt").write("base\n")
+    ovl = fs.OverlayFS()
+    ovl.makedirs(tmpdir.join("new").strpath)
+    ovl.write(tmpdir.join("new/file").strpath, b"new\n")
+    assert ovl.read(tmpdir.join("base.txt").strpath) == b"base\n"
+    assert ovl.isdir(tmpdir.strpath)
+    assert ovl.dirs == {tmpdir.join("new").strpath}
+    assert list(ovl.files) == [tmpdir.join("new/file").strpath]
+    assert not tmpdir.join("new").exists()
+
+
+# -----------------------------------------------------------------------------
+def test_aio_generate(tmpdir, fx_tmpl):
+    """
+    The aio coroutines should produce the same files as the sync functions,
+    many at once, on a bounded executor
+    """
+    ptdir = tmpdir.join(".pytool")
+
+    async def many():
+        await asyncio.gather(
+            *[aio.create_project(tmpdir.join("proj%d" % idx).strpath)
+              for idx in range(6)],
+            aio.create_program(tmpdir.join("prog.py").strpath),
+            aio.create_tool(tmpdir.join("tool.py").strpath))
+
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        asyncio.run(many())
+    for idx in range(6):
+        check_proj_files(ptdir, tmpdir.join("proj%d" % idx), fx_tmpl)
+    for name in ("prog.py", "tool.py"):
+        assert ptdir.join("templates", name).read() == \
+            tmpdir.join(name).read()
+
+
+# -----------------------------------------------------------------------------
+def test_aio_cancel(tmpdir):
+    """
+    Cancelling an aio generation should wait for the writes in progress and
+    then remove the partial project
+    """
+    ptdir = tmpdir.join(".pytool")
+    trgdir = tmpdir.join("proj")
+    started = threading.Event()
+    gate = threading.Event()
+
+    class SlowFS(fs.LocalFS):
+        def place(self, src, dst, **kwa):
+            started.set()
+            gate.wait(10)
+            return super(SlowFS, self).place(src, dst, **kwa)
+
+    async def cancelled():
+        task = asyncio.ensure_future(aio.create_project(trgdir.strpath,
+                                                        fs=SlowFS()))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        assert trgdir.isdir()
+        task.cancel()
+        gate.set()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        asyncio.run(cancelled())
+    assert not trgdir.exists()
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("link", ['hard', 'auto'])
+def test_pytool_project_link(tmpdir, fx_tmpl, link):
+    """
+    'pytool project --link MODE PATH' should hard link (or clone) read-only
+    templates and never hard link writable ones
+    """
+    ptdir = tmpdir.join(".pytool")
+    trgdir = tmpdir.join("project")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        rdonly = ptdir.join("templates/prjdir/test/test_stub.py")
+        rdonly.chmod(0o444)
+        pytool.make_project(d=False, jobs='4', link=link, PATH=trgdir.strpath)
+    check_proj_files(ptdir, trgdir, fx_tmpl)
+
+    writable = ptdir.join("templates/prjdir/setup.py")
+    assert not os.path.samefile(writable.strpath,
+                                trgdir.join("setup.py").strpath)
+    if link == 'hard':
+        assert os.path.samefile(rdonly.strpath,
+                                trgdir.join("test/test_stub.py").strpath)
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("cmd", ['project', 'program', 'tool'])
+def test_pytool_link_bogus(tmpdir, cmd):
+    """
+    An unknown --link mode should be reported before anything is written
+    """
+    trg = tmpdir.join("demo")
+    with tbx.envset(PYTOOL_DIR=tmpdir.join(".pytool").strpath):
+        pytool.initialize()
+        code, out, err = cli.run([cmd, "--link", "bogus", trg.strpath])
+        assert (code, out) == (1, "")
+        assert err == "{}: 'bogus'\n".format(mcat['badlink'])
+        assert not trg.exists()
+        with pytest.raises(ValueError):
+            pytool.create_project(trg.strpath, link='bogus')
+        assert not trg.exists()
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_project_link_regen(tmpdir, fx_tmpl):
+    """
+    Generating over a project made with --link hard should write new files,
+    not truncate the templates they were linked to
+    """
+    ptdir = tmpdir.join(".pytool")
+    trgdir = tmpdir.join("project")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        rdonly = ptdir.join("templates/prjdir/test/test_stub.py")
+        rdonly.chmod(0o444)
+        before = rdonly.read_binary()
+        pytool.make_project(d=False, jobs='4', link='hard',
+                            PATH=trgdir.strpath)
+        assert rdonly.stat().nlink == 2
+        pytool.make_project(d=False, jobs='4', PATH=trgdir.strpath)
+    assert rdonly.read_binary() == before
+    assert rdonly.stat().nlink == 1
+    assert trgdir.join("test/test_stub.py").read_binary() == before
+    check_proj_files(ptdir, trgdir, fx_tmpl)
+
+
+# -----------------------------------------------------------------------------
+def test_manifest_cache(tmpdir):
+    """
+    manifest.load() should save the manifest in the cache dir, reuse it while
+    the template directories are unchanged, and rebuild it when an entry is
+    added
+    """
+    root = tmpdir.join("prjdir")
+    root.join("prjdir/__init__.py").ensure()
+    root.join("setup.py").write("setup()\n")
+    cache = tmpdir.join("cache")
+
+    entries = manifest.load(root.strpath, cachedir=cache.strpath)
+    assert [(x.path, x.isdir) for x in entries] == [
+        ("prjdir", True),
+        ("prjdir/__init__.py", False),
+        ("setup.py", False),
+        ]
+    assert entries[2].size == len("setup()\n")
+    mpath = py.path.local(manifest.manifest_path(root.strpath, cache.strpath))
+    assert mpath.exists()
+
+    # a fresh process would find the saved manifest and not re-walk
+    manifest.invalidate()
+    assert manifest.load(root.strpath, cachedir=cache.strpath) == entries
+
+    root.join("prjdir/extra.py").ensure()
+    entries = manifest.load(root.strpath, cachedir=cache.strpath)
+    assert "prjdir/extra.py" in [x.path for x in entries]
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.parametrize("pool", ['thread', 'process'])
+def test_pytool_batch(tmpdir, fx_tmpl, pool):
+    """
+    Test 'pytool batch': good jobs are run, bad jobs are reported without
+    stopping the rest
+    """
+    ptdir = tmpdir.join(".pytool")
+    jobs = [json.dumps({'command': 'project',
+                        'path': tmpdir.join("proj").strpath}),
+            json.dumps({'command': 'tool',
+                        'path': tmpdir.join("tool.py").strpath}),
+            json.dumps({'command': 'nonesuch',
+                        'path': tmpdir.join("bad").strpath}),
+            "not json",
+            ]
+    out = io.StringIO()
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        failed = batch.run_batch(jobs, out=out, jobs=2, pool=pool)
+    assert failed == 2
+
+    results = sorted([json.loads(x) for x in out.getvalue().splitlines()],
+                     key=lambda x: x['job'])
+    assert [x['job'] for x in results] == [0, 1, 2, 3]
+    assert [x['ok'] for x in results] == [True, True, False, False]
+    assert mcat['badjob'] in results[2]['error']
+    assert all(x['elapsed'] >= 0 for x in results)
+
+    check_proj_files(ptdir, tmpdir.join("proj"), fx_tmpl)
+    assert ptdir.join("templates/tool.py").read() == \
+        tmpdir.join("tool.py").read()
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_batch_stream(tmpdir, monkeypatch):
+    """
+    'pytool batch' should write each result while the input is still open,
+    and read only a few jobs ahead of the workers
+    """
+    out = io.StringIO()
+    read = []
+
+    def lines():
+        for idx in range(20):
+            read.append(idx)
+            yield json.dumps({'command': 'tool',
+                              'path': tmpdir.join("t{}.py".format(idx))
+                              .strpath})
+            # don't send the next job until this one's result is out
+            deadline = time.time() + 10
+            while out.getvalue().count("\n") <= idx:
+                assert time.time() < deadline
+                time.sleep(0.01)
+
+    with tbx.envset(PYTOOL_DIR=tmpdir.join(".pytool").strpath):
+        assert batch.run_batch(lines(), out=out, jobs=2) == 0
+        assert len(out.getvalue().splitlines()) == 20
+
+        # with the workers stuck, reading stops once the window is full
+        gate = threading.Event()
+        real = batch.run_job
+        monkeypatch.setattr(batch, 'run_job',
+                            lambda *a: gate.wait() and real(*a))
+        del read[:]
+        runner = threading.Thread(target=batch.run_batch,
+                                  args=(iter(read.append(x) or x
+                                             for x in ["{}"] * 100),
+                                        io.StringIO(), 2))
+        runner.start()
+        time.sleep(0.5)
+        assert len(read) == 2 * batch.WINDOW + 1
+        gate.set()
+        runner.join()
+        assert len(read) == 100
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_pack_templates(tmpdir, fx_tmpl):
+    """
+    After 'pytool pack-templates', generation should read from the bundle,
+    and the bundle should be repacked when a template is newer than it
+    """
+    ptdir = tmpdir.join(".pytool")
+    pbundle = ptdir.join(mcat['bundle'])
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.pack_templates(d=False)
+        assert pbundle.exists()
+        bnd = bundle.Bundle(pbundle.strpath)
+        assert "prjdir/setup.py" in bnd.index
+        assert bytes(bnd.data("tool.py")) == \
+            ptdir.join("templates/tool.py").read_binary()
+        bnd.close()
+
+        trgdir = tmpdir.join("project")
+        pytool.make_project(d=False, jobs='4', PATH=trgdir.strpath)
+        check_proj_files(ptdir, trgdir, fx_tmpl)
+
+        src = ptdir.join("templates/prog.py")
+        src.write(src.read() + "# An extra comment at the end.\n")
+        os.utime(src.strpath, (pbundle.mtime() + 10, pbundle.mtime() + 10))
+        trg = tmpdir.join("example.py")
+        pytool.make_program(d=False, PATH=trg.strpath)
+        assert src.read() == trg.read()
+
+
+# -----------------------------------------------------------------------------
+def test_render_memo_stale(tmpdir):
+    """
+    A changed template's cached plan, and the plans (and so the mapping) of
+    a replaced bundle, should be dropped rather than kept forever
+    """
+    import gc
+    import weakref
+    ptdir = tmpdir.join(".pytool")
+    tmpl = ptdir.join("templates/tool.py")
+    pbundle = ptdir.join(mcat['bundle'])
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.initialize()
+        for count in range(3):
+            tmpl.write("# {{project}} v%d\n" % count)
+            os.utime(tmpl.strpath, (count, count))
+            plan = render.plan_for_file(tmpl.strpath)
+            assert bytes(plan.data) == tmpl.read_binary()
+            assert [x for x in render._memo if tmpl.strpath in x] == \
+                [tmpl.strpath]
+
+        pytool.pack_templates(d=False)
+        old = bundle.current(ptdir.join("templates").strpath,
+                             pbundle.strpath)
+        assert old.plan("tool.py")
+        gone = weakref.ref(old)
+        del old
+        tmpl.write("# {{project}} repacked\n")
+        os.utime(tmpl.strpath, (pbundle.mtime() + 10, pbundle.mtime() + 10))
+        new = bundle.current(ptdir.join("templates").strpath,
+                             pbundle.strpath)
+        assert bytes(new.plan("tool.py").data) == tmpl.read_binary()
+        gc.collect()
+        assert gone() is None
+        assert [stamp for ident, (stamp, _) in render._memo.items()
+                if ident[0] == pbundle.strpath] == [new.stamp]
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_serve(tmpdir, fx_tmpl):
+    """
+    A 'pytool serve' daemon should handle --client requests from its own
+    user on a socket no one else can use, and a client with no daemon to
+    talk to should do the work itself
+    """
+    ptdir = tmpdir.join(".pytool")
+    sock = tmpdir.join("pt.sock")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath, PYTOOL_SOCKET=sock.strpath):
+        daemon = server.make_server()
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            assert stat.S_IMODE(sock.stat().mode) == 0o600
+            result = server.request({'command': 'project',
+                                     'path': tmpdir.join("proj").strpath})
+            assert result['ok']
+            check_proj_files(ptdir, tmpdir.join("proj"), fx_tmpl)
+
+            # another user's connection is dropped unserved
+            if hasattr(socket, 'SO_PEERCRED'):
+                daemon.uid = os.getuid() + 1
+                assert server.request({
+                    'command': 'tool',
+                    'path': tmpdir.join("other.py").strpath}) is None
+                assert not tmpdir.join("other.py").exists()
+                daemon.uid = os.getuid()
+
+            with pytest.raises(FileExistsError):
+                server.make_server()
+        finally:
+            daemon.shutdown()
+            daemon.server_close()
+            thread.join()
+        sock.remove()
+
+        assert server.request({'command': 'tool', 'path': 'x'}) is None
+        trg = tmpdir.join("tool.py")
+        pytool.make_tool(d=False, client=True, PATH=trg.strpath)
+        assert trg.read() == ptdir.join("templates/tool.py").read()
+
+
 # -----------------------------------------------------------------------------
 def test_version():
     """
     Test 'pytool version'
     """
-    result = tbx.run("pytool version")
-    assert mcat['trace'] not in result.decode()
-    assert re.findall("pytool version \d+\.\d+\.\d+", result.decode())
+    code, result, err = cli.run(["version"])
+    assert code == 0
+    assert mcat['trace'] not in result + err
+    assert re.findall("pytool version \d+\.\d+\.\d+", result)
+
+
+# -----------------------------------------------------------------------------
+def test_cli_run(tmpdir, fx_tmpl):
+    """
+    cli.run() should run commands in this process, returning the exit code
+    and output instead of printing, and leave sys.argv alone
+    """
+    argv = list(sys.argv)
+    ptdir = tmpdir.join(".pytool")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        for _ in range(200):
+            assert cli.run(["version"]) == (
+                0, "pytool version {}\n".format(version.__version__), "")
+
+        code, out, err = cli.run(["--help"])
+        assert (code, err) == (0, "")
+        assert out.strip() == pytool.__doc__.strip()
+
+        code, out, err = cli.run(["nonesuch"])
+        assert (code, out) == (1, "")
+        assert "Usage:" in err
+
+        trgdir = tmpdir.join("proj")
+        code, out, err = cli.run(["project", trgdir.strpath])
+        assert (code, err) == (0, "")
+        assert mcat['stupflz'] in out
+        check_proj_files(ptdir, trgdir, fx_tmpl)
+
+        code, out, err = cli.run(["project",
+                                  trgdir.join("setup.py", "sub").strpath])
+        assert (code, out) == (1, "")
+        assert mcat['trace'] in err
+        assert "NotADirectoryError" in err
+
+        job = json.dumps({'command': 'tool',
+                          'path': tmpdir.join("tool.py").strpath})
+        code, out, err = cli.run(["batch", "-"], stdin=job + "\n")
+        assert (code, err) == (0, "")
+        assert json.loads(out)['ok']
+        assert tmpdir.join("tool.py").read() == \
+            ptdir.join("templates/tool.py").read()
+    assert sys.argv == argv
+
+
+# -----------------------------------------------------------------------------
+def test_cli_run_streams(tmpdir, monkeypatch):
+    """
+    cli.run() should hand the command its own streams instead of swapping
+    sys.stdout, sys.stderr, and sys.stdin, so calls on several threads run
+    at the same time, each getting back just its own output
+    """
+    real = io.StringIO()
+    for name in ('stdout', 'stderr', 'stdin'):
+        monkeypatch.setattr(sys, name, real)
+    barrier = threading.Barrier(4, timeout=10)
+    seen = []
+    show_version = pytool._commands['version']
+
+    def gated(**kwa):
+        seen.append((sys.stdout, sys.stderr, sys.stdin))
+        barrier.wait()
+        return show_version(**kwa)
+    monkeypatch.setitem(pytool._commands, 'version', gated)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        cli.run(["version"]))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [(0, "pytool version {}\n".format(version.__version__),
+                        "")] * 4
+    assert seen == [(real, real, real)] * 4
+
+    with tbx.envset(PYTOOL_DIR=tmpdir.join(".pytool").strpath):
+        code, out, err = cli.run(["project", "--trace",
+                                  tmpdir.join("demo").strpath])
+    assert (code, real.getvalue()) == (0, "")
+    assert mcat['stupflz'] in out
+    assert '"event": "counters"' in err
+
+
+# -----------------------------------------------------------------------------
+def test_pytool_bench(tmpdir):
+    """
+    'pytool bench' should run the cases in the benchmarks directory and
+    report their timings as JSON; compare() should flag slower cases
+    """
+    with tbx.envset(PYTOOL_DIR=tmpdir.join("unused").strpath):
+        pytool.run_bench(d=False, suite=None, sizes="10", repeat='2',
+                         k="[is]*", o=tmpdir.join("report.json").strpath)
+    assert not tmpdir.join("unused").exists()
+    report = json.loads(tmpdir.join("report.json").read())
+    assert report['pytool'] == version.__version__
+    names = [x['name'] for x in report['results']]
+    assert "initialize.existing" in names
+    assert "setup_config_dir" in names
+    assert "startup.version.cold" in names
+    assert "create_project.copy" not in names
+    for result in report['results']:
+        assert len(result['times']) == 2
+        assert result['min'] <= result['median']
+
+    slow = json.loads(json.dumps(report))
+    for result in slow['results']:
+        result['median'] *= 2
+    lines = bench.compare(report, slow)
+    assert len(lines) == len(names)
+    assert all(mcat['slower'] in x for x in lines)
+    assert not any(mcat['slower'] in x for x in bench.compare(slow, report))
+
+    with pytest.raises(FileNotFoundError) as err:
+        bench.run(tmpdir.strpath)
+    assert mcat['nobench'] in str(err)
+
+
+# -----------------------------------------------------------------------------
+def test_bench_create_project(tmpdir):
+    """
+    The create_project benchmarks should generate from a synthetic tree,
+    timing it and counting its system calls
+    """
+    report = bench.run(sizes=[25], repeat=1, pattern="create_project.*")
+    assert [(x['name'], x['params']) for x in report['results']] == [
+        ("create_project.copy", {'files': 25}),
+        ("create_project.hard", {'files': 25}),
+        ("create_project.est_syscalls", {'files': 25, 'walk': 'cold'}),
+        ("create_project.est_syscalls", {'files': 25, 'walk': 'warm'}),
+        ]
+    cold, warm = [x['median'] for x in report['results'][2:]]
+    assert cold > warm > 25
+    assert not trace.enabled
+
+
+# -----------------------------------------------------------------------------
+def test_trace(tmpdir, fx_tmpl):
+    """
+    With tracing on, generation should write a span for each phase, a file
+    record for each file written, and the counter totals at the end. With it
+    off, nothing should be written.
+    """
+    ptdir = tmpdir.join(".pytool")
+    out = tmpdir.join("trace.jsonl")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.invalidate_config()
+        with tbx.envset(PYTOOL_TRACE=out.strpath):
+            trace.configure_from_env()
+        try:
+            assert trace.enabled
+            pytool.create_project(tmpdir.join("proj").strpath)
+        finally:
+            trace.close()
+        assert not trace.enabled
+        pytool.create_project(tmpdir.join("quiet").strpath)
+
+    records = [json.loads(x) for x in out.read().splitlines()]
+    spans = [x['name'] for x in records if x['event'] == 'span']
+    for name in ('cfgdir', 'ini_path', 'setup_config_dir', 'initialize',
+                 'walk', 'mkdir', 'copy', 'record', 'create_project'):
+        assert name in spans
+    files = [x for x in records if x['event'] == 'file'
+             and x['path'].startswith(tmpdir.join("proj").strpath)]
+    written = [x for x in tmpdir.join("proj").visit() if x.isfile()]
+    assert len(files) == len(written)
+    assert all(x['est_syscalls'] > 0 for x in files)
+    assert records[-1]['event'] == 'counters'
+    assert records[-1]['bytes'] == sum(x['bytes'] for x in records
+                                       if x['event'] == 'file')
+    assert "quiet" not in out.read()
+
+
+# -----------------------------------------------------------------------------
+def test_makedirs_tree(tmpdir, monkeypatch):
+    """
+    LocalFS.makedirs_tree() should make the top directory with makedirs()
+    and each one below it with a single mkdir, once, and still complain
+    about a file in the way
+    """
+    made = []
+    real = os.mkdir
+
+    def mkdir(path, *args):
+        made.append(path)
+        return real(path, *args)
+    monkeypatch.setattr(os, 'mkdir', mkdir)
+    top = tmpdir.join("a", "proj").strpath
+    dirs = [top] + [os.path.join(top, x)
+                    for x in ("d1", "d1/e", "d2", "d1", "d2/f/..")]
+    fs.LocalFS().makedirs_tree(dirs)
+    assert made.count(top) == 1
+    for sub in ("d1", "d1/e", "d2"):
+        assert made.count(os.path.join(top, sub)) == 1
+        assert tmpdir.join("a", "proj", sub).isdir()
+    assert len(made) == 5
+
+    # a second pass over an existing tree is harmless
+    fs.LocalFS().makedirs_tree(dirs)
+    tmpdir.join("a", "proj", "d3").write("")
+    with pytest.raises(FileExistsError):
+        fs.LocalFS().makedirs_tree([top, os.path.join(top, "d3")])
+
+
+# -----------------------------------------------------------------------------
+def test_version_import_budget():
+    """
+    'pytool version' should not import the modules only needed for
+    generation or debugging. What gets imported is checked rather than how
+    long it takes, which depends on how busy the machine is.
+    """
+    script = ("import sys; sys.argv = ['pytool', 'version']; "
+              "import pytool; pytool.main(); "
+              "print(' '.join(sorted(sys.modules)))")
+    proc = subprocess.run([sys.executable, "-c", script],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out = proc.stdout.decode().splitlines()
+    assert out[0].startswith("pytool version")
+    loaded = set(out[1].split())
+    assert 'pytool' in loaded
+
+    for heavy in ['configparser', 'py', 'pdb', 'concurrent.futures',
+                  'json', 'mmap', 'hashlib', 'asyncio', 'socketserver',
+                  'tarfile', 'zipfile', 'pytool.aio', 'pytool.batch',
+                  'pytool.bundle', 'pytool.cache', 'pytool.compress',
+                  'pytool.copier', 'pytool.fs', 'pytool.manifest',
+                  'pytool.render', 'pytool.server', 'pytool.store',
+                  'pytool.update']:
+        assert heavy not in loaded, "{} imported".format(heavy)
 
 
 # -----------------------------------------------------------------------------
@@ -557,6 +1944,24 @@ def test_content(func, snips):
         assert mcat[item] in content
 
 
+# -----------------------------------------------------------------------------
+def test_builtin_fresh(tmpdir):
+    """
+    The shipped defaults.json should be exactly what the build_* functions
+    assemble from mcat (run 'make defaults' if not), and setup_config_dir()
+    should write those bytes
+    """
+    assert builtin.files() == builtin.build()
+    ptdir = tmpdir.join(".pytool")
+    with tbx.envset(PYTOOL_DIR=ptdir.strpath):
+        pytool.setup_config_dir()
+    for relpath, content in builtin.files().items():
+        if relpath != mcat['ptini']:
+            assert ptdir.join(relpath).read_binary() == content.encode()
+    assert ptdir.join(mcat['ptini']).read() == \
+        builtin.build_pytool_ini().replace(builtin.CFGDIR, ptdir.strpath)
+
+
 # -----------------------------------------------------------------------------
 def test_deployable():
     """
@@ -582,10 +1987,11 @@ def test_deployable():
 # -----------------------------------------------------------------------------
 def check_proj_files(srcdir, trgdir, flist):
     """
-    Check that 'prjdir' files in flist were copied properly from srcdir to
-    trgdir
+    Check that 'prjdir' files in flist were copied (or rendered, with the
+    default variables) properly from srcdir to trgdir
     """
     trgroot = py.path.local(trgdir.dirname)
+    variables = render.variables(None, trgdir.basename)
     plist = [(d, d.replace('templates/prjdir', trgdir.basename))
              for d in flist if 'prjdir' in d]
     for sname, tname in plist:
@@ -593,7 +1999,11 @@ def check_proj_files(srcdir, trgdir, flist):
         if src.isdir():
             continue
         trg = trgroot.join(tname.replace('prjdir', trgdir.basename))
-        assert src.read() == trg.read()
+        plan = render.compile_template(src.read_binary())
+        if plan:
+            assert render.render_bytes(plan, variables) == trg.read_binary()
+        else:
+            assert src.read() == trg.read()
 
 
 # -----------------------------------------------------------------------------